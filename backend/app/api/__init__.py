@@ -2,5 +2,8 @@
 from app.api.predict import router as predict_router
 from app.api.history import router as history_router
 from app.api.auth import router as auth_router
+from app.api.admin import router as admin_router
+from app.api.images import router as images_router
+from app.api.jobs import router as jobs_router
 
-__all__ = ["predict_router", "history_router", "auth_router"]
\ No newline at end of file
+__all__ = ["predict_router", "history_router", "auth_router", "admin_router", "images_router", "jobs_router"]
\ No newline at end of file
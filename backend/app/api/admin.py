@@ -0,0 +1,48 @@
+"""
+模型管理 API 路由
+查看模型注册表、热切换模型版本（仅管理员）
+"""
+from dataclasses import asdict
+from fastapi import APIRouter, Depends, HTTPException
+
+from app.api.deps import get_current_superuser
+from app.services.ai_service import ModelSwapInProgressError, ai_service
+from app.services.model_registry import model_registry
+
+router = APIRouter(
+    prefix="/api/admin",
+    tags=["模型管理"],
+    dependencies=[Depends(get_current_superuser)],
+)
+
+
+@router.get("/models")
+async def list_models():
+    """列出注册表中的模型版本及当前切换状态"""
+    model_registry.reload()
+    return {
+        "active": model_registry.active_version,
+        "loaded": ai_service.model_version,
+        "has_manifest": model_registry.has_manifest,
+        "models": [asdict(spec) for spec in model_registry.list()],
+        "model_swap": ai_service.readiness()["model_swap"],
+    }
+
+
+@router.post("/models/{version}/activate", status_code=202)
+async def activate_model(version: str):
+    """
+    切换到指定模型版本
+    
+    在后台加载并预热新模型，完成后原子替换；切换期间请求继续由旧模型处理。
+    通过 GET /api/admin/models 或 /ready 查看切换进度。
+    """
+    if not ai_service.is_ready:
+        raise HTTPException(status_code=503, detail="模型加载中，请稍后重试")
+    try:
+        ai_service.start_model_swap(version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"模型版本不存在: {version}")
+    except ModelSwapInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"success": True, "target": version, "status": "loading"}
@@ -2,17 +2,24 @@
 历史记录 API 路由
 查询识别历史
 """
-from datetime import date, datetime, timedelta
-from fastapi import APIRouter, Depends, Query, HTTPException
+import base64
+from datetime import date, datetime, time, timedelta
+from fastapi import APIRouter, Depends, Query, HTTPException, Response
 from pydantic import BaseModel
-from sqlalchemy import select, func, delete, and_
+from sqlalchemy import select, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
 from app.core.database import get_db
 from app.models.prediction import PredictionRecord
-from app.schemas.prediction import PredictionHistoryResponse
-import os
+from app.schemas.prediction import (
+    BulkDeleteJobResponse,
+    PredictionHistoryResponse,
+    SimilarCase,
+    SimilarCasesResponse,
+)
+from app.services import bulk_delete, stats_rollup
+from app.services.embedding_index import embedding_index
 
 router = APIRouter(prefix="/api", tags=["历史记录"])
 
@@ -21,19 +28,101 @@ class BatchDeleteRequest(BaseModel):
     ids: list[int]
 
 
+def _encode_cursor(record: PredictionRecord) -> str:
+    raw = f"{record.created_at.isoformat()}|{record.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, _, record_id = raw.partition("|")
+        return datetime.fromisoformat(created_at), int(record_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+
+def _history_filters(
+    predicted_class: str | None,
+    crop: str | None,
+    status: str | None,
+    keyword: str | None,
+    start_date: date | None,
+    end_date: date | None,
+    min_confidence: float | None,
+    max_confidence: float | None,
+) -> list:
+    """历史记录筛选条件（均直接作用于索引列，不对列套函数）"""
+    conditions = []
+    if predicted_class:
+        conditions.append(PredictionRecord.predicted_class == predicted_class)
+    if crop:
+        conditions.append(PredictionRecord.crop == crop)
+    if status:
+        conditions.append(PredictionRecord.is_healthy == (status == "healthy"))
+    if keyword:
+        # 前端把类别名显示为 "Crop - Disease name"，还原为原始写法再匹配
+        keyword = keyword.strip().replace(" - ", "___").replace(" ", "_")
+        conditions.append(PredictionRecord.predicted_class.icontains(keyword, autoescape=True))
+    if start_date:
+        conditions.append(PredictionRecord.created_at >= datetime.combine(start_date, time.min))
+    if end_date:
+        conditions.append(PredictionRecord.created_at < datetime.combine(end_date + timedelta(days=1), time.min))
+    if min_confidence is not None:
+        conditions.append(PredictionRecord.confidence >= min_confidence)
+    if max_confidence is not None:
+        conditions.append(PredictionRecord.confidence <= max_confidence)
+    return conditions
+
+
 @router.get("/history", response_model=list[PredictionHistoryResponse])
 async def get_history(
-    skip: int = Query(0, ge=0, description="跳过记录数"),
+    response: Response,
+    skip: int = Query(0, ge=0, description="跳过记录数（偏移分页，深分页较慢）"),
     limit: int = Query(20, ge=1, le=100, description="返回记录数"),
+    cursor: str | None = Query(None, description="游标分页：上一页响应头 X-Next-Cursor 的值"),
+    predicted_class: str | None = Query(None, description="按类别筛选"),
+    crop: str | None = Query(None, description="按作物筛选"),
+    status: str | None = Query(None, pattern="^(healthy|diseased)?$", description="healthy / diseased"),
+    keyword: str | None = Query(None, description="类别名称关键词"),
+    start_date: date | None = Query(None, description="开始日期 YYYY-MM-DD"),
+    end_date: date | None = Query(None, description="结束日期 YYYY-MM-DD（含）"),
+    min_confidence: float | None = Query(None, ge=0, le=1, description="最低置信度"),
+    max_confidence: float | None = Query(None, ge=0, le=1, description="最高置信度"),
     db: AsyncSession = Depends(get_db)
 ):
-    """获取识别历史记录"""
-    query = select(PredictionRecord).order_by(
-        PredictionRecord.created_at.desc()
-    ).offset(skip).limit(limit)
+    """
+    获取识别历史记录（按识别时间倒序）
+    
+    支持两种分页方式：
+    - 偏移分页：skip + limit（兼容旧接口）
+    - 游标分页：首页不带 cursor，之后把响应头 X-Next-Cursor 作为 cursor 传入；
+      按 (created_at, id) 索引定位，任意深度的翻页耗时相同
+    """
+    if cursor and skip:
+        raise HTTPException(status_code=400, detail="cursor 与 skip 不能同时使用")
+    
+    conditions = _history_filters(
+        predicted_class, crop, status, keyword, start_date, end_date, min_confidence, max_confidence
+    )
+    if cursor:
+        cursor_created_at, cursor_id = _decode_cursor(cursor)
+        conditions.append(
+            tuple_(PredictionRecord.created_at, PredictionRecord.id) < tuple_(cursor_created_at, cursor_id)
+        )
+    
+    query = select(PredictionRecord).where(*conditions).order_by(
+        PredictionRecord.created_at.desc(), PredictionRecord.id.desc()
+    ).limit(limit)
+    if skip:
+        query = query.offset(skip)
     
     result = await db.execute(query)
-    return result.scalars().all()
+    records = result.scalars().all()
+    # 满页时给出下一页游标（偏移分页的响应同样提供，可随时切换为游标分页）
+    if len(records) == limit:
+        response.headers["X-Next-Cursor"] = _encode_cursor(records[-1])
+    return records
 
 
 @router.get("/history/{id}", response_model=PredictionHistoryResponse)
@@ -46,33 +135,81 @@ async def get_history_detail(id: int, db: AsyncSession = Depends(get_db)):
     return record
 
 
+@router.get("/history/{id}/similar", response_model=SimilarCasesResponse)
+async def get_similar_history(
+    id: int,
+    limit: int = Query(10, ge=1, le=50, description="返回记录数"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    查找与该记录图片相似的历史病例
+
+    在同一模型版本保存的倒数第二层特征中做余弦相似度 Top-k 检索（需要开启 EMBEDDING_INDEX_ENABLED）；
+    与该记录共用同一张图片的记录（重复上传）不计入结果。
+    """
+    record = await db.get(PredictionRecord, id)
+    if not record:
+        raise HTTPException(status_code=404, detail="记录不存在")
+    if not settings.EMBEDDING_INDEX_ENABLED or not record.model_version:
+        raise HTTPException(status_code=404, detail="该记录没有保存图片特征")
+
+    # 命中预测缓存的记录没有单独提取特征，使用同一张图片、同一模型版本的其他记录的特征
+    same_image = (await db.execute(
+        select(PredictionRecord.id).where(
+            PredictionRecord.image_path == record.image_path,
+            PredictionRecord.model_version == record.model_version,
+        ).order_by(PredictionRecord.id)
+    )).scalars().all()
+    query_ids = [id, *(other for other in same_image if other != id)]
+    # 多取一些候选：已删除的记录和共用同一张图片的记录会被过滤掉
+    matches = await embedding_index.search(record.model_version, query_ids, limit * 2 + len(query_ids))
+    if matches is None:
+        raise HTTPException(status_code=404, detail="该记录没有保存图片特征")
+
+    candidates = {
+        candidate.id: candidate
+        for candidate in (await db.execute(
+            select(PredictionRecord).where(PredictionRecord.id.in_([match_id for match_id, _ in matches]))
+        )).scalars().all()
+    }
+    results = []
+    for match_id, similarity in matches:
+        candidate = candidates.get(match_id)
+        if candidate is None or candidate.image_path == record.image_path:
+            continue
+        results.append(SimilarCase(
+            similarity=round(similarity, 4),
+            record=PredictionHistoryResponse.model_validate(candidate),
+        ))
+        if len(results) == limit:
+            break
+    return SimilarCasesResponse(record_id=id, model_version=record.model_version, results=results)
+
+
 @router.delete("/history/batch")
-async def batch_delete_history(req: BatchDeleteRequest, db: AsyncSession = Depends(get_db)):
-    """批量删除识别记录"""
-    """批量删除识别记录"""
-    # 先查询要删除的记录以获取文件名
-    query = select(PredictionRecord).where(PredictionRecord.id.in_(req.ids))
-    result = await db.execute(query)
-    records = result.scalars().all()
-    
-    # 删除文件
-    deleted_files_count = 0
-    for record in records:
-        if record.image_path:
-            file_path = settings.UPLOAD_DIR / record.image_path
-            try:
-                if file_path.exists():
-                    os.remove(file_path)
-                    deleted_files_count += 1
-            except Exception as e:
-                print(f"Error deleting file {file_path}: {e}")
-
-    # 删除数据库记录
-    result = await db.execute(
-        delete(PredictionRecord).where(PredictionRecord.id.in_(req.ids))
-    )
-    await db.commit()
-    return {"success": True, "deleted_count": result.rowcount, "deleted_files": deleted_files_count}
+async def batch_delete_history(req: BatchDeleteRequest, response: Response):
+    """
+    批量删除识别记录
+
+    记录分块删除，图片在文件线程池中删除；超过 BATCH_DELETE_SYNC_LIMIT 条时
+    转为后台任务并返回 202 和任务地址，通过 GET /api/history/jobs/{job_id} 查询进度。
+    """
+    if len(req.ids) > settings.BATCH_DELETE_SYNC_LIMIT:
+        job = await bulk_delete.start_delete_job(req.ids)
+        response.status_code = 202
+        return {"success": True, "job_id": job.id, "status_url": f"/api/history/jobs/{job.id}"}
+
+    deleted_count, deleted_files_count = await bulk_delete.delete_records(req.ids)
+    return {"success": True, "deleted_count": deleted_count, "deleted_files": deleted_files_count}
+
+
+@router.get("/history/jobs/{job_id}", response_model=BulkDeleteJobResponse)
+async def get_delete_job(job_id: str, db: AsyncSession = Depends(get_db)):
+    """查询后台批量删除任务的进度"""
+    job = await bulk_delete.get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
 
 
 @router.delete("/history/{id}")
@@ -83,78 +220,28 @@ async def delete_history(id: int, db: AsyncSession = Depends(get_db)):
     if not record:
         raise HTTPException(status_code=404, detail="记录不存在")
     
-    # 删除关联的图片文件
-    if record.image_path:
-        file_path = settings.UPLOAD_DIR / record.image_path
-        try:
-            if file_path.exists():
-                os.remove(file_path)
-        except Exception as e:
-            print(f"Error deleting file {file_path}: {e}")
-
     await db.delete(record)
+    await db.flush()
+    await stats_rollup.record_deleted(db, [(record.created_at, record.predicted_class)])
+    # 关联的图片仍被其他记录引用时保留
+    unreferenced = await bulk_delete.unreferenced_paths(db, {record.image_path} if record.image_path else set())
     await db.commit()
+    
+    await bulk_delete.remove_files(unreferenced)
     return {"success": True, "message": "删除成功"}
 
 
 @router.get("/stats")
 async def get_stats(db: AsyncSession = Depends(get_db)):
-    """获取增强统计数据"""
-    # 总记录数
-    total = (await db.execute(select(func.count(PredictionRecord.id)))).scalar() or 0
-    
-    # 今日记录数
-    today = date.today()
-    today_count = (await db.execute(
-        select(func.count(PredictionRecord.id)).where(
-            func.date(PredictionRecord.created_at) == today
-        )
-    )).scalar() or 0
-    
-    # 健康/病害统计
-    healthy_count = (await db.execute(
-        select(func.count(PredictionRecord.id)).where(
-            PredictionRecord.predicted_class.ilike("%healthy%")
-        )
-    )).scalar() or 0
-    diseased_count = total - healthy_count
-    healthy_rate = round(healthy_count / total, 4) if total > 0 else 0
-    
-    # 按类别统计
-    stats_result = await db.execute(
-        select(PredictionRecord.predicted_class, func.count(PredictionRecord.id).label("count"))
-        .group_by(PredictionRecord.predicted_class)
-    )
-    class_stats = [{"class": row[0], "count": row[1]} for row in stats_result.all()]
-    
-    # 按作物统计
-    crop_stats = {}
-    for item in class_stats:
-        crop = item["class"].split("___")[0] if "___" in item["class"] else item["class"]
-        if crop not in crop_stats:
-            crop_stats[crop] = {"crop": crop, "count": 0, "healthy": 0, "diseased": 0}
-        crop_stats[crop]["count"] += item["count"]
-        if "healthy" in item["class"].lower():
-            crop_stats[crop]["healthy"] += item["count"]
-        else:
-            crop_stats[crop]["diseased"] += item["count"]
-    
-    return {
-        "total": total,
-        "today_count": today_count,
-        "healthy_count": healthy_count,
-        "diseased_count": diseased_count,
-        "healthy_rate": healthy_rate,
-        "by_class": class_stats,
-        "by_crop": list(crop_stats.values())
-    }
+    """获取增强统计数据（读取按 日期 × 类别 维护的汇总表）"""
+    return await stats_rollup.summary(db)
 
 
 @router.get("/stats/trend")
 async def get_stats_trend(
     start_date: str = Query(None, description="开始日期 YYYY-MM-DD"),
     end_date: str = Query(None, description="结束日期 YYYY-MM-DD"),
-    granularity: str = Query("day", description="粒度: day/week/month"),
+    granularity: str = Query("day", pattern="^(day|week|month)$", description="粒度: day/week/month"),
     db: AsyncSession = Depends(get_db)
 ):
     """获取趋势统计数据"""
@@ -162,32 +249,9 @@ async def get_stats_trend(
     end = date.today() if not end_date else datetime.strptime(end_date, "%Y-%m-%d").date()
     start = end - timedelta(days=30) if not start_date else datetime.strptime(start_date, "%Y-%m-%d").date()
     
-    # 查询范围内的记录
-    result = await db.execute(
-        select(PredictionRecord).where(
-            and_(
-                func.date(PredictionRecord.created_at) >= start,
-                func.date(PredictionRecord.created_at) <= end
-            )
-        )
-    )
-    records = result.scalars().all()
-    
-    # 按日期聚合
-    data_map = {}
-    for r in records:
-        d = r.created_at.date()
-        if granularity == "week":
-            d = d - timedelta(days=d.weekday())
-        elif granularity == "month":
-            d = d.replace(day=1)
-        key = d.isoformat()
-        if key not in data_map:
-            data_map[key] = {"date": key, "total": 0, "healthy": 0, "diseased": 0}
-        data_map[key]["total"] += 1
-        if "healthy" in r.predicted_class.lower():
-            data_map[key]["healthy"] += 1
-        else:
-            data_map[key]["diseased"] += 1
-    
-    return {"data": sorted(data_map.values(), key=lambda x: x["date"])}
\ No newline at end of file
+    key = (start, end, granularity)
+    data = stats_rollup.trend_cache.get(key)
+    if data is None:
+        data = await stats_rollup.trend(db, start, end, granularity)
+        stats_rollup.trend_cache.put(key, data)
+    return {"data": data}
\ No newline at end of file
@@ -0,0 +1,36 @@
+"""
+派生图片 API 路由
+提供上传图片的 WebP 缩略图和预览图，首次请求时按需生成
+"""
+import asyncio
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+
+from app.core.urls import DERIVED_IMAGE_PREFIX
+from app.services.thumbnails import VARIANTS, DerivedImageError, derived_path, ensure_derived
+
+router = APIRouter(prefix=DERIVED_IMAGE_PREFIX, tags=["图片"])
+
+# 文件名（uuid）不会复用，派生图片内容永不变化，可以长期缓存
+CACHE_HEADERS = {"Cache-Control": "public, max-age=31536000, immutable"}
+
+
+@router.get("/{variant}/{image_path}")
+async def get_derived_image(variant: str, image_path: str):
+    """
+    获取派生图片
+    
+    - **variant**: thumb（缩略图）或 preview（预览图）
+    - **image_path**: 识别记录中的 image_path
+    """
+    if variant not in VARIANTS:
+        raise HTTPException(status_code=404, detail=f"未知的图片规格: {variant}")
+    path = derived_path(image_path, variant)
+    if not path.exists():
+        try:
+            path = await asyncio.to_thread(ensure_derived, image_path, variant)
+        except DerivedImageError:
+            raise HTTPException(status_code=404, detail="图片不存在")
+        except OSError:
+            raise HTTPException(status_code=404, detail="图片无法解码")
+    return FileResponse(path, media_type="image/webp", headers=CACHE_HEADERS)
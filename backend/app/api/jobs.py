@@ -0,0 +1,75 @@
+"""
+异步识别任务 API 路由
+查询 POST /api/predict?async=true 创建的任务，支持轮询和 SSE 推送
+"""
+import asyncio
+import time
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database import async_session, get_db
+from app.schemas.prediction import PredictionJobResponse
+from app.services.job_queue import TERMINAL_STATUSES, job_queue
+
+router = APIRouter(prefix="/api", tags=["识别任务"])
+
+
+@router.get("/jobs/{job_id}", response_model=PredictionJobResponse)
+async def get_prediction_job(job_id: str, db: AsyncSession = Depends(get_db)):
+    """查询异步识别任务的状态，成功后 result 为识别结果"""
+    job = await job_queue.get(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+
+async def _load_job(job_id: str) -> PredictionJobResponse | None:
+    # 每次检查使用新的会话，不在整个推送期间占用连接
+    async with async_session() as db:
+        job = await job_queue.get(db, job_id)
+        return PredictionJobResponse.model_validate(job) if job is not None else None
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_prediction_job(job_id: str):
+    """
+    以 Server-Sent Events 推送任务状态
+
+    状态或重试次数变化时发送一条 status 事件（data 与 GET /api/jobs/{job_id} 相同），
+    任务结束后发送最后一条事件并关闭连接；空闲时按 JOB_EVENTS_HEARTBEAT_SECONDS 发送注释行保持连接。
+    worker 在其他进程中执行任务，这里按 JOB_EVENTS_POLL_MS 检查数据库。
+    """
+    job = await _load_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    async def events():
+        current = job
+        last_state = None
+        last_sent = time.monotonic()
+        # 断线重连的客户端在 1 秒后重试
+        yield "retry: 1000\n\n"
+        while current is not None:
+            state = (current.status, current.attempts)
+            if state != last_state:
+                last_state = state
+                last_sent = time.monotonic()
+                yield f"event: status\ndata: {current.model_dump_json()}\n\n"
+                if current.status in TERMINAL_STATUSES:
+                    return
+            elif time.monotonic() - last_sent >= settings.JOB_EVENTS_HEARTBEAT_SECONDS:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(settings.JOB_EVENTS_POLL_MS / 1000)
+            current = await _load_job(job_id)
+        # 任务在推送期间被清理
+        yield 'event: gone\ndata: {}\n\n'
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -2,61 +2,450 @@
 预测 API 路由
 处理图片上传和病害识别
 """
+import asyncio
+import hashlib
+import json
+import time
 import uuid
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime
 from pathlib import Path
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
+from typing import BinaryIO
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from PIL import UnidentifiedImageError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
-from app.core.database import get_db
-from app.models.prediction import PredictionRecord
+from app.core.database import get_db, async_session
+from app.core.metrics import metrics
 from app.schemas.prediction import PredictionResponse
 from app.services.ai_service import ai_service
+from app.services.embedding_index import embedding_index
+from app.services.executor import ExecutorBusyError
+from app.services.job_queue import QueueFullError, job_queue
+from app.services.prediction_cache import CachedPrediction, prediction_cache
+from app.services.record_writer import record_writer, write_predictions
+from app.services.thumbnails import generate_all
+from app.services.uploads import (
+    SNIFF_BYTES, StoredUpload, UnsupportedImageError, UploadTooLargeError, sniff_image_type, stream_upload,
+)
 
 router = APIRouter(prefix="/api", tags=["预测"])
 
+ALLOWED_TYPES = {"image/jpeg", "image/png", "image/webp"}
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+ZIP_TYPES = {"application/zip", "application/x-zip-compressed"}
+UNSUPPORTED_IMAGE = "仅支持 jpg/png/webp 格式图片"
+# 批量上传 / zip 条目分块读取的块大小
+_READ_CHUNK_SIZE = 64 * 1024
 
-@router.post("/predict", response_model=PredictionResponse)
+PREDICT_STAGE_SECONDS = metrics.histogram(
+    "cropvision_predict_stage_seconds",
+    "Time spent in each stage of POST /api/predict",
+    ("stage",),
+)
+
+
+def _ensure_model_ready():
+    """模型加载/预热完成前拒绝预测请求"""
+    if not ai_service.is_ready:
+        raise HTTPException(
+            status_code=503,
+            detail="模型加载中，请稍后重试",
+            headers={"Retry-After": "5"},
+        )
+
+
+async def _receive_upload(request: Request) -> StoredUpload:
+    """边接收边写入临时文件，同一遍完成哈希计算、文件头识别和大小检查"""
+    try:
+        with PREDICT_STAGE_SECONDS.time(stage="upload"):
+            return await stream_upload(
+                request, settings.UPLOAD_DIR, settings.MAX_UPLOAD_SIZE_MB * 1024 * 1024, ALLOWED_TYPES
+            )
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _enqueue_prediction(db: AsyncSession, request: Request, tta: str) -> JSONResponse:
+    """保存图片并创建异步识别任务，返回 202 和任务地址；排队任务数达到上限时返回 503"""
+    upload = await _receive_upload(request)
+    try:
+        await upload.commit(f"{uuid.uuid4()}{upload.suffix}")
+        job = await job_queue.enqueue(db, upload.path.name, upload.sha256, tta)
+        await db.commit()
+    except QueueFullError:
+        await upload.discard()
+        raise HTTPException(status_code=503, detail="识别任务队列已满，请稍后重试", headers={"Retry-After": "5"})
+    except BaseException:
+        await upload.discard()
+        raise
+    return JSONResponse(status_code=202, content={
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events",
+    })
+
+
+def _save_upload(file_path: Path, content: bytes):
+    """保存上传的原图"""
+    with open(file_path, "wb") as f:
+        f.write(content)
+
+
+def _save_uploads(items: list[tuple[Path, bytes]]):
+    for file_path, content in items:
+        _save_upload(file_path, content)
+
+
+@dataclass
+class _BatchItem:
+    """批量上传中的一张图片；content 为 None 时 error 说明跳过的原因"""
+    name: str
+    content: bytes | None = None
+    suffix: str | None = None
+    error: str | None = None
+    sha256: str | None = None
+
+
+def _read_limited(stream: BinaryIO, limit: int) -> bytes | None:
+    """分块读取，超过 limit 字节时返回 None，不再读入剩余部分"""
+    buffer = bytearray()
+    while chunk := stream.read(_READ_CHUNK_SIZE):
+        buffer += chunk
+        if len(buffer) > limit:
+            return None
+    return bytes(buffer)
+
+
+def _expand_uploads(files: list[UploadFile]) -> list[_BatchItem]:
+    """
+    读取批量上传的文件（在线程中执行）
+
+    zip 压缩包展开为其中的图片。每张图片（含解压后）不超过 MAX_UPLOAD_SIZE_MB，
+    超限、类型不支持或文件头不是 jpg/png/webp 的以错误项占位，后续输出错误行；
+    保存时使用按文件头识别的扩展名。
+
+    Raises:
+        UploadTooLargeError: 读入的图片合计超过 MAX_REQUEST_SIZE_MB（防止压缩炸弹）
+    """
+    max_bytes = settings.MAX_UPLOAD_SIZE_MB * 1024 * 1024
+    max_total = settings.MAX_REQUEST_SIZE_MB * 1024 * 1024
+    too_large = f"图片大小超过 {settings.MAX_UPLOAD_SIZE_MB} MB 上限"
+    items = []
+    total = 0
+
+    def add(name: str, content: bytes | None):
+        nonlocal total
+        if content is None:
+            items.append(_BatchItem(name, error=too_large))
+            return
+        total += len(content)
+        if total > max_total:
+            raise UploadTooLargeError(f"解压后的图片合计超过 {settings.MAX_REQUEST_SIZE_MB} MB 上限")
+        suffix = sniff_image_type(content[:SNIFF_BYTES])
+        if suffix is None:
+            items.append(_BatchItem(name, error=UNSUPPORTED_IMAGE))
+        else:
+            items.append(_BatchItem(name, content, suffix, sha256=hashlib.sha256(content).hexdigest()))
+
+    for file in files:
+        name = file.filename or "upload"
+        if file.content_type in ZIP_TYPES or Path(name).suffix.lower() == ".zip":
+            with zipfile.ZipFile(file.file) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or info.filename.startswith("__MACOSX/"):
+                        continue
+                    if Path(info.filename).suffix.lower() not in IMAGE_SUFFIXES:
+                        items.append(_BatchItem(info.filename, error=UNSUPPORTED_IMAGE))
+                    elif info.file_size > max_bytes:
+                        items.append(_BatchItem(info.filename, error=too_large))
+                    else:
+                        with archive.open(info) as entry:
+                            add(info.filename, _read_limited(entry, max_bytes))
+                    if len(items) > settings.BATCH_PREDICT_MAX_FILES:
+                        return items
+        elif file.content_type in ALLOWED_TYPES:
+            add(name, _read_limited(file.file, max_bytes))
+        else:
+            items.append(_BatchItem(name, error=UNSUPPORTED_IMAGE))
+    return items
+
+
+# 请求体由 stream_upload 直接解析，不声明 File 参数（否则 FastAPI 会先把整个表单读入临时文件）；
+# 这里只为接口文档描述表单结构
+_PREDICT_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary", "description": "上传的农作物图片"}},
+                }
+            }
+        },
+    }
+}
+
+
+@router.post("/predict", response_model=PredictionResponse, openapi_extra=_PREDICT_REQUEST_BODY)
 async def predict_disease(
-    file: UploadFile = File(..., description="上传的农作物图片"),
+    request: Request,
+    background_tasks: BackgroundTasks,
+    tta: str = Query("none", pattern="^(none|flip|full)$", description="测试时增强: none / flip（3 个视图）/ full（8 个视图）"),
+    run_async: bool = Query(False, alias="async", description="只保存图片并入队，立即返回任务 ID（202）"),
     db: AsyncSession = Depends(get_db)
 ):
     """
     上传图片进行病害识别
     
-    - **file**: 农作物叶片图片 (支持 jpg, png, webp)
+    - **file**: 农作物叶片图片 (支持 jpg, png, webp，大小不超过 MAX_UPLOAD_SIZE_MB)
+    - **tta**: 对难以判断的图片开启测试时增强，多个视图合并为一次批量推理后平均概率（耗时更长，不使用结果缓存）
+    - **async**: 网络不稳定的客户端可以只上传、不等待推理：返回 202 和任务 ID，
+      之后轮询 GET /api/jobs/{job_id} 或订阅 GET /api/jobs/{job_id}/events（SSE）获取结果
     
     返回预测的病害类别和置信度
     """
-    # 验证文件类型
-    allowed_types = {"image/jpeg", "image/png", "image/webp"}
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="仅支持 jpg/png/webp 格式图片")
+    if run_async:
+        # 任务由 worker 进程执行，入队不需要本进程的模型就绪
+        return await _enqueue_prediction(db, request, tta)
+    _ensure_model_ready()
+    start = time.perf_counter()
     
-    # 保存上传的图片
-    file_ext = Path(file.filename).suffix or ".jpg"
-    filename = f"{uuid.uuid4()}{file_ext}"
-    file_path = settings.UPLOAD_DIR / filename
-    
-    content = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(content)
+    # 文件类型在接收到该字段的表头时检查
+    upload = await _receive_upload(request)
     
-    # 执行预测
-    predicted_class, confidence, top_predictions = ai_service.predict(file_path)
+    cache_row = None
+    embedding = None
+    try:
+        # 相同图片 + 相同模型版本直接复用缓存结果和已保存的图片
+        with PREDICT_STAGE_SECONDS.time(stage="cache_lookup"):
+            model_version = ai_service.model_version
+            # 缓存的是常规推理结果，TTA 请求既不读取也不写入
+            cached = None if tta != "none" else await prediction_cache.get(db, upload.sha256, model_version)
+        
+        if cached is not None:
+            await upload.discard()
+            filename = cached.image_path
+            predicted_class = cached.predicted_class
+            confidence = cached.confidence
+            top_predictions = cached.top_predictions
+        else:
+            # 从刚写入（仍在页缓存中）的文件解码，请求期间不在内存中保留整个上传
+            try:
+                with PREDICT_STAGE_SECONDS.time(stage="inference"):
+                    result = await ai_service.predict_async(upload.path, tta)
+            except ExecutorBusyError:
+                raise HTTPException(
+                    status_code=503,
+                    detail="推理服务繁忙，请稍后重试",
+                    headers={"Retry-After": "1"},
+                )
+            except (UnidentifiedImageError, OSError):
+                raise HTTPException(status_code=400, detail="图片无法解码")
+            
+            filename = f"{uuid.uuid4()}{upload.suffix}"
+            await upload.commit(filename)
+            if settings.DERIVED_PREGENERATE:
+                # 响应返回后生成缩略图和预览图，历史列表首次加载即可命中
+                background_tasks.add_task(generate_all, [filename])
+            
+            predicted_class = result.predicted_class
+            confidence = result.confidence
+            top_predictions = result.top_predictions
+            embedding = result.embedding
+            # 请求期间模型可能被热切换，以实际产生结果的版本为准
+            model_version = result.model_version
+            if tta == "none":
+                # 提交之后才写入进程内缓存（write-behind 时由 record_writer 在写入后写入）
+                cache_row = prediction_cache.row(upload.sha256, model_version, CachedPrediction(
+                    predicted_class=predicted_class,
+                    confidence=confidence,
+                    top_predictions=top_predictions,
+                    image_path=filename,
+                ))
+    except BaseException:
+        # 未能保存为正式文件（推理失败、请求取消等）时清理临时文件
+        if upload.path.name.endswith(".part"):
+            await upload.discard()
+        raise
     
-    # 保存记录到数据库
-    record = PredictionRecord(
-        image_path=str(filename),
-        predicted_class=predicted_class,
-        confidence=confidence
-    )
-    db.add(record)
-    await db.commit()
+    # 保存记录到数据库（开启 write-behind 时只放入缓冲区，这里提交的是缓存查询的事务）
+    record = {
+        "image_path": str(filename),
+        "predicted_class": predicted_class,
+        "confidence": confidence,
+        "model_version": model_version,
+        "created_at": datetime.now(),
+    }
+    with PREDICT_STAGE_SECONDS.time(stage="db_commit"):
+        record_id = await record_writer.save(db, record, cache_row, embedding)
+        await db.commit()
+    if record_id is not None:
+        if cache_row is not None:
+            prediction_cache.remember([cache_row])
+        await embedding_index.add([(record_id, model_version, embedding)])
+    PREDICT_STAGE_SECONDS.observe(time.perf_counter() - start, stage="total")
     
     return PredictionResponse(
         predicted_class=predicted_class,
         confidence=round(confidence, 4),
         image_url=f"/uploads/{filename}",
-        top_predictions=top_predictions
-    )
\ No newline at end of file
+        top_predictions=top_predictions,
+        model_version=model_version,
+        tta=tta
+    )
+
+
+async def _write_batch(records: list[dict], embeddings: list, cache_rows: list[dict]):
+    """整批记录一次写入、一次提交，提交后更新进程内缓存和相似检索索引"""
+    created_at = datetime.now()
+    for record in records:
+        record["created_at"] = created_at
+    async with async_session() as db:
+        ids = await write_predictions(db, records, cache_rows)
+        await db.commit()
+    prediction_cache.remember(cache_rows)
+    await embedding_index.add(zip(ids, [record["model_version"] for record in records], embeddings))
+
+
+# 不随请求取消的后台写入任务（保留引用，避免任务在完成前被回收）
+_background_writes: set[asyncio.Task] = set()
+
+
+async def _shielded(coro):
+    """在独立任务中执行 coro；调用方被取消时任务继续运行到结束"""
+    task = asyncio.ensure_future(coro)
+    _background_writes.add(task)
+    task.add_done_callback(_background_writes.discard)
+    await asyncio.shield(task)
+
+
+@router.post("/predict/batch")
+async def predict_batch(
+    files: list[UploadFile] = File(..., description="多张农作物图片，或一个包含图片的 zip 压缩包"),
+):
+    """
+    批量病害识别
+    
+    - **files**: 多张图片 (jpg/png/webp)，或单个 zip 压缩包
+    
+    以 NDJSON 流式返回，每张图片一行，按块推理完成即输出；与单图接口一样先查预测缓存，
+    命中的图片直接复用结果和已保存的图片。预测记录在响应结束时（包括客户端中途断开）
+    一次性批量写入数据库，开启 DERIVED_PREGENERATE 时随后生成缩略图和预览图。
+    """
+    _ensure_model_ready()
+    try:
+        items = await asyncio.to_thread(_expand_uploads, files)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="zip 文件损坏或格式不正确")
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if not items:
+        raise HTTPException(status_code=400, detail="未找到可识别的图片")
+    if len(items) > settings.BATCH_PREDICT_MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"单次最多识别 {settings.BATCH_PREDICT_MAX_FILES} 张图片",
+        )
+    
+    async def stream():
+        valid = []
+        for item in items:
+            if item.content is None:
+                yield json.dumps({"filename": item.name, "error": item.error}, ensure_ascii=False) + "\n"
+            else:
+                valid.append(item)
+        
+        records = []
+        embeddings = []
+        # 新推理图片的缓存行（同一批中重复的图片只保留一行）
+        cache_rows = {}
+        saved = []
+        try:
+            # 与单图接口一致：相同图片 + 相同模型版本直接复用缓存结果和已保存的图片
+            model_version = ai_service.model_version
+            hits, pending = [], []
+            async with async_session() as db:
+                for item in valid:
+                    cached = await prediction_cache.get(db, item.sha256, model_version)
+                    if cached is None:
+                        pending.append(item)
+                    else:
+                        hits.append((item, cached))
+                await db.commit()
+            for item, cached in hits:
+                records.append({
+                    "image_path": cached.image_path,
+                    "predicted_class": cached.predicted_class,
+                    "confidence": cached.confidence,
+                    "model_version": model_version,
+                })
+                embeddings.append(None)
+                yield json.dumps({
+                    "filename": item.name,
+                    "predicted_class": cached.predicted_class,
+                    "confidence": round(cached.confidence, 4),
+                    "image_url": f"/uploads/{cached.image_path}",
+                    "top_predictions": cached.top_predictions,
+                }, ensure_ascii=False) + "\n"
+            
+            offset = 0
+            contents = [item.content for item in pending]
+            async for results in ai_service.predict_stream(contents, settings.BATCH_PREDICT_CHUNK_SIZE):
+                lines = []
+                to_save = []
+                chunk_records = []
+                for item, result in zip(pending[offset:offset + len(results)], results):
+                    if isinstance(result, Exception):
+                        lines.append({"filename": item.name, "error": "图片无法解码"})
+                        continue
+                    # 扩展名取自文件头，不使用客户端提供的文件名
+                    filename = f"{uuid.uuid4()}{item.suffix}"
+                    to_save.append((settings.UPLOAD_DIR / filename, item.content))
+                    chunk_records.append((item, result, filename))
+                    lines.append({
+                        "filename": item.name,
+                        "predicted_class": result.predicted_class,
+                        "confidence": round(result.confidence, 4),
+                        "image_url": f"/uploads/{filename}",
+                        "top_predictions": result.top_predictions,
+                    })
+                offset += len(results)
+                
+                await asyncio.to_thread(_save_uploads, to_save)
+                # 图片落盘之后才登记记录并输出地址；此后无论请求如何结束，记录都会写入
+                for item, result, filename in chunk_records:
+                    records.append({
+                        "image_path": filename,
+                        "predicted_class": result.predicted_class,
+                        "confidence": result.confidence,
+                        "model_version": result.model_version,
+                    })
+                    embeddings.append(result.embedding)
+                    saved.append(filename)
+                    cache_rows[item.sha256] = prediction_cache.row(item.sha256, result.model_version, CachedPrediction(
+                        predicted_class=result.predicted_class,
+                        confidence=result.confidence,
+                        top_predictions=result.top_predictions,
+                        image_path=filename,
+                    ))
+                for line in lines:
+                    yield json.dumps(line, ensure_ascii=False) + "\n"
+        finally:
+            # 客户端断开或后续块出错时，已经输出地址的图片也要写入记录（否则会被孤立文件回收删除）；
+            # 写入在独立任务中完成，不随请求一起被取消
+            if records:
+                await _shielded(_write_batch(records, embeddings, list(cache_rows.values())))
+        
+        if saved and settings.DERIVED_PREGENERATE:
+            await asyncio.to_thread(generate_all, saved)
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
@@ -3,6 +3,7 @@
 使用 pydantic-settings 管理环境变量和配置
 """
 from pathlib import Path
+from typing import Literal
 from pydantic_settings import BaseSettings
 
 
@@ -17,17 +18,139 @@ class Settings(BaseSettings):
     # 路径配置
     BASE_DIR: Path = Path(__file__).resolve().parent.parent.parent
     UPLOAD_DIR: Path = BASE_DIR / "uploads"
+    # 缩略图 / 预览图缓存目录
+    DERIVED_DIR: Path = BASE_DIR / "derived"
     MODEL_DIR: Path = BASE_DIR / "ml_models"
     
     # 模型配置
     MODEL_PATH: str = "best_model.pth"
     CLASS_MAPPING_PATH: str = "class_mapping.json"
+    # 模型注册表清单（位于 MODEL_DIR 下），以及各 worker 检查清单变化的间隔
+    MODEL_REGISTRY_PATH: str = "registry.json"
+    MODEL_REGISTRY_POLL_SECONDS: float = 10.0
+    # 以内存映射方式加载权重，多进程部署时共享页缓存
+    MODEL_MMAP: bool = True
+    # 推理后端: torch（eager / TorchScript）或 onnxruntime
+    # 选择 onnxruntime 时加载与模型文件同名的 .onnx（由 export_onnx.py 导出），不存在则回退到 torch
+    INFERENCE_BACKEND: Literal["torch", "onnxruntime"] = "torch"
+    # ONNX Runtime 算子内线程数，0 表示由 ORT 自行决定
+    ONNX_INTRA_OP_THREADS: int = 0
+    
+    # 置信度级联：所有图片先经过学生模型（量化 MobileNetV3），Top-1 置信度或 Top-1 与 Top-2 之差
+    # 低于阈值时，同一份预处理后的张量再交给教师模型（ResNet50）复核（阈值为 0 表示不按该条件升级）
+    # 版本为空时分别取注册表中第一个量化模型和第一个 ResNet50 模型
+    CASCADE_ENABLED: bool = False
+    CASCADE_STUDENT_VERSION: str = ""
+    CASCADE_TEACHER_VERSION: str = ""
+    CASCADE_MIN_CONFIDENCE: float = 0.8
+    CASCADE_MIN_MARGIN: float = 0.2
+    
+    # 微批处理配置：凑满 BATCH_MAX_SIZE 张或等待 BATCH_MAX_WAIT_MS 毫秒即执行一次前向传播
+    BATCH_MAX_SIZE: int = 8
+    BATCH_MAX_WAIT_MS: float = 5.0
+    # 以 channels_last 内存布局执行推理（部分 CPU 卷积实现更快）
+    CHANNELS_LAST: bool = False
+    
+    # 推理线程池配置：工作线程数应不小于 BATCH_MAX_SIZE，否则批次无法凑满
+    INFERENCE_WORKERS: int = 8
+    INFERENCE_QUEUE_SIZE: int = 32
+    
+    # 启动预热：模型加载后按这些批大小各执行几次合成输入的前向传播
+    WARMUP_BATCH_SIZES: list[int] = [1, 8, 32]
+    WARMUP_ITERATIONS: int = 2
+    
+    # 启动调优：加载模型时以单线程比较各量化引擎（量化模型按各引擎重新加载，预加载部署时只在父进程执行一次），
+    # 各 worker 预热前再在合成批次上比较候选的算子内线程数，固定使用最快的组合。
+    # 线程上限为 CPU 核数 / SERVE_WORKERS，避免同机多个 worker 超额订阅；
+    # TORCH_NUM_THREADS > 0 或 QUANTIZED_ENGINE 非空时固定该项，不参与比较；TORCH_INTEROP_THREADS 为 0 时取线程上限
+    AUTOTUNE_ENABLED: bool = True
+    AUTOTUNE_BATCH_SIZE: int = 8
+    AUTOTUNE_ITERATIONS: int = 3
+    TORCH_NUM_THREADS: int = 0
+    TORCH_INTEROP_THREADS: int = 1
+    QUANTIZED_ENGINE: str = ""
+    
+    # 批量预测接口配置
+    DECODE_WORKERS: int = 4              # 并行解码线程数
+    BATCH_PREDICT_CHUNK_SIZE: int = 32   # 每次前向传播的图片数
+    BATCH_PREDICT_MAX_FILES: int = 500   # 单次请求（含 zip 内）最多图片数
+    
+    # 上传限制：单张图片大小上限（单图识别接口在接收过程中即按此限制），单个请求（含批量 / zip）大小上限
+    MAX_UPLOAD_SIZE_MB: int = 20
+    MAX_REQUEST_SIZE_MB: int = 200
+    
+    # 派生图片：缩略图和预览图的最长边像素、WebP 质量，以及是否在识别完成后预先生成
+    THUMBNAIL_SIZE: int = 256
+    PREVIEW_SIZE: int = 1024
+    DERIVED_WEBP_QUALITY: int = 80
+    DERIVED_PREGENERATE: bool = True
+    
+    # 预测结果缓存（进程内 LRU 条目上限，0 表示只使用持久化表）
+    PREDICTION_CACHE_SIZE: int = 1024
+    
+    # 相似病例检索：识别时保存倒数第二层特征（L2 归一化后的 float16 行，按识别记录 ID 追加写入内存映射矩阵，
+    # 每个模型版本一个矩阵）。行数达到 EMBEDDING_IVF_MIN_ROWS 后在后台构建 IVF 粗排索引，
+    # 查询时只扫描与查询最接近的 EMBEDDING_IVF_NPROBE 个聚类
+    EMBEDDING_INDEX_ENABLED: bool = False
+    EMBEDDING_DIR: Path = BASE_DIR / "embeddings"
+    EMBEDDING_IVF_MIN_ROWS: int = 50000
+    EMBEDDING_IVF_NPROBE: int = 16
+    
+    # 趋势统计响应缓存时间（秒），0 表示不缓存
+    STATS_TREND_CACHE_TTL: float = 30.0
+    
+    # 批量删除：每个事务删除的记录数、超过多少条转为后台任务、删除文件的线程数
+    DELETE_CHUNK_SIZE: int = 500
+    BATCH_DELETE_SYNC_LIMIT: int = 1000
+    FILE_DELETE_WORKERS: int = 4
+    # 后台删除任务每删除一块刷新一次心跳，超过这个时间（秒）未刷新视为执行它的进程已退出
+    BULK_DELETE_STALE_SECONDS: int = 300
+    
+    # 孤立文件回收：运行周期（秒，0 表示关闭）；新于宽限期的文件可能属于进行中的请求，不做处理
+    ORPHAN_GC_INTERVAL_SECONDS: int = 3600
+    ORPHAN_GC_GRACE_SECONDS: int = 3600
+    
+    # 异步识别任务队列（prediction_jobs 表）：POST /api/predict?async=true 保存图片后入队并立即返回任务 ID，
+    # 由 worker.py 进程按批领取。领取后 JOB_VISIBILITY_TIMEOUT_SECONDS 内未完成的任务重新可见；
+    # 失败的任务按 JOB_RETRY_BACKOFF_SECONDS × 2^(n-1) 延迟重试，最多执行 JOB_MAX_ATTEMPTS 次；
+    # 排队任务数达到 JOB_QUEUE_MAX_PENDING 时拒绝入队（503）
+    JOB_QUEUE_MAX_PENDING: int = 1000
+    JOB_BATCH_SIZE: int = 16
+    JOB_POLL_INTERVAL_MS: int = 200
+    JOB_VISIBILITY_TIMEOUT_SECONDS: int = 120
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_BACKOFF_SECONDS: float = 2.0
+    # 已结束的任务保留时间（小时），过期后由 worker 清理
+    JOB_RESULT_TTL_HOURS: int = 24
+    # 队列深度指标的刷新间隔，以及 SSE 推送检查任务状态、发送心跳的间隔
+    JOB_QUEUE_STATS_INTERVAL_SECONDS: float = 5.0
+    JOB_EVENTS_POLL_MS: int = 500
+    JOB_EVENTS_HEARTBEAT_SECONDS: float = 15.0
+    # 在 API 进程内同时运行一个 worker（单机 / 开发环境，无需另外启动 worker.py）
+    JOB_WORKER_IN_PROCESS: bool = False
+    
+    # 多进程部署配置（serve.py 预加载模型后 fork 出的 worker 数；使用 uvicorn --workers 时也应设置，用于分配线程预算）
+    SERVE_WORKERS: int = 1
     
     # Auth 配置
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7 # 7 days
     
     # 数据库配置
     DATABASE_URL: str = "sqlite+aiosqlite:///./cropvision.db"
+    # 打印执行的 SQL（与 DEBUG 分开，高并发下逐条日志本身就是瓶颈）
+    DB_ECHO: bool = False
+    # SQLite 连接参数：WAL 日志模式下 synchronous=NORMAL 只在检查点时 fsync
+    SQLITE_JOURNAL_MODE: Literal["WAL", "DELETE", "TRUNCATE"] = "WAL"
+    SQLITE_SYNCHRONOUS: Literal["OFF", "NORMAL", "FULL"] = "NORMAL"
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    
+    # 识别记录延迟批量写入：攒够 N 条或等待 T 毫秒后合并为一次多行插入，关闭时写完剩余记录；
+    # 写入失败的记录放回缓冲区重试，每条记录最多尝试 WRITE_BEHIND_MAX_ATTEMPTS 次
+    PREDICTION_WRITE_BEHIND: bool = False
+    WRITE_BEHIND_MAX_BATCH: int = 256
+    WRITE_BEHIND_FLUSH_MS: int = 50
+    WRITE_BEHIND_MAX_ATTEMPTS: int = 5
     
     # CORS 配置
     CORS_ORIGINS: list[str] = ["http://localhost:5173", "http://localhost:3000", "http://localhost:5174"]
@@ -41,4 +164,5 @@ settings = Settings()
 
 # 确保目录存在
 settings.UPLOAD_DIR.mkdir(exist_ok=True)
+settings.DERIVED_DIR.mkdir(exist_ok=True)
 settings.MODEL_DIR.mkdir(exist_ok=True)
\ No newline at end of file
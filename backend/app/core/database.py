@@ -2,14 +2,20 @@
 数据库连接模块
 使用 SQLAlchemy 异步引擎
 """
+import time
+from contextvars import ContextVar
+
+from fastapi import Request
+from sqlalchemy import event, inspect, text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 
 from app.core.config import settings
+from app.core.metrics import metrics
 
 
 # 创建异步引擎
-engine = create_async_engine(settings.DATABASE_URL, echo=settings.DEBUG)
+engine = create_async_engine(settings.DATABASE_URL, echo=settings.DB_ECHO)
 
 # 创建异步会话工厂
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
@@ -20,13 +26,97 @@ class Base(DeclarativeBase):
     pass
 
 
-async def get_db():
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """每个新连接建立时设置 SQLite 同步级别、mmap 大小和锁等待时间（日志模式见 init_db）"""
+    if engine.dialect.name != "sqlite":
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.close()
+
+
+# 数据库耗时指标，按发起请求的路由路径区分
+DB_SESSION_SECONDS = metrics.histogram(
+    "cropvision_db_session_seconds", "Lifetime of request-scoped DB sessions", ("route",)
+)
+DB_QUERY_SECONDS = metrics.histogram(
+    "cropvision_db_query_seconds", "Time spent executing SQL statements", ("route",)
+)
+_current_route: ContextVar[str] = ContextVar("db_route", default="background")
+
+
+def _observe_query(context):
+    start = getattr(context, "_cropvision_query_start", None)
+    if start is not None:
+        DB_QUERY_SECONDS.observe(time.perf_counter() - start, route=_current_route.get())
+
+
+# 开始时间保存在每条语句自己的执行上下文上（而不是连接级的栈），执行失败时也不会残留到后续语句
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._cropvision_query_start = time.perf_counter()
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _observe_query(context)
+
+
+@event.listens_for(engine.sync_engine, "handle_error")
+def _handle_error(exception_context):
+    """执行失败的语句同样计时（例如等待写锁超时）"""
+    _observe_query(exception_context.execution_context)
+
+
+async def get_db(request: Request):
     """获取数据库会话的依赖注入函数"""
-    async with async_session() as session:
-        yield session
+    route = request.scope.get("route")
+    _current_route.set(getattr(route, "path", request.url.path))
+    start = time.perf_counter()
+    try:
+        async with async_session() as session:
+            yield session
+    finally:
+        DB_SESSION_SECONDS.observe(time.perf_counter() - start, route=_current_route.get())
+
+
+def _add_missing_columns(conn):
+    """
+    为已存在的表补充新增的列
+
+    create_all 只会创建缺失的表，不会修改已有表；新增的可空列在这里用
+    ALTER TABLE ADD COLUMN 补上，旧数据库无需手动迁移。
+    """
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+
+
+def _add_missing_indexes(conn):
+    """为已存在的表补建新增的索引（create_all 不会为已有表创建索引）"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
 
 
 async def init_db():
     """初始化数据库表"""
+    if engine.dialect.name == "sqlite":
+        # 日志模式写入数据库文件本身，只需设置一次；放在连接事件里会让并发新建的连接互相抢锁
+        async with engine.connect() as conn:
+            await conn.exec_driver_sql(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_add_missing_indexes)
\ No newline at end of file
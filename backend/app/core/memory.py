@@ -0,0 +1,62 @@
+"""
+进程内存统计
+读取 /proc/<pid>/smaps_rollup，区分共享页与私有页，用于评估多进程下模型权重是否被共享
+"""
+import os
+import resource
+from pathlib import Path
+
+
+_FIELDS = {
+    "Rss": "rss_mb",
+    "Pss": "pss_mb",
+    "Shared_Clean": "shared_clean_mb",
+    "Shared_Dirty": "shared_dirty_mb",
+    "Private_Clean": "private_clean_mb",
+    "Private_Dirty": "private_dirty_mb",
+}
+
+
+def memory_report(pid: int | None = None) -> dict:
+    """
+    获取进程内存占用（MB）
+
+    Linux 下返回 RSS / PSS 以及共享、私有页的拆分；
+    其他平台仅能返回当前进程的峰值 RSS。
+    """
+    pid = pid or os.getpid()
+    rollup = Path(f"/proc/{pid}/smaps_rollup")
+    if not rollup.exists():
+        if pid != os.getpid():
+            return {"pid": pid}
+        # ru_maxrss 在 Linux 上单位为 KB，在 macOS 上为字节
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        divisor = 1024 * 1024 if os.uname().sysname == "Darwin" else 1024
+        return {"pid": pid, "peak_rss_mb": round(peak / divisor, 1)}
+
+    try:
+        content = rollup.read_text()
+    except OSError:
+        # 进程已退出
+        return {"pid": pid}
+
+    report = {"pid": pid}
+    for line in content.splitlines():
+        key, _, value = line.partition(":")
+        if key in _FIELDS:
+            report[_FIELDS[key]] = round(int(value.split()[0]) / 1024, 1)
+    report["shared_mb"] = round(report.get("shared_clean_mb", 0) + report.get("shared_dirty_mb", 0), 1)
+    report["private_mb"] = round(report.get("private_clean_mb", 0) + report.get("private_dirty_mb", 0), 1)
+    return report
+
+
+def format_report(reports: list[dict]) -> str:
+    """把多个进程的内存报告格式化为表格"""
+    header = f"{'pid':>8} {'rss_mb':>10} {'pss_mb':>10} {'shared_mb':>10} {'private_mb':>10}"
+    lines = [header]
+    for r in reports:
+        lines.append(
+            f"{r['pid']:>8} {r.get('rss_mb', r.get('peak_rss_mb', 0)):>10} {r.get('pss_mb', '-'):>10} "
+            f"{r.get('shared_mb', '-'):>10} {r.get('private_mb', '-'):>10}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,48 @@
+"""
+ASGI 中间件
+"""
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class BodySizeLimitMiddleware:
+    """
+    请求体大小上限
+
+    Content-Length 超过上限时直接返回 413；没有 Content-Length（分块传输）时
+    在接收过程中累计字节数，一旦超过上限立即中止，不会先把整个请求体读完。
+    route_limits 按请求路径给单独的路由设置更小的上限（例如单图上传）。
+    """
+
+    def __init__(self, app: ASGIApp, max_bytes: int, route_limits: dict[str, int] | None = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.route_limits = route_limits or {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = self.route_limits.get(scope["path"], self.max_bytes)
+        detail = f"请求体超过 {max_bytes // (1024 * 1024)} MB 上限"
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+            response = JSONResponse({"detail": detail}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    # 由路由的异常处理转换为 413 响应
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,12 @@
+"""
+对外访问地址
+响应模型和 API 路由共用的 URL 规则（schemas 只依赖 core，不依赖 services）
+"""
+
+# 派生图片路由前缀，见 app/api/images.py
+DERIVED_IMAGE_PREFIX = "/api/images"
+
+
+def derived_url(image_path: str, variant: str) -> str:
+    """派生图片的访问地址（首次访问时按需生成）"""
+    return f"{DERIVED_IMAGE_PREFIX}/{variant}/{image_path}"
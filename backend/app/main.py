@@ -2,15 +2,45 @@
 CropVision-AI 后端主入口
 FastAPI 应用启动配置
 """
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 from app.core.config import settings
-from app.core.database import init_db
-from app.core.database import init_db
-from app.api import predict_router, history_router, auth_router
+from app.core.database import async_session, init_db
+from app.core.metrics import metrics
+from app.core.middleware import BodySizeLimitMiddleware
+from app.api import predict_router, history_router, auth_router, admin_router, images_router, jobs_router
+from app.services import bulk_delete, stats_rollup
+from app.services.ai_service import ai_service
+from app.services.job_queue import job_queue
+from app.services.job_worker import job_worker
+from app.services.orphan_gc import collect_orphans_periodically
+from app.services.prediction_cache import prediction_cache
+from app.services.record_writer import backfill_class_columns, record_writer
+
+
+async def watch_model_registry():
+    """定期检查模型注册表，其他 worker 切换了激活版本时跟随切换"""
+    while True:
+        await asyncio.sleep(settings.MODEL_REGISTRY_POLL_SECONDS)
+        try:
+            await asyncio.to_thread(ai_service.sync_with_registry)
+        except Exception as e:
+            print(f"检查模型注册表失败: {e}")
+
+
+async def refresh_job_queue_stats():
+    """定期刷新异步识别任务队列的深度指标（worker 在其他进程中时，API 进程的 /metrics 也能反映积压）"""
+    while True:
+        try:
+            await job_queue.refresh_stats()
+        except Exception as e:
+            print(f"刷新识别任务队列指标失败: {e}")
+        await asyncio.sleep(settings.JOB_QUEUE_STATS_INTERVAL_SECONDS)
 
 
 @asynccontextmanager
@@ -18,8 +48,37 @@ async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     # 启动时初始化数据库
     await init_db()
+    async with async_session() as db:
+        backfilled = await backfill_class_columns(db)
+        await db.commit()
+        if backfilled:
+            print(f"已为 {backfilled} 条旧识别记录填充作物 / 病害 / 健康状态列")
+        await stats_rollup.ensure_initialized(db)
+        interrupted = await bulk_delete.fail_stale_jobs(db)
+        await db.commit()
+        if interrupted:
+            print(f"已将 {interrupted} 个中断的批量删除任务标记为失败")
+    # 模型在后台线程中加载并预热，不阻塞端口绑定；就绪状态见 /ready
+    app.state.model_loader = asyncio.create_task(asyncio.to_thread(ai_service.load_and_warm_up))
+    registry_watcher = asyncio.create_task(watch_model_registry())
+    queue_stats = asyncio.create_task(refresh_job_queue_stats())
+    orphan_collector = None
+    if settings.ORPHAN_GC_INTERVAL_SECONDS > 0:
+        orphan_collector = asyncio.create_task(collect_orphans_periodically())
+    record_writer.start()
+    job_runner = asyncio.create_task(job_worker.run()) if settings.JOB_WORKER_IN_PROCESS else None
     print(f"🌾 {settings.APP_NAME} v{settings.APP_VERSION} 启动成功")
     yield
+    registry_watcher.cancel()
+    queue_stats.cancel()
+    if orphan_collector is not None:
+        orphan_collector.cancel()
+    if job_runner is not None:
+        # 处理完当前批次再退出
+        job_worker.stop()
+        await job_runner
+    await bulk_delete.cancel_jobs()
+    await record_writer.stop()
     # 关闭时清理资源
     print("👋 应用关闭")
 
@@ -39,6 +98,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
+)
+
+# 限制请求体大小，超出时在接收过程中中止；单图识别按单张图片上限（加上 multipart 分隔和表头的余量）
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_bytes=settings.MAX_REQUEST_SIZE_MB * 1024 * 1024,
+    route_limits={"/api/predict": settings.MAX_UPLOAD_SIZE_MB * 1024 * 1024 + 64 * 1024},
 )
 
 # 挂载静态文件目录（用于访问上传的图片）
@@ -48,6 +115,9 @@ app.mount("/uploads", StaticFiles(directory=settings.UPLOAD_DIR), name="uploads"
 app.include_router(predict_router)
 app.include_router(history_router)
 app.include_router(auth_router)
+app.include_router(admin_router)
+app.include_router(images_router)
+app.include_router(jobs_router)
 
 
 @app.get("/", tags=["健康检查"])
@@ -63,4 +133,26 @@ async def root():
 @app.get("/health", tags=["健康检查"])
 async def health_check():
     """健康检查接口"""
-    return {"status": "healthy"}
\ No newline at end of file
+    return {
+        "status": "healthy",
+        "batching": ai_service.batch_stats(),
+        "prediction_cache": prediction_cache.stats(),
+    }
+
+
+@app.get("/ready", tags=["健康检查"])
+async def readiness_check():
+    """就绪检查接口：模型加载并预热完成后返回 200，否则返回 503"""
+    readiness = ai_service.readiness()
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+
+@app.get("/metrics", tags=["健康检查"], response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """
+    Prometheus 指标
+
+    预测各阶段耗时、推理队列深度、批大小分布、缓存命中率以及各路由的数据库耗时。
+    多 worker 部署时每个进程各自计数，由 Prometheus 按实例聚合。
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
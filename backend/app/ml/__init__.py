@@ -0,0 +1 @@
+"""模型通用组件（不依赖应用配置，训练脚本也可直接导入）"""
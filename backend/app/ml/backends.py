@@ -0,0 +1,136 @@
+"""
+推理后端
+统一 PyTorch（eager / TorchScript）与 ONNX Runtime 的调用方式：
+输入为归一化后的 float 批量张量 (N, 3, H, W)，输出为 logits 张量 (N, num_classes)
+"""
+import json
+import os
+import threading
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+
+# 可选的推理后端名称（对应配置项 INFERENCE_BACKEND）
+BACKEND_NAMES = ("torch", "onnxruntime")
+
+
+class InferenceBackend:
+    """推理后端接口"""
+
+    name = "base"
+    # 输入是否需要 channels_last 内存布局
+    channels_last = False
+    # 是否能同时输出倒数第二层特征（见 forward_with_embedding）
+    supports_embedding = False
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        raise NotImplementedError
+
+    def forward_with_embedding(self, batch: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        """返回 (logits, 倒数第二层特征 (N, dim) float32)"""
+        raise NotImplementedError
+
+
+def _last_linear(module: nn.Module) -> nn.Module | None:
+    """分类头中最后一个全连接层（ResNet 的 fc、MobileNetV3 的 classifier[3]）"""
+    linear_types = (nn.Linear, torch.ao.nn.quantized.Linear)
+    layers = [layer for layer in module.modules() if isinstance(layer, linear_types)]
+    return layers[-1] if layers else None
+
+
+class TorchBackend(InferenceBackend):
+    """PyTorch eager 模型或 TorchScript 模型"""
+
+    def __init__(self, module: nn.Module, channels_last: bool = False):
+        self.module = module
+        self.scripted = isinstance(module, torch.jit.ScriptModule)
+        self.name = "torchscript" if self.scripted else "torch"
+        # TorchScript 模型的权重布局在导出时已固定，不做转换
+        self.channels_last = channels_last and not self.scripted
+        if self.channels_last:
+            self.module = module.to(memory_format=torch.channels_last)
+        # 最后一个全连接层的输入即倒数第二层特征，用前置 hook 截取；TorchScript 模型不支持 hook。
+        # 多个线程会同时调用同一个模型，截取结果按线程保存
+        self._captured = threading.local()
+        head = None if self.scripted else _last_linear(self.module)
+        if head is not None:
+            head.register_forward_pre_hook(self._capture)
+        self.supports_embedding = head is not None
+
+    def _capture(self, _module: nn.Module, inputs: tuple):
+        if getattr(self._captured, "enabled", False):
+            features = inputs[0]
+            self._captured.value = features.dequantize() if features.is_quantized else features
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            return self.module(batch)
+
+    def forward_with_embedding(self, batch: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        if not self.supports_embedding:
+            raise NotImplementedError(f"{self.name} 模型不支持输出特征")
+        self._captured.enabled = True
+        try:
+            with torch.no_grad():
+                logits = self.module(batch)
+            return logits, self._captured.value.flatten(1).float()
+        finally:
+            self._captured.enabled = False
+            self._captured.value = None
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """
+    ONNX Runtime CPU 推理
+
+    会话在首次推理时创建，并在 fork 出的子进程中重新创建：
+    ORT 的线程池不能跨越 fork，预加载模式下父进程只读取模型文件。
+    """
+
+    name = "onnxruntime"
+
+    def __init__(self, path: Path, intra_op_threads: int = 0):
+        try:
+            import onnxruntime  # noqa: F401
+        except ImportError:
+            raise RuntimeError("使用 ONNX Runtime 后端需要安装 onnxruntime: uv sync --extra onnx")
+        self.path = Path(path)
+        self.intra_op_threads = intra_op_threads
+        self._model_bytes = self.path.read_bytes()
+        self._lock = threading.Lock()
+        self._session = None
+        self._session_pid = None
+        self._input_name = None
+
+    def _get_session(self):
+        if self._session is None or self._session_pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._session_pid != os.getpid():
+                    import onnxruntime as ort
+                    options = ort.SessionOptions()
+                    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                    if self.intra_op_threads > 0:
+                        options.intra_op_num_threads = self.intra_op_threads
+                    session = ort.InferenceSession(
+                        self._model_bytes, options, providers=["CPUExecutionProvider"]
+                    )
+                    self._input_name = session.get_inputs()[0].name
+                    self._session = session
+                    self._session_pid = os.getpid()
+        return self._session
+
+    def metadata(self) -> dict[str, str]:
+        """导出时写入的自定义元数据（如类别列表）"""
+        return dict(self._get_session().get_modelmeta().custom_metadata_map)
+
+    def classes(self) -> list[str] | None:
+        """导出时写入的类别名称列表，没有时返回 None"""
+        classes = self.metadata().get("classes")
+        return json.loads(classes) if classes else None
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        session = self._get_session()
+        inputs = batch.contiguous().numpy()
+        (logits,) = session.run(None, {self._input_name: inputs})
+        return torch.from_numpy(logits)
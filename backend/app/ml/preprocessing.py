@@ -0,0 +1,115 @@
+"""
+图像预处理
+服务端推理、训练和量化校准共用的预处理流程：
+
+1. 在 uint8 上完成 Resize(256) + CenterCrop(224)（与 torchvision 的 PIL 实现一致）
+2. 整批转换为 float 并归一化，一次 addcmul 完成，不产生中间张量
+
+与 transforms.Compose([Resize, CenterCrop, ToTensor, Normalize]) 数值等价
+（误差在 float32 舍入范围内，见 tests/test_preprocessing.py）。
+"""
+import torch
+from PIL import Image
+from torchvision.transforms import InterpolationMode
+from torchvision.transforms import functional as F
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+RESIZE_SIZE = 256
+CROP_SIZE = 224
+
+# 测试时增强 (TTA) 级别；none 即常规的单视图推理
+TTA_LEVELS = ("none", "flip", "full")
+
+# normalize 用到的常量，按 (device, dtype) 缓存
+_constants: dict[tuple, tuple[torch.Tensor, torch.Tensor]] = {}
+
+
+def resize_size_for(crop_size: int) -> int:
+    """模型输入边长对应的 Resize 边长（保持 256 / 224 的比例）"""
+    return crop_size * RESIZE_SIZE // CROP_SIZE
+
+
+def resize_and_crop(image: Image.Image, resize_size: int = RESIZE_SIZE, crop_size: int = CROP_SIZE) -> Image.Image:
+    """短边缩放到 resize_size 后中心裁剪 crop_size，全程保持 uint8"""
+    image = F.resize(image, resize_size, interpolation=InterpolationMode.BILINEAR)
+    return F.center_crop(image, crop_size)
+
+
+def to_uint8_tensor(image: Image.Image, resize_size: int = RESIZE_SIZE, crop_size: int = CROP_SIZE) -> torch.Tensor:
+    """
+    单张图片预处理到 uint8 张量
+
+    Returns:
+        (3, crop_size, crop_size) 的 uint8 张量，可直接 stack 成批
+    """
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return F.pil_to_tensor(resize_and_crop(image, resize_size, crop_size))
+
+
+def tta_views(
+    image: Image.Image, level: str, resize_size: int = RESIZE_SIZE, crop_size: int = CROP_SIZE
+) -> torch.Tensor:
+    """
+    由一次解码、一次缩放生成多个 TTA 视图
+
+    - flip: 中心裁剪、水平翻转、垂直翻转（3 个视图）
+    - full: 另加水平 + 垂直翻转和四角裁剪（8 个视图）
+
+    第一个视图与 to_uint8_tensor 的结果完全相同。
+
+    Returns:
+        (V, 3, crop_size, crop_size) 的 uint8 张量
+    """
+    if level not in TTA_LEVELS[1:]:
+        raise ValueError(f"未知的 TTA 级别: {level}")
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    resized = F.pil_to_tensor(F.resize(image, resize_size, interpolation=InterpolationMode.BILINEAR))
+    center = F.center_crop(resized, crop_size)
+    views = [center, center.flip(-1), center.flip(-2)]
+    if level == "full":
+        views.append(center.flip(-2, -1))
+        height, width = resized.shape[-2:]
+        for top in (0, height - crop_size):
+            for left in (0, width - crop_size):
+                views.append(resized[:, top:top + crop_size, left:left + crop_size])
+    return torch.stack(views)
+
+
+def _get_constants(device: torch.device, dtype: torch.dtype) -> tuple[torch.Tensor, torch.Tensor]:
+    key = (device, dtype)
+    if key not in _constants:
+        mean = torch.tensor(IMAGENET_MEAN, dtype=torch.float64)
+        std = torch.tensor(IMAGENET_STD, dtype=torch.float64)
+        # (x / 255 - mean) / std == x * scale + bias
+        scale = (1.0 / (255.0 * std)).to(device=device, dtype=dtype).view(1, 3, 1, 1)
+        bias = (-mean / std).to(device=device, dtype=dtype).view(1, 3, 1, 1)
+        _constants[key] = (scale, bias)
+    return _constants[key]
+
+
+def normalize(batch: torch.Tensor, channels_last: bool = False, dtype: torch.dtype = torch.float32) -> torch.Tensor:
+    """
+    uint8 批量张量转换为归一化后的浮点张量
+
+    Args:
+        batch: (N, 3, H, W) 或 (3, H, W) 的 uint8 张量
+        channels_last: 是否输出 channels_last 内存布局
+        dtype: 输出数据类型
+
+    Returns:
+        归一化后的 (N, 3, H, W) 张量
+    """
+    if batch.dim() == 3:
+        batch = batch.unsqueeze(0)
+    scale, bias = _get_constants(batch.device, dtype)
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    out = torch.empty(batch.shape, dtype=dtype, device=batch.device, memory_format=memory_format)
+    return torch.addcmul(bias, batch, scale, out=out)
+
+
+def preprocess_batch(images: list[Image.Image], channels_last: bool = False) -> torch.Tensor:
+    """多张图片预处理为一个归一化后的批量张量"""
+    return normalize(torch.stack([to_uint8_tensor(image) for image in images]), channels_last=channels_last)
@@ -0,0 +1,138 @@
+"""
+推理运行时调优
+检测可用的量化引擎，按同机 worker 数分配线程预算，并在预热批次上测量各组合的耗时
+"""
+import os
+import platform
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Callable
+
+import torch
+
+# 各平台的量化引擎偏好顺序（调优关闭或只有一个候选时使用第一个可用的）
+_ENGINE_PREFERENCE = {
+    "arm": ("qnnpack",),
+    "x86": ("x86", "fbgemm", "onednn", "qnnpack"),
+}
+
+
+def available_engines() -> list[str]:
+    """当前 PyTorch 构建支持的量化引擎（不含 none）"""
+    return [engine for engine in torch.backends.quantized.supported_engines if engine != "none"]
+
+
+def default_engine() -> str | None:
+    """按平台偏好选择量化引擎，没有可用引擎时返回 None"""
+    engines = available_engines()
+    machine = platform.machine().lower()
+    preference = _ENGINE_PREFERENCE["arm" if "arm" in machine or "aarch64" in machine else "x86"]
+    return next((engine for engine in preference if engine in engines), engines[0] if engines else None)
+
+
+def set_engine(engine: str | None):
+    """切换量化引擎（量化权重在加载时按当前引擎打包，切换后需要重新加载模型）"""
+    if engine is not None and torch.backends.quantized.engine != engine:
+        torch.backends.quantized.engine = engine
+
+
+def cpu_count() -> int:
+    """当前进程可以使用的 CPU 核数（考虑 CPU 亲和性）"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def thread_budget(workers: int) -> int:
+    """每个 worker 的算子内线程上限：同机 worker 平分 CPU 核数，避免线程超额订阅"""
+    return max(1, cpu_count() // max(1, workers))
+
+
+def thread_candidates(budget: int) -> list[int]:
+    """候选线程数：不超过预算的 2 的幂，加上预算本身"""
+    candidates = {budget}
+    threads = 1
+    while threads < budget:
+        candidates.add(threads)
+        threads *= 2
+    return sorted(candidates)
+
+
+def set_interop_threads(threads: int) -> bool:
+    """
+    设置算子间线程数
+
+    PyTorch 只允许在第一次并行执行之前设置一次，之后调用返回 False
+    """
+    if torch.get_num_interop_threads() == threads:
+        return True
+    try:
+        torch.set_num_interop_threads(threads)
+    except RuntimeError:
+        return False
+    return True
+
+
+def measure(run: Callable[[], object], iterations: int) -> float:
+    """先执行一次（触发惰性初始化），再返回 iterations 次执行耗时的中位数（毫秒）"""
+    run()
+    samples = []
+    for _ in range(max(1, iterations)):
+        start = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+@dataclass
+class TuningResult:
+    """调优结果：选定的线程数和量化引擎，以及各候选线程数、各量化引擎（加载时单线程比较）的耗时"""
+    num_threads: int
+    interop_threads: int
+    quantized_engine: str | None
+    latency_ms: float | None
+    workers: int
+    thread_budget: int
+    batch_size: int
+    candidates: list[dict] = field(default_factory=list)
+    engine_candidates: list[dict] = field(default_factory=list)
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+    def summary(self) -> str:
+        engine = self.quantized_engine or "-"
+        latency = f"{self.latency_ms:.2f} ms" if self.latency_ms is not None else "未测量"
+        return (
+            f"线程数 {self.num_threads}（上限 {self.thread_budget}，同机 {self.workers} 个 worker，"
+            f"算子间线程 {self.interop_threads}），量化引擎 {engine}，"
+            f"批大小 {self.batch_size} 耗时 {latency}，共比较 {len(self.candidates)} 个线程数、"
+            f"{len(self.engine_candidates)} 个量化引擎"
+        )
+
+
+def benchmark(
+    runners: dict[str | None, Callable[[], object]],
+    threads: list[int],
+    iterations: int,
+) -> list[dict]:
+    """
+    测量各量化引擎 × 线程数组合的耗时
+
+    Args:
+        runners: 量化引擎 → 在该引擎下加载的模型上执行一次前向传播的函数（非量化模型的键为 None）
+        threads: 候选线程数
+        iterations: 每个组合计时的次数
+
+    Returns:
+        按耗时升序排列的 {"engine", "threads", "latency_ms"} 列表
+    """
+    results = []
+    for engine, run in runners.items():
+        set_engine(engine)
+        for num_threads in threads:
+            torch.set_num_threads(num_threads)
+            latency = measure(run, iterations)
+            results.append({"engine": engine, "threads": num_threads, "latency_ms": round(latency, 2)})
+    return sorted(results, key=lambda item: item["latency_ms"])
@@ -2,8 +2,8 @@
 """
 预测记录模型
 """
-from datetime import datetime
-from sqlalchemy import String, Float, DateTime
+from datetime import date, datetime
+from sqlalchemy import Boolean, Date, Integer, String, Float, DateTime, JSON, Index, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.core.database import Base
@@ -13,9 +13,114 @@ class PredictionRecord(Base):
     病害预测历史记录表
     """
     __tablename__ = "prediction_records"
+    __table_args__ = (
+        # 历史列表按 (created_at, id) 倒序分页，日期范围筛选也走这个索引
+        Index("ix_prediction_records_created_at_id", "created_at", "id"),
+        # 按类别 / 作物 / 健康状态筛选后仍按时间排序
+        Index("ix_prediction_records_class_created_at", "predicted_class", "created_at", "id"),
+        Index("ix_prediction_records_crop_created_at", "crop", "created_at", "id"),
+        Index("ix_prediction_records_healthy_created_at", "is_healthy", "created_at", "id"),
+        Index("ix_prediction_records_confidence", "confidence"),
+        # 删除记录时检查图片是否仍被其他记录引用、孤立文件回收
+        Index("ix_prediction_records_image_path", "image_path"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
-    image_path: Mapped[str] = mapped_column(String, index=False)
-    predicted_class: Mapped[str] = mapped_column(String, index=True)
+    image_path: Mapped[str] = mapped_column(String)
+    predicted_class: Mapped[str] = mapped_column(String)
     confidence: Mapped[float] = mapped_column(Float)
+    # 由 predicted_class 拆出的作物 / 病害 / 是否健康，写入时填充（旧数据由启动时回填）
+    crop: Mapped[str | None] = mapped_column(String, nullable=True)
+    disease: Mapped[str | None] = mapped_column(String, nullable=True)
+    is_healthy: Mapped[bool | None] = mapped_column(Boolean, nullable=True)
+    model_version: Mapped[str | None] = mapped_column(String, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+
+class PredictionCacheEntry(Base):
+    """
+    预测结果缓存表
+    以上传内容的哈希和模型版本为键，重复上传同一张图片时直接复用结果和已保存的图片
+    """
+    __tablename__ = "prediction_cache"
+    __table_args__ = (UniqueConstraint("content_hash", "model_version"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    content_hash: Mapped[str] = mapped_column(String(64))
+    model_version: Mapped[str] = mapped_column(String)
+    image_path: Mapped[str] = mapped_column(String)
+    predicted_class: Mapped[str] = mapped_column(String)
+    confidence: Mapped[float] = mapped_column(Float)
+    top_predictions: Mapped[list] = mapped_column(JSON)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+
+
+class PredictionDailyStat(Base):
+    """
+    识别记录按 日期 × 类别 的汇总表
+    与识别记录的插入 / 删除在同一事务中增量维护，统计接口直接读取计数
+    """
+    __tablename__ = "prediction_daily_stats"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    predicted_class: Mapped[str] = mapped_column(String, primary_key=True)
+    crop: Mapped[str] = mapped_column(String, index=True)
+    is_healthy: Mapped[bool] = mapped_column(Boolean)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class BulkDeleteJob(Base):
+    """
+    后台批量删除任务
+    状态保存在数据库中，多进程部署时任意 worker 都能查询进度
+    """
+    __tablename__ = "bulk_delete_jobs"
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    status: Mapped[str] = mapped_column(String, default="pending")  # pending / running / succeeded / failed
+    total: Mapped[int] = mapped_column(Integer)
+    deleted: Mapped[int] = mapped_column(Integer, default=0)
+    deleted_files: Mapped[int] = mapped_column(Integer, default=0)
+    error: Mapped[str | None] = mapped_column(String, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    # 执行任务的进程最近一次更新进度的时间，用于发现进程被杀死后遗留的任务
+    heartbeat_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class PredictionJob(Base):
+    """
+    异步识别任务
+    数据库即队列：API 进程入队，worker 进程以一条 UPDATE ... RETURNING 原子地领取一批任务，
+    领取后 leased_until 之前对其他 worker 不可见
+    """
+    __tablename__ = "prediction_jobs"
+    __table_args__ = (
+        # 领取排队中的任务 / 回收租约过期的任务
+        Index("ix_prediction_jobs_status_available_at", "status", "available_at"),
+        Index("ix_prediction_jobs_status_leased_until", "status", "leased_until"),
+        # 清理过期的已结束任务
+        Index("ix_prediction_jobs_finished_at", "finished_at"),
+        # 孤立文件回收时检查图片是否仍被任务引用
+        Index("ix_prediction_jobs_image_path", "image_path"),
+    )
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    status: Mapped[str] = mapped_column(String, default="queued")  # queued / running / succeeded / failed
+    image_path: Mapped[str] = mapped_column(String)
+    content_hash: Mapped[str] = mapped_column(String(64))
+    tta: Mapped[str] = mapped_column(String, default="none")
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    max_attempts: Mapped[int] = mapped_column(Integer)
+    # 排队中的任务在此时间之后才能被领取（重试退避）
+    available_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    # 持有租约的 worker 及租约到期时间
+    worker_id: Mapped[str | None] = mapped_column(String, nullable=True)
+    leased_until: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    result: Mapped[dict | None] = mapped_column(JSON, nullable=True)
+    record_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    error: Mapped[str | None] = mapped_column(String, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
@@ -3,7 +3,9 @@
 用于请求/响应数据验证
 """
 from datetime import datetime
-from pydantic import BaseModel
+from pydantic import BaseModel, computed_field
+
+from app.core.urls import derived_url
 
 
 class TopPrediction(BaseModel):
@@ -22,6 +24,8 @@ class PredictionResponse(BaseModel):
     confidence: float     # 置信度 (0-1)
     image_url: str        # 图片访问路径
     top_predictions: list[dict]  # Top-3 预测结果
+    model_version: str | None = None  # 产生该结果的模型版本
+    tta: str = "none"  # 测试时增强级别
     
     class Config:
         from_attributes = True
@@ -33,7 +37,69 @@ class PredictionHistoryResponse(BaseModel):
     image_path: str
     predicted_class: str
     confidence: float
+    crop: str | None = None
+    disease: str | None = None
+    is_healthy: bool | None = None
+    model_version: str | None = None
+    created_at: datetime
+    
+    @computed_field
+    @property
+    def thumbnail_url(self) -> str:
+        """缩略图地址（列表展示用）"""
+        return derived_url(self.image_path, "thumb")
+    
+    @computed_field
+    @property
+    def preview_url(self) -> str:
+        """预览图地址（详情 / 放大查看用）"""
+        return derived_url(self.image_path, "preview")
+    
+    class Config:
+        from_attributes = True
+
+
+class SimilarCase(BaseModel):
+    """相似病例：历史记录及其与查询记录的余弦相似度"""
+    similarity: float
+    record: PredictionHistoryResponse
+
+
+class SimilarCasesResponse(BaseModel):
+    """相似病例检索结果"""
+    record_id: int
+    model_version: str | None = None  # 特征所属的模型版本，只在同一版本的记录中检索
+    results: list[SimilarCase]
+
+
+class BulkDeleteJobResponse(BaseModel):
+    """后台批量删除任务"""
+    id: str
+    status: str  # pending / running / succeeded / failed
+    total: int
+    deleted: int
+    deleted_files: int
+    error: str | None = None
+    created_at: datetime
+    finished_at: datetime | None = None
+    
+    class Config:
+        from_attributes = True
+
+
+class PredictionJobResponse(BaseModel):
+    """异步识别任务"""
+    id: str
+    status: str  # queued / running / succeeded / failed
+    attempts: int
+    max_attempts: int
+    tta: str = "none"
+    result: PredictionResponse | None = None  # 成功后的识别结果
+    record_id: int | None = None  # 成功后对应的识别记录
+    error: str | None = None  # 最近一次失败的原因（重试中的任务也会保留）
     created_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
@@ -2,165 +2,836 @@
 AI 推理服务
 单例模式加载模型，提供病害预测功能
 """
+import asyncio
+import io
 import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
 from pathlib import Path
+from typing import AsyncIterator, BinaryIO
 from PIL import Image
 import torch
 import torch.nn as nn
-from torchvision import transforms, models
+from torchvision import models
 import torch.quantization
 
-# torch.backends.quantized.engine = 'fbgemm' # Not supported on this env
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.ml import tuning
+from app.ml.backends import InferenceBackend, OnnxRuntimeBackend, TorchBackend
+from app.ml.preprocessing import RESIZE_SIZE, normalize, resize_size_for, to_uint8_tensor, tta_views
+from app.services.batching import MicroBatcher
+from app.services.executor import BoundedExecutor, ExecutorBusyError
+from app.services.model_registry import QUANTIZED_FORMATS, ModelSpec, model_registry
+from app.services.prediction_cache import prediction_cache
 
 
+INFERENCE_STAGE_SECONDS = metrics.histogram(
+    "cropvision_inference_stage_seconds",
+    "Time spent in each stage of AIService.predict",
+    ("stage",),
+)
+INFERENCE_BATCH_SIZE = metrics.histogram(
+    "cropvision_inference_batch_size",
+    "Number of images per forward pass",
+    ("source",),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+CASCADE_IMAGES = metrics.counter(
+    "cropvision_cascade_images_total",
+    "Images answered by each model of the cascade (teacher = escalated)",
+    ("path",),
+)
+
+
+class ModelNotReadyError(RuntimeError):
+    """模型尚未加载完成，调用方应返回 503"""
+    pass
+
+
+class ModelSwapInProgressError(RuntimeError):
+    """已有模型切换正在进行"""
+    pass
 
-from app.core.config import settings
+
+@dataclass
+class LoadedModel:
+    """已加载的模型及其元数据（model 为 None 表示模拟模式）"""
+    version: str
+    model: InferenceBackend | None
+    class_mapping: dict[str, str]
+    architecture: str = ""
+    input_size: int = 224
+    # 级联模式下的教师模型；此时 version 为 学生+教师 的组合标识，student_version 为学生模型的注册表版本
+    teacher: "LoadedModel | None" = None
+    student_version: str | None = None
+
+
+@dataclass
+class PredictionResult:
+    """单张图片的预测结果"""
+    predicted_class: str
+    confidence: float
+    top_predictions: list[dict]
+    model_version: str
+    # 倒数第二层特征（开启 EMBEDDING_INDEX_ENABLED 且模型支持时）
+    embedding: torch.Tensor | None = None
 
 
 class AIService:
-    """AI 推理服务（单例模式）"""
-    
+    """
+    AI 推理服务（单例模式）
+
+    创建实例时不加载模型；由应用启动流程在后台调用 load_and_warm_up()，
+    完成前 predict 系列方法抛出 ModelNotReadyError。
+
+    当前模型保存在 _active 中，热切换时整体替换该引用：
+    已经开始的批次继续使用旧模型，之后的批次使用新模型。
+    """
+
     _instance = None
-    _model = None
-    _class_mapping = None
-    _transform = None
-    
+    _initialized = False
+    _active: LoadedModel | None = None
+    _batcher = None
+    _executor = None
+    _decode_pool = None
+    _decode_pool_pid = None
+
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
         return cls._instance
-    
+
     def __init__(self):
-        if self._model is None:
-            self._load_model()
-            self._setup_transform()
-    
-
-
-    def _load_mobilenet_quantized(self):
-        """Try to load the new quantized MobileNetV3 model"""
-        # Define paths for new model (this is a placeholder logic, usually we'd have a config switch)
-        # For now, we will add a check in _load_model to prefer this if it exists
-        pass
-
-    def _load_model(self):
-        """加载训练好的模型"""
-        # Prioritize Quantized Utils if available
-        quantized_path = settings.MODEL_DIR / "quantized_model_scripted.pt" 
-        # Or state dict path
-        quantized_state_path = settings.MODEL_DIR / "quantized_mobilenet_se.pth"
-        
-        mapping_path = settings.MODEL_DIR / settings.CLASS_MAPPING_PATH
-        model_path = settings.MODEL_DIR / settings.MODEL_PATH # Fallback old model
-
-        # Load Mapping
+        if not self._initialized:
+            self._initialized = True
+            self._load_lock = threading.Lock()
+            self._swap_lock = threading.Lock()
+            self._status = "pending"
+            self._error: str | None = None
+            self._load_time_ms: float | None = None
+            self._warmup_ms: dict[int, float] = {}
+            self._tuning: tuning.TuningResult | None = None
+            self._engine_candidates: list[dict] = []
+            self._swap: dict = {"state": "idle"}
+            self._batcher = MicroBatcher(
+                self._run_batch,
+                max_batch_size=settings.BATCH_MAX_SIZE,
+                max_wait_ms=settings.BATCH_MAX_WAIT_MS,
+            )
+            self._executor = BoundedExecutor(
+                max_workers=settings.INFERENCE_WORKERS,
+                max_pending=settings.INFERENCE_QUEUE_SIZE,
+            )
+
+    def load(self):
+        """加载当前激活的模型并选定量化引擎（幂等，可在 fork 前由父进程预先调用）"""
+        with self._load_lock:
+            if self._status not in ("pending", "failed"):
+                return
+            self._status = "loading"
+            start = time.perf_counter()
+            try:
+                # 量化权重在加载时按当前引擎打包，需要先确定引擎
+                tuning.set_engine(settings.QUANTIZED_ENGINE or tuning.default_engine())
+                self._active = self._select_engine(self._load_model())
+            except Exception as e:
+                self._status = "failed"
+                self._error = str(e)
+                raise
+            self._load_time_ms = round((time.perf_counter() - start) * 1000, 1)
+            self._status = "loaded"
+
+    def _warm_up_model(self, handle: LoadedModel, batch_sizes: list[int], iterations: int = 2) -> dict[int, float]:
+        """
+        用合成输入按各批大小执行几次前向传播
+
+        触发算子的惰性初始化和内存分配，避免第一个真实请求承担这部分开销；
+        返回每个批大小最后一次前向传播的耗时（毫秒）。
+        """
+        latencies = {}
+        if handle.model is None:
+            return latencies
+        if handle.teacher is not None:
+            # 合成输入未必触发升级，教师模型单独预热；返回的延迟为学生模型的延迟
+            self._warm_up_model(handle.teacher, batch_sizes, iterations)
+        for batch_size in sorted(set(batch_sizes)):
+            batch = torch.randint(0, 256, (batch_size, 3, handle.input_size, handle.input_size), dtype=torch.uint8)
+            for _ in range(max(1, iterations)):
+                start = time.perf_counter()
+                self._probabilities(batch, handle)
+                elapsed = time.perf_counter() - start
+            latencies[batch_size] = round(elapsed * 1000, 2)
+        return latencies
+
+    def _model_spec(self, handle: LoadedModel) -> ModelSpec | None:
+        """当前模型（级联模式下为学生模型）在注册表中的条目，模拟模式下为 None"""
+        try:
+            return model_registry.get(handle.student_version or handle.version)
+        except KeyError:
+            return None
+
+    def _select_engine(self, handle: LoadedModel) -> LoadedModel:
+        """
+        比较各量化引擎，返回在最快引擎下加载的模型（load() 中调用，每个进程树只执行一次）
+
+        量化权重按引擎打包，比较需要按每个引擎重新加载模型，因此放在加载阶段：
+        预加载部署时由父进程在 fork 前完成，worker 直接共享选定的模型，不再各自重新加载。
+        比较固定使用 1 个算子内线程（不启动 OpenMP 线程池，fork 后子进程不受影响），
+        线程数在各 worker 的 tune() 中确定。级联模式下只比较学生模型。
+        """
+        spec = self._model_spec(handle) if handle.model is not None else None
+        if (
+            not settings.AUTOTUNE_ENABLED
+            or settings.QUANTIZED_ENGINE
+            or spec is None
+            or spec.format not in QUANTIZED_FORMATS
+            or handle.model.name == "onnxruntime"
+        ):
+            return handle
+        handles = {torch.backends.quantized.engine: handle}
+        for engine in tuning.available_engines():
+            if engine in handles:
+                continue
+            tuning.set_engine(engine)
+            try:
+                candidate = self.build_model(spec)
+            except Exception as e:
+                print(f"量化引擎 {engine} 加载失败，跳过: {e}")
+                continue
+            if handle.teacher is not None:
+                candidate = self._make_cascade(candidate, handle.teacher)
+            handles[engine] = candidate
+
+        size = handle.input_size
+        batch = torch.randint(0, 256, (max(1, settings.AUTOTUNE_BATCH_SIZE), 3, size, size), dtype=torch.uint8)
+        runners = {engine: (lambda h=h: self._probabilities(batch, h)) for engine, h in handles.items()}
+        self._engine_candidates = tuning.benchmark(runners, [1], settings.AUTOTUNE_ITERATIONS)
+        best = self._engine_candidates[0]["engine"]
+        tuning.set_engine(best)
+        return handles[best]
+
+    def tune(self):
+        """
+        固定推理线程数（在预热之前、处理请求之前由每个 worker 调用）
+
+        线程上限为 CPU 核数 / SERVE_WORKERS。开启 AUTOTUNE_ENABLED 时在合成批次上比较
+        候选线程数，使用 load() 时选定的量化引擎和已加载的模型，不重新加载模型
+        （预加载部署时 worker 继续共享父进程的权重内存页）。
+        """
+        handle = self._active
+        workers = max(1, settings.SERVE_WORKERS)
+        budget = tuning.thread_budget(workers)
+        interop = settings.TORCH_INTEROP_THREADS if settings.TORCH_INTEROP_THREADS > 0 else budget
+        if not tuning.set_interop_threads(interop):
+            interop = torch.get_num_interop_threads()
+        threads = [settings.TORCH_NUM_THREADS] if settings.TORCH_NUM_THREADS > 0 else tuning.thread_candidates(budget)
+        result = tuning.TuningResult(
+            num_threads=threads[-1],
+            interop_threads=interop,
+            quantized_engine=torch.backends.quantized.engine,
+            latency_ms=None,
+            workers=workers,
+            thread_budget=budget,
+            batch_size=settings.AUTOTUNE_BATCH_SIZE,
+            engine_candidates=self._engine_candidates,
+        )
+
+        if handle.model is not None and handle.model.name == "onnxruntime":
+            # ORT 使用自己的线程池，未配置 ONNX_INTRA_OP_THREADS 时同样按预算限制
+            if settings.ONNX_INTRA_OP_THREADS <= 0:
+                handle.model.intra_op_threads = budget
+        elif handle.model is not None and settings.AUTOTUNE_ENABLED:
+            spec = self._model_spec(handle)
+            # 非量化模型与量化引擎无关（键为 None）
+            engine = result.quantized_engine if spec is not None and spec.format in QUANTIZED_FORMATS else None
+            size = handle.input_size
+            batch = torch.randint(0, 256, (max(1, settings.AUTOTUNE_BATCH_SIZE), 3, size, size), dtype=torch.uint8)
+            result.candidates = tuning.benchmark(
+                {engine: lambda: self._probabilities(batch, handle)}, threads, settings.AUTOTUNE_ITERATIONS
+            )
+            best = result.candidates[0]
+            result.num_threads = best["threads"]
+            result.latency_ms = best["latency_ms"]
+
+        tuning.set_engine(result.quantized_engine)
+        torch.set_num_threads(result.num_threads)
+        self._tuning = result
+        print(f"推理调优: {result.summary()}")
+
+    def warm_up(self, batch_sizes: list[int], iterations: int = 2):
+        """预热当前模型"""
+        self._warmup_ms = self._warm_up_model(self._active, batch_sizes, iterations)
+        if 1 in self._warmup_ms:
+            self._record_latency(self._active.version, self._warmup_ms[1])
+        self._status = "ready"
+
+    @staticmethod
+    def _record_latency(version: str, latency_ms: float):
+        """把实测延迟写入注册表清单；写入失败只打印警告，不影响模型就绪"""
+        try:
+            model_registry.record_latency(version, latency_ms)
+        except Exception as e:
+            print(f"记录模型延迟失败 ({version}): {e}")
+
+    def load_and_warm_up(self):
+        """启动时在后台线程中执行：加载模型并预热"""
+        try:
+            self.load()
+            self._status = "tuning"
+            self.tune()
+            self._status = "warming_up"
+            self.warm_up(settings.WARMUP_BATCH_SIZES, settings.WARMUP_ITERATIONS)
+        except Exception as e:
+            self._status = "failed"
+            self._error = str(e)
+            print(f"模型加载失败: {e}")
+            return
+        mode = "模拟模式" if self._active.model is None else self._active.version
+        print(f"模型已就绪 ({mode})，加载耗时 {self._load_time_ms} ms，预热耗时 {self._warmup_ms}")
+
+    @property
+    def is_ready(self) -> bool:
+        return self._status == "ready"
+
+    def readiness(self) -> dict:
+        """就绪状态：加载耗时、各批大小的预热延迟以及模型切换状态"""
+        return {
+            "status": self._status,
+            "ready": self.is_ready,
+            "model_version": self.model_version,
+            "architecture": self._active.architecture if self._active else None,
+            "backend": self.backend_name,
+            "cascade": self.cascade_info(),
+            "load_time_ms": self._load_time_ms,
+            "warmup_latency_ms": self._warmup_ms,
+            "tuning": self._tuning.as_dict() if self._tuning else None,
+            "model_swap": self._swap,
+            "error": self._error,
+        }
+
+    def _ensure_ready(self):
+        if not self.is_ready:
+            raise ModelNotReadyError(f"模型尚未就绪（{self._status}）")
+
+    def _read_class_mapping(self, filename: str) -> dict[str, str]:
+        mapping_path = settings.MODEL_DIR / filename
         if mapping_path.exists():
             with open(mapping_path, "r") as f:
-                self._class_mapping = json.load(f)
-        else:
-            self._class_mapping = {str(i): f"Disease_{i}" for i in range(38)}
-            
-        # Try loading Quantized Script Model first (Fastest)
-        if quantized_path.exists():
-            print(f"Loading Quantized Model (Scripted) from {quantized_path}")
+                return json.load(f)
+        return {str(i): f"Disease_{i}" for i in range(38)}
+
+    def _load_model(self) -> LoadedModel:
+        """
+        加载注册表中当前激活的模型
+
+        有清单时只加载清单指定的版本；没有清单时按旧的固定顺序依次尝试，
+        全部不存在则进入模拟模式。
+        """
+        model_registry.reload(force=True)
+        if settings.CASCADE_ENABLED:
+            handle = self._load_cascade()
+            if handle is not None:
+                return handle
+        if model_registry.has_manifest:
+            return self.build_model(model_registry.get(model_registry.active_version))
+
+        for spec in model_registry.list():
             try:
-                self._model = torch.jit.load(quantized_path)
-                self._model.eval()
-                print("Quantized Model Loaded Successfully")
-                return
+                return self.build_model(spec)
             except Exception as e:
-                print(f"Failed to load scripted model: {e}")
-
-        # Try loading Quantized State Dict
-        if quantized_state_path.exists():
-             print(f"Loading Quantized Model (State Dict) from {quantized_state_path}")
-             try:
-                 # Reconstruct Model Structure
-                 from torchvision.models import mobilenet_v3_large
-                 model = mobilenet_v3_large(weights=None)
-                 num_classes = len(self._class_mapping)
-                 model.classifier[3] = nn.Linear(model.classifier[3].in_features, num_classes)
-                 
-                 # Prepare for QAT/Quantization structure matches
-                 model.qconfig = torch.ao.quantization.get_default_qat_qconfig('fbgemm')
-                 torch.ao.quantization.prepare_qat(model, inplace=True)
-                 torch.ao.quantization.convert(model, inplace=True)
-                 
-                 model.load_state_dict(torch.load(quantized_state_path, map_location='cpu'))
-                 self._model = model
-                 self._model.eval()
-                 return
-             except Exception as e:
-                 print(f"Failed to load quantized state dict: {e}")
-
-        # Fallback to Original ResNet50
-        print(f"Loading Standard Model from {model_path}")
-        if not model_path.exists():
-            print(f"警告: 模型文件不存在 {model_path}，使用模拟模式")
-            return
-        
-        checkpoint = torch.load(model_path, map_location="cpu", weights_only=False)
-        num_classes = checkpoint.get("num_classes", len(self._class_mapping))
-        
-        self._model = models.resnet50(weights=None)
-        self._model.fc = nn.Sequential(
-            nn.Dropout(0.5),
-            nn.Linear(self._model.fc.in_features, num_classes)
+                print(f"Failed to load {spec.artifact}: {e}")
+
+        print(f"警告: 模型文件不存在 {settings.MODEL_DIR / settings.MODEL_PATH}，使用模拟模式")
+        return LoadedModel(
+            version="mock",
+            model=None,
+            class_mapping=self._read_class_mapping(settings.CLASS_MAPPING_PATH),
         )
-        self._model.load_state_dict(checkpoint["model_state_dict"])
-        self._model.eval()
-        
-        if "classes" in checkpoint:
-            self._class_mapping = {str(i): name for i, name in enumerate(checkpoint["classes"])}
-
-    
-    def _setup_transform(self):
-        """设置图像预处理"""
-        self._transform = transforms.Compose([
-            transforms.Resize(256),
-            transforms.CenterCrop(224),
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-        ])
-    
-    def predict(self, image_path: Path) -> tuple[str, float, list[dict]]:
+
+    def build_model(self, spec: ModelSpec, backend: str | None = None) -> LoadedModel:
         """
-        对图片进行病害预测
-        
+        按注册表条目加载模型文件
+
         Args:
-            image_path: 图片路径
-            
+            spec: 注册表条目
+            backend: 推理后端（torch / onnxruntime），默认取配置项 INFERENCE_BACKEND；
+                选择 onnxruntime 时优先加载同名 .onnx 文件
+        """
+        artifact_path = settings.MODEL_DIR / spec.artifact
+        class_mapping = self._read_class_mapping(spec.class_mapping)
+        backend = backend or settings.INFERENCE_BACKEND
+
+        onnx_path = artifact_path if spec.format == "onnx" else artifact_path.with_suffix(".onnx")
+        if spec.format == "onnx" or (backend == "onnxruntime" and onnx_path.exists()):
+            print(f"Loading ONNX Model from {onnx_path}")
+            engine = OnnxRuntimeBackend(onnx_path, intra_op_threads=settings.ONNX_INTRA_OP_THREADS)
+            classes = engine.classes()
+            if classes:
+                class_mapping = {str(i): name for i, name in enumerate(classes)}
+            return LoadedModel(
+                version=spec.version,
+                model=engine,
+                class_mapping=class_mapping,
+                architecture=spec.architecture,
+                input_size=spec.input_size,
+            )
+        if backend == "onnxruntime":
+            print(f"警告: 未找到 {onnx_path.name}，{spec.artifact} 回退到 PyTorch 后端")
+
+        if spec.format == "torchscript":
+            print(f"Loading Quantized Model (Scripted) from {artifact_path}")
+            model = torch.jit.load(artifact_path)
+            model.eval()
+            print("Quantized Model Loaded Successfully")
+
+        elif spec.format == "quantized_state_dict":
+            print(f"Loading Quantized Model (State Dict) from {artifact_path}")
+            # Reconstruct Model Structure
+            from torchvision.models import mobilenet_v3_large
+            model = mobilenet_v3_large(weights=None)
+            num_classes = len(class_mapping)
+            model.classifier[3] = nn.Linear(model.classifier[3].in_features, num_classes)
+
+            # Prepare for QAT/Quantization structure matches（按当前量化引擎，见 tuning）
+            model.qconfig = torch.ao.quantization.get_default_qat_qconfig(torch.backends.quantized.engine)
+            torch.ao.quantization.prepare_qat(model, inplace=True)
+            torch.ao.quantization.convert(model, inplace=True)
+
+            # 量化权重加载后会被重新打包，mmap 无法共享，这里保持普通加载
+            model.load_state_dict(torch.load(artifact_path, map_location='cpu'))
+            model.eval()
+
+        elif spec.format == "resnet50_checkpoint":
+            print(f"Loading Standard Model from {artifact_path}")
+            # mmap 加载时权重直接引用文件页，assign=True 避免再复制一份，
+            # 多个 worker 进程共享同一份页缓存
+            checkpoint = torch.load(artifact_path, map_location="cpu", weights_only=False, mmap=settings.MODEL_MMAP)
+            num_classes = checkpoint.get("num_classes", len(class_mapping))
+
+            model = models.resnet50(weights=None)
+            model.fc = nn.Sequential(
+                nn.Dropout(0.5),
+                nn.Linear(model.fc.in_features, num_classes)
+            )
+            model.load_state_dict(checkpoint["model_state_dict"], assign=settings.MODEL_MMAP)
+            model.eval()
+
+            if "classes" in checkpoint:
+                class_mapping = {str(i): name for i, name in enumerate(checkpoint["classes"])}
+
+        else:
+            raise ValueError(f"不支持的模型格式: {spec.format}")
+
+        return LoadedModel(
+            version=spec.version,
+            model=TorchBackend(model, channels_last=settings.CHANNELS_LAST),
+            class_mapping=class_mapping,
+            architecture=spec.architecture,
+            input_size=spec.input_size,
+        )
+
+    def _load_cascade(self) -> LoadedModel | None:
+        """
+        加载级联模式的学生模型和教师模型
+
+        版本未配置时，学生取注册表中第一个量化模型，教师取第一个 ResNet50 模型；
+        任一模型不存在时返回 None，回退到单模型加载。
+        """
+        specs = model_registry.list()
+
+        def pick(version: str, formats: tuple[str, ...]) -> ModelSpec | None:
+            if version:
+                return model_registry.get(version)
+            return next((spec for spec in specs if spec.format in formats), None)
+
+        student = pick(settings.CASCADE_STUDENT_VERSION, QUANTIZED_FORMATS)
+        teacher = pick(settings.CASCADE_TEACHER_VERSION, ("resnet50_checkpoint",))
+        if student is None or teacher is None or student.version == teacher.version:
+            print("警告: 级联模式需要学生模型和教师模型各一个，回退到单模型")
+            return None
+        return self._make_cascade(self.build_model(student), self.build_model(teacher))
+
+    @staticmethod
+    def _make_cascade(student: LoadedModel, teacher: LoadedModel) -> LoadedModel:
+        """把学生模型和教师模型组合为一个级联模型"""
+        if student.input_size != teacher.input_size:
+            raise ValueError(f"级联模型的输入尺寸不一致: {student.input_size} / {teacher.input_size}")
+        if student.class_mapping != teacher.class_mapping:
+            raise ValueError(f"级联模型的类别映射不一致: {student.version} / {teacher.version}")
+        # 版本标识包含阈值：阈值变化后预测缓存随之失效
+        version = (
+            f"cascade:{student.version}+{teacher.version}"
+            f"@{settings.CASCADE_MIN_CONFIDENCE:g}/{settings.CASCADE_MIN_MARGIN:g}"
+        )
+        return replace(
+            student,
+            version=version,
+            architecture=f"{student.architecture}+{teacher.architecture}",
+            teacher=teacher,
+            student_version=student.version,
+        )
+
+    def cascade_info(self) -> dict | None:
+        """级联模式的模型、阈值和已升级到教师模型的图片比例"""
+        if self._active is None or self._active.teacher is None:
+            return None
+        student = CASCADE_IMAGES.value(path="student")
+        teacher = CASCADE_IMAGES.value(path="teacher")
+        return {
+            "student": self._active.student_version,
+            "teacher": self._active.teacher.version,
+            "min_confidence": settings.CASCADE_MIN_CONFIDENCE,
+            "min_margin": settings.CASCADE_MIN_MARGIN,
+            "escalation_rate": round(teacher / (student + teacher), 4) if student + teacher else None,
+        }
+
+    @property
+    def model_version(self) -> str | None:
+        """当前模型的版本标识（模拟模式下为 mock，加载前为 None）"""
+        return self._active.version if self._active else None
+
+    @property
+    def backend_name(self) -> str | None:
+        """当前实际使用的推理后端（torch / torchscript / onnxruntime / mock）"""
+        if self._active is None:
+            return None
+        return self._active.model.name if self._active.model is not None else "mock"
+
+    def start_model_swap(self, version: str):
+        """
+        在后台加载、预热指定版本，完成后原子替换当前模型
+
+        Raises:
+            KeyError: 注册表中没有该版本
+            ModelSwapInProgressError: 已有切换正在进行
+        """
+        model_registry.reload()
+        spec = model_registry.get(version)
+        with self._swap_lock:
+            if self._swap["state"] in ("loading", "warming_up"):
+                raise ModelSwapInProgressError(f"正在切换到 {self._swap['target']}")
+            self._swap = {"state": "loading", "target": version, "error": None}
+        threading.Thread(target=self._swap_model, args=(spec,), name="model-swap", daemon=True).start()
+
+    def _swap_model(self, spec: ModelSpec):
+        start = time.perf_counter()
+        try:
+            handle = self.build_model(spec)
+            # 级联模式下切换的是学生模型，教师模型保持不变
+            current = self._active
+            if current is not None and current.teacher is not None and spec.version != current.teacher.version:
+                handle = self._make_cascade(handle, current.teacher)
+            self._swap["state"] = "warming_up"
+            warmup_ms = self._warm_up_model(handle, settings.WARMUP_BATCH_SIZES, settings.WARMUP_ITERATIONS)
+        except Exception as e:
+            self._swap = {"state": "failed", "target": spec.version, "error": str(e)}
+            print(f"模型切换失败 ({spec.version}): {e}")
+            return
+
+        previous = self._active.version if self._active else None
+        # 引用替换是原子的，进行中的批次继续使用旧模型直到完成
+        self._active = handle
+        self._warmup_ms = warmup_ms
+        # 切换只发生一次，由此删除旧版本的缓存条目（查询时只失效本进程的 LRU）
+        prediction_cache.retire_other_versions(handle.version)
+        model_registry.set_active(spec.version)
+        if 1 in warmup_ms:
+            self._record_latency(spec.version, warmup_ms[1])
+        self._swap = {
+            "state": "done",
+            "target": spec.version,
+            "previous": previous,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+            "error": None,
+        }
+        print(f"模型已切换: {previous} -> {spec.version}")
+
+    def sync_with_registry(self):
+        """
+        清单中的激活版本被其他进程修改时跟随切换
+
+        多 worker 部署下管理接口只会落到其中一个进程，其余进程靠定期调用本方法同步。
+        """
+        if not self.is_ready or not model_registry.reload():
+            return
+        target = model_registry.active_version
+        current = self._active.student_version or self._active.version
+        if not model_registry.has_manifest or target is None or target == current:
+            return
+        try:
+            self.start_model_swap(target)
+        except (KeyError, ModelSwapInProgressError):
+            pass
+
+    @staticmethod
+    def _probabilities(
+        batch: torch.Tensor, handle: LoadedModel, views: int = 1, embeddings: bool = False
+    ) -> tuple[torch.Tensor, torch.Tensor | None]:
+        """
+        单个模型的前向传播；每 views 个相邻视图属于同一张图片
+
         Returns:
-            (预测类别, 置信度, Top-3预测列表)
+            (按图片平均后的概率, 按图片平均后的倒数第二层特征；embeddings=False 时为 None)
         """
-        # 加载并预处理图片
-        image = Image.open(image_path).convert("RGB")
-        input_tensor = self._transform(image).unsqueeze(0)
-        
-        # 模拟模式（模型未加载时）
-        if self._model is None:
-            import random
-            idx = random.randint(0, len(self._class_mapping) - 1)
-            conf = random.uniform(0.7, 0.99)
-            top_predictions = [{"class": self._class_mapping[str(idx)], "confidence": round(conf, 4)}]
-            return self._class_mapping[str(idx)], conf, top_predictions
-        
-        # 推理
-        with torch.no_grad():
-            outputs = self._model(input_tensor)
-            probabilities = torch.softmax(outputs, dim=1)
-            top3_conf, top3_idx = torch.topk(probabilities, k=min(3, probabilities.size(1)), dim=1)
-        
-        # 构建 Top-3 结果
+        inputs = normalize(batch, channels_last=handle.model.channels_last)
+        if embeddings:
+            logits, features = handle.model.forward_with_embedding(inputs)
+        else:
+            logits, features = handle.model(inputs), None
+        probabilities = torch.softmax(logits, dim=1)
+        if views > 1:
+            probabilities = probabilities.view(-1, views, probabilities.size(1)).mean(dim=1)
+            if features is not None:
+                features = features.view(-1, views, features.size(1)).mean(dim=1)
+        return probabilities, features
+
+    def _forward(self, batch: torch.Tensor, handle: LoadedModel | None = None, views: int = 1) -> torch.Tensor:
+        """批量前向传播，输入为 uint8 批量张量，返回每张图片的类别概率 (N / views, num_classes)"""
+        return self._infer(batch, handle or self._active, views)[0]
+
+    @staticmethod
+    def _wants_embeddings(handle: LoadedModel) -> bool:
+        return settings.EMBEDDING_INDEX_ENABLED and handle.model.supports_embedding
+
+    def _infer(
+        self, batch: torch.Tensor, handle: LoadedModel, views: int = 1, embeddings: bool = False
+    ) -> tuple[torch.Tensor, torch.Tensor | None]:
+        """
+        批量前向传播，同时可选返回倒数第二层特征（见 _probabilities）
+
+        级联模式下整批先经过学生模型，置信度或 Top-1 / Top-2 差值低于阈值的图片
+        取出对应的输入行，作为一个子批次交给教师模型，结果替换学生模型的概率；
+        特征始终取自学生模型，同一模型版本的特征处于同一空间。
+        """
+        if handle.teacher is None:
+            return self._probabilities(batch, handle, views, embeddings)
+
+        with INFERENCE_STAGE_SECONDS.time(stage="cascade_student"):
+            probabilities, features = self._probabilities(batch, handle, views, embeddings)
+        top2 = torch.topk(probabilities, k=min(2, probabilities.size(1)), dim=1).values
+        margin = top2[:, 0] - top2[:, 1] if top2.size(1) > 1 else top2[:, 0]
+        uncertain = (top2[:, 0] < settings.CASCADE_MIN_CONFIDENCE) | (margin < settings.CASCADE_MIN_MARGIN)
+        escalated = uncertain.nonzero().flatten()
+
+        CASCADE_IMAGES.inc(probabilities.size(0) - escalated.numel(), path="student")
+        if escalated.numel():
+            CASCADE_IMAGES.inc(escalated.numel(), path="teacher")
+            rows = batch.view(-1, views, *batch.shape[1:])[escalated].flatten(0, 1)
+            INFERENCE_BATCH_SIZE.observe(escalated.numel(), source="cascade_teacher")
+            with INFERENCE_STAGE_SECONDS.time(stage="cascade_teacher"):
+                probabilities[escalated] = self._probabilities(rows, handle.teacher, views)[0]
+        return probabilities, features
+
+    def _run_batch(self, batch: torch.Tensor) -> list[tuple[torch.Tensor, torch.Tensor | None, LoadedModel]]:
+        """微批处理回调：整批使用同一个模型快照，并把 (概率, 特征, 模型) 随结果一起返回"""
+        handle = self._active
+        INFERENCE_BATCH_SIZE.observe(batch.size(0), source="micro_batch")
+        with INFERENCE_STAGE_SECONDS.time(stage="forward"):
+            probabilities, features = self._infer(batch, handle, embeddings=self._wants_embeddings(handle))
+        if features is None:
+            return [(row, None, handle) for row in probabilities]
+        return [(row, feature, handle) for row, feature in zip(probabilities, features)]
+
+    def _mock_predict(self, handle: LoadedModel) -> PredictionResult:
+        """模拟模式（模型未加载时）"""
+        import random
+        class_mapping = handle.class_mapping
+        idx = random.randint(0, len(class_mapping) - 1)
+        conf = random.uniform(0.7, 0.99)
+        top_predictions = [{"class": class_mapping[str(idx)], "confidence": round(conf, 4)}]
+        return PredictionResult(class_mapping[str(idx)], conf, top_predictions, handle.version)
+
+    def _build_result(
+        self, probabilities: torch.Tensor, handle: LoadedModel, embedding: torch.Tensor | None = None
+    ) -> PredictionResult:
+        """根据单张图片的概率向量构建 Top-3 结果"""
+        top3_conf, top3_idx = torch.topk(probabilities, k=min(3, probabilities.size(0)))
+
         top_predictions = []
-        for i in range(top3_idx.size(1)):
-            cls_name = self._class_mapping.get(str(top3_idx[0, i].item()), "Unknown")
-            top_predictions.append({"class": cls_name, "confidence": round(top3_conf[0, i].item(), 4)})
-        
+        for conf, idx in zip(top3_conf.tolist(), top3_idx.tolist()):
+            cls_name = handle.class_mapping.get(str(idx), "Unknown")
+            top_predictions.append({"class": cls_name, "confidence": round(conf, 4)})
+
         predicted_class = top_predictions[0]["class"]
         confidence = top_predictions[0]["confidence"]
-        return predicted_class, confidence, top_predictions
+        return PredictionResult(predicted_class, confidence, top_predictions, handle.version, embedding)
+
+    @staticmethod
+    def _load_image(source: bytes | BinaryIO | Path, resize_size: int = RESIZE_SIZE) -> Image.Image:
+        """
+        解码图片
+
+        JPEG 使用 draft 模式在 DCT 阶段直接按 1/2、1/4、1/8 缩小解码，
+        保证短边不小于 resize_size（模型的 Resize 边长，见 resize_size_for），
+        后续 Resize 只需处理小图，且不会先缩小再放大。
+        """
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        image = Image.open(source)
+        image.draft("RGB", (resize_size, resize_size))
+        return image.convert("RGB")
+
+    @staticmethod
+    def _preprocess(image: Image.Image, input_size: int) -> torch.Tensor:
+        """
+        单张图片预处理到 uint8 张量
+
+        归一化在组批后对整批一次完成（见 _forward）
+        """
+        return to_uint8_tensor(image, resize_size=resize_size_for(input_size), crop_size=input_size)
+
+    def predict(self, image: bytes | BinaryIO | Path, tta: str = "none") -> PredictionResult:
+        """
+        对图片进行病害预测
+
+        Args:
+            image: 图片内容（bytes / 文件对象）或图片路径
+            tta: 测试时增强级别 none / flip / full（见 _predict_tta）
+
+        Returns:
+            预测结果（预测类别、置信度、Top-3 预测列表、模型版本）
+        """
+        self._ensure_ready()
+        if tta != "none":
+            return self._predict_tta(image, tta)
+        handle = self._active
+
+        # 加载并预处理图片
+        with INFERENCE_STAGE_SECONDS.time(stage="decode"):
+            image = self._load_image(image, resize_size_for(handle.input_size))
+        with INFERENCE_STAGE_SECONDS.time(stage="preprocess"):
+            input_tensor = self._preprocess(image, handle.input_size)
+
+        if handle.model is None:
+            return self._mock_predict(handle)
+
+        # 提交到微批处理队列，与并发请求合并推理（含排队等待与前向传播）
+        with INFERENCE_STAGE_SECONDS.time(stage="batch_wait"):
+            probabilities, embedding, batch_handle = self._batcher.submit(input_tensor).result()
+        with INFERENCE_STAGE_SECONDS.time(stage="postprocess"):
+            return self._build_result(probabilities, batch_handle, embedding)
+
+    def _predict_tta(self, image: bytes | BinaryIO | Path, level: str) -> PredictionResult:
+        """
+        测试时增强预测
+
+        一次解码生成翻转 / 裁剪视图，所有视图作为一个批次前向传播（不经过微批处理队列），
+        对各视图的 softmax 概率取平均后再取 Top-3。
+        """
+        handle = self._active
+        resize_size = resize_size_for(handle.input_size)
+        with INFERENCE_STAGE_SECONDS.time(stage="decode"):
+            image = self._load_image(image, resize_size)
+        with INFERENCE_STAGE_SECONDS.time(stage="preprocess"):
+            views = tta_views(image, level, resize_size=resize_size, crop_size=handle.input_size)
+
+        if handle.model is None:
+            return self._mock_predict(handle)
+
+        INFERENCE_BATCH_SIZE.observe(views.size(0), source="tta")
+        with INFERENCE_STAGE_SECONDS.time(stage="tta_forward"):
+            probabilities, features = self._infer(
+                views, handle, views=views.size(0), embeddings=self._wants_embeddings(handle)
+            )
+        with INFERENCE_STAGE_SECONDS.time(stage="postprocess"):
+            return self._build_result(probabilities[0], handle, features[0] if features is not None else None)
+
+    async def predict_async(self, image: bytes | BinaryIO | Path, tta: str = "none") -> PredictionResult:
+        """
+        predict 的协程版本
+
+        解码、预处理和等待批处理结果都在服务自有的有界线程池中完成，
+        不阻塞事件循环；队列已满时抛出 ExecutorBusyError。
+        """
+        self._ensure_ready()
+        return await self._executor.run(self.predict, image, tta)
+
+    def _get_decode_pool(self) -> ThreadPoolExecutor:
+        # 线程池不会跨越 fork，在子进程中重新创建
+        if self._decode_pool is None or self._decode_pool_pid != os.getpid():
+            self._decode_pool = ThreadPoolExecutor(
+                max_workers=settings.DECODE_WORKERS, thread_name_prefix="decode"
+            )
+            self._decode_pool_pid = os.getpid()
+        return self._decode_pool
+
+    def predict_batch(self, images: list[bytes | BinaryIO | Path]) -> list[PredictionResult | Exception]:
+        """
+        批量预测
+
+        并行解码后直接以一个大批次前向传播，不经过微批处理队列。
+        无法解码的图片在对应位置返回异常对象，不影响其他图片。
+        """
+        self._ensure_ready()
+        handle = self._active
+        resize_size = resize_size_for(handle.input_size)
+
+        def try_decode(image):
+            try:
+                return self._preprocess(self._load_image(image, resize_size), handle.input_size)
+            except Exception as e:
+                return e
+
+        results: list = list(self._get_decode_pool().map(try_decode, images))
+        valid = [i for i, item in enumerate(results) if not isinstance(item, Exception)]
+        if not valid:
+            return results
+
+        if handle.model is None:
+            for i in valid:
+                results[i] = self._mock_predict(handle)
+            return results
+
+        INFERENCE_BATCH_SIZE.observe(len(valid), source="batch_api")
+        probabilities, features = self._infer(
+            torch.stack([results[i] for i in valid]), handle, embeddings=self._wants_embeddings(handle)
+        )
+        for row, i in enumerate(valid):
+            results[i] = self._build_result(probabilities[row], handle, features[row] if features is not None else None)
+        return results
+
+    async def predict_stream(
+        self, images: list[bytes | BinaryIO | Path], chunk_size: int
+    ) -> AsyncIterator[list[PredictionResult | Exception]]:
+        """
+        分块批量预测，每完成一块就产出该块的结果
+
+        批量任务在推理队列已满时等待重试，而不是直接失败。
+        """
+        self._ensure_ready()
+        for start in range(0, len(images), chunk_size):
+            chunk = images[start:start + chunk_size]
+            while True:
+                try:
+                    results = await self._executor.run(self.predict_batch, chunk)
+                    break
+                except ExecutorBusyError:
+                    await asyncio.sleep(0.05)
+            yield results
+
+    def batch_stats(self) -> dict:
+        """微批处理计数器：批次数、平均/最大批大小及分布"""
+        stats = self._batcher.stats.snapshot()
+        stats["queue_depth"] = self._batcher.queue_depth()
+        stats["executor_in_flight"] = self._executor.in_flight()
+        return stats
 
 
 # 全局服务实例
-ai_service = AIService()
\ No newline at end of file
+ai_service = AIService()
+
+metrics.gauge(
+    "cropvision_inference_queue_depth",
+    "Images waiting in the micro-batching queue",
+    lambda: ai_service._batcher.queue_depth(),
+)
+metrics.gauge(
+    "cropvision_inference_in_flight",
+    "Requests running or queued in the bounded inference executor",
+    lambda: ai_service._executor.in_flight(),
+)
+metrics.gauge("cropvision_model_ready", "1 when the model is loaded and warmed up", lambda: int(ai_service.is_ready))
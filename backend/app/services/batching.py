@@ -0,0 +1,131 @@
+"""
+动态微批处理调度器
+将并发到达的单张图片推理请求合并为一次批量前向传播
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+import torch
+
+
+class BatchStats:
+    """批处理计数器（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.max_batch_size = 0
+        self.size_histogram: dict[int, int] = {}
+
+    def record(self, batch_size: int):
+        with self._lock:
+            self.batches += 1
+            self.items += batch_size
+            self.max_batch_size = max(self.max_batch_size, batch_size)
+            self.size_histogram[batch_size] = self.size_histogram.get(batch_size, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0,
+                "max_batch_size": self.max_batch_size,
+                "size_histogram": dict(sorted(self.size_histogram.items())),
+            }
+
+
+class MicroBatcher:
+    """
+    微批处理调度器
+
+    请求进入队列后由后台线程收集，凑满 max_batch_size 或等待超过
+    max_wait_ms 即执行一次批量前向传播，再把每一行结果交还给各自的调用方。
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[torch.Tensor], torch.Tensor],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+    ):
+        self._run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.stats = BatchStats()
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker: threading.Thread | None = None
+        self._worker_pid: int | None = None
+
+    def submit(self, input_tensor: torch.Tensor) -> Future:
+        """
+        提交单张图片的输入张量
+
+        Args:
+            input_tensor: 预处理后的张量 (C, H, W)
+
+        Returns:
+            Future，结果为该图片对应的输出行
+        """
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((input_tensor, future))
+        return future
+
+    def queue_depth(self) -> int:
+        """当前等待组批的请求数"""
+        return self._queue.qsize()
+
+    def _ensure_worker(self):
+        # 后台线程不会跨越 fork，在子进程中首次提交时重新启动
+        pid = os.getpid()
+        if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+                return
+            if self._worker_pid != pid:
+                self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+            self._worker_pid = pid
+            self._worker.start()
+
+    def _collect(self) -> list[tuple[torch.Tensor, Future]]:
+        """阻塞等待第一条请求，然后在等待窗口内尽量凑满一批"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            # 跳过已被调用方取消的请求
+            batch = [(t, f) for t, f in batch if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            self.stats.record(len(batch))
+            try:
+                outputs = self._run_batch(torch.stack([t for t, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for i, (_, future) in enumerate(batch):
+                future.set_result(outputs[i])
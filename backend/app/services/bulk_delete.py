@@ -0,0 +1,180 @@
+"""
+识别记录批量删除
+记录按块删除（每块一个事务，避免超出 SQLite 的参数上限和长时间持有写锁），
+不再被引用的图片及其派生图片在文件线程池中删除，不阻塞事件循环。
+大批量删除以后台任务执行，进度写入 bulk_delete_jobs 表；执行任务的进程被杀死后，
+心跳超时的任务在启动时或查询时标记为失败。
+"""
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database import async_session
+from app.models.prediction import BulkDeleteJob, PredictionRecord
+from app.services import stats_rollup
+from app.services.executor import BoundedExecutor
+from app.services.thumbnails import delete_derived
+
+# 删除文件的线程池（排队上限足够大，删除请求不会因为排队被拒绝）
+file_executor = BoundedExecutor(settings.FILE_DELETE_WORKERS, max_pending=1024)
+
+# 运行中的后台删除任务（保持引用，避免被垃圾回收；关闭时取消）
+_job_tasks: set[asyncio.Task] = set()
+
+_UNFINISHED = ("pending", "running")
+_INTERRUPTED_ERROR = "执行任务的进程已退出，任务中断"
+
+
+async def unreferenced_paths(db: AsyncSession, paths: set[str]) -> set[str]:
+    """返回不再被任何记录引用的图片路径（重复上传的记录会共享同一张图片）"""
+    if not paths:
+        return set()
+    result = await db.execute(
+        select(PredictionRecord.image_path).where(PredictionRecord.image_path.in_(paths)).distinct()
+    )
+    return paths - set(result.scalars().all())
+
+
+def remove_image_files(image_paths: list[str]) -> int:
+    """删除原图及其派生图片（阻塞调用，在文件线程池中执行），返回删除的原图数"""
+    delete_derived(set(image_paths))
+    removed = 0
+    for image_path in image_paths:
+        file_path = settings.UPLOAD_DIR / image_path
+        try:
+            file_path.unlink()
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error deleting file {file_path}: {e}")
+    return removed
+
+
+async def remove_files(image_paths: set[str]) -> int:
+    """把文件分给线程池中的各个线程并行删除"""
+    paths = sorted(image_paths)
+    if not paths:
+        return 0
+    workers = file_executor.max_workers
+    slices = [paths[i::workers] for i in range(workers) if paths[i::workers]]
+    counts = await asyncio.gather(*(file_executor.run(remove_image_files, part) for part in slices))
+    return sum(counts)
+
+
+async def delete_records(ids: list[int], job_id: str | None = None) -> tuple[int, int]:
+    """
+    按 DELETE_CHUNK_SIZE 分块删除记录及不再被引用的文件
+
+    每块在独立事务中删除记录并更新统计汇总，提交后再删除文件；
+    中途失败时已提交的块保持删除状态。
+
+    Returns:
+        (删除的记录数, 删除的文件数)
+    """
+    ids = list(dict.fromkeys(ids))
+    chunk_size = max(1, settings.DELETE_CHUNK_SIZE)
+    deleted = deleted_files = 0
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        async with async_session() as db:
+            result = await db.execute(
+                delete(PredictionRecord)
+                .where(PredictionRecord.id.in_(chunk))
+                .returning(PredictionRecord.image_path, PredictionRecord.created_at, PredictionRecord.predicted_class)
+            )
+            rows = result.all()
+            await stats_rollup.record_deleted(db, [(row.created_at, row.predicted_class) for row in rows])
+            unreferenced = await unreferenced_paths(db, {row.image_path for row in rows if row.image_path})
+            await db.commit()
+        deleted += len(rows)
+        deleted_files += await remove_files(unreferenced)
+        if job_id is not None:
+            await _update_job(job_id, deleted=deleted, deleted_files=deleted_files)
+    return deleted, deleted_files
+
+
+async def _update_job(job_id: str, **values):
+    async with async_session() as db:
+        await db.execute(
+            update(BulkDeleteJob).where(BulkDeleteJob.id == job_id).values(heartbeat_at=datetime.now(), **values)
+        )
+        await db.commit()
+
+
+async def _run_job(job_id: str, ids: list[int]):
+    await _update_job(job_id, status="running")
+    try:
+        await delete_records(ids, job_id)
+    except asyncio.CancelledError:
+        await asyncio.shield(_update_job(
+            job_id, status="failed", error="服务关闭，任务中断", finished_at=datetime.now()
+        ))
+        raise
+    except Exception as e:
+        print(f"批量删除任务 {job_id} 失败: {e}")
+        await _update_job(job_id, status="failed", error=str(e), finished_at=datetime.now())
+    else:
+        await _update_job(job_id, status="succeeded", finished_at=datetime.now())
+
+
+async def start_delete_job(ids: list[int]) -> BulkDeleteJob:
+    """创建后台删除任务并立即返回任务记录"""
+    ids = list(dict.fromkeys(ids))
+    job = BulkDeleteJob(id=uuid.uuid4().hex, status="pending", total=len(ids), deleted=0, deleted_files=0)
+    async with async_session() as db:
+        db.add(job)
+        await db.commit()
+    task = asyncio.create_task(_run_job(job.id, ids))
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+    return job
+
+
+def _stale_before() -> datetime:
+    return datetime.now() - timedelta(seconds=settings.BULK_DELETE_STALE_SECONDS)
+
+
+async def get_job(db: AsyncSession, job_id: str) -> BulkDeleteJob | None:
+    """查询任务；未结束但心跳已超时的任务在此标记为失败"""
+    job = await db.get(BulkDeleteJob, job_id)
+    if job is not None and job.status in _UNFINISHED and (job.heartbeat_at or job.created_at) < _stale_before():
+        job.status = "failed"
+        job.error = _INTERRUPTED_ERROR
+        job.finished_at = datetime.now()
+        await db.commit()
+    return job
+
+
+async def fail_stale_jobs(db: AsyncSession) -> int:
+    """
+    把心跳超过 BULK_DELETE_STALE_SECONDS 的未结束任务标记为失败（调用方负责提交事务）
+
+    进程被强制杀死时 cancel_jobs() 不会执行，任务会一直停留在 running。
+    其他 worker 上仍在运行的任务每删除一块都会刷新心跳，不受影响；
+    已提交的块保持删除状态，客户端可以重新提交剩余的 ID。
+
+    Returns:
+        标记的任务数
+    """
+    result = await db.execute(
+        update(BulkDeleteJob)
+        .where(
+            BulkDeleteJob.status.in_(_UNFINISHED),
+            func.coalesce(BulkDeleteJob.heartbeat_at, BulkDeleteJob.created_at) < _stale_before(),
+        )
+        .values(status="failed", error=_INTERRUPTED_ERROR, finished_at=datetime.now())
+    )
+    return result.rowcount
+
+
+async def cancel_jobs():
+    """应用关闭时取消仍在运行的删除任务（已提交的块保持删除状态）"""
+    tasks = list(_job_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,372 @@
+"""
+相似病例特征索引
+识别时保存的倒数第二层特征按模型版本分目录存放（不同模型的特征不可比较）：
+
+    meta.json    模型版本和特征维度
+    vectors.f16  L2 归一化后的 float16 行，只追加，查询时以内存映射方式读取
+    ids.i64      每行对应的识别记录 ID（先写特征再写 ID，ID 文件的长度即有效行数）
+    ivf.npz      行数达到 EMBEDDING_IVF_MIN_ROWS 后构建的 IVF 粗排索引（聚类中心 + 按聚类分组的行号）
+
+多进程部署时追加和构建索引都持有文件锁，查询时发现文件变长会重新映射。
+删除识别记录不改动矩阵，查询结果由调用方按数据库中仍存在的记录过滤。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import torch
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 不支持 fork 多进程部署（见 serve.py），只需要进程内加锁
+    fcntl = None
+
+SIMILAR_SEARCH_SECONDS = metrics.histogram(
+    "cropvision_similar_search_seconds", "Time to run one similar-case search", ("mode",)
+)
+
+# 每次参与矩阵乘法的数据量上限（限制 float16 → float32 转换的临时内存）
+_SCAN_BYTES = 64 * 1024 * 1024
+# IVF 构建后新追加的行超过已索引行数的这个比例时重建
+_IVF_REBUILD_GROWTH = 0.2
+# k-means：聚类数取 sqrt(行数) 并限制在此范围内，每个聚类的训练样本数和迭代次数
+_IVF_LISTS_RANGE = (16, 1024)
+_IVF_SAMPLES_PER_LIST = 32
+_KMEANS_ITERATIONS = 10
+
+
+@contextmanager
+def _file_lock(path: Path, blocking: bool = True):
+    """跨进程文件锁；非阻塞模式下未获得锁时产出 False"""
+    with open(path, "a") as f:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _chunk_rows(dim: int) -> int:
+    return max(1024, _SCAN_BYTES // (4 * dim))
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _spherical_kmeans(sample: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """按余弦相似度聚类，返回 L2 归一化的聚类中心 (k, dim)"""
+    data = torch.from_numpy(sample)
+    centroids = data[torch.from_numpy(rng.choice(len(sample), k, replace=False))].clone()
+    for _ in range(iterations):
+        labels = torch.argmax(data @ centroids.T, dim=1)
+        sums = torch.zeros_like(centroids).index_add_(0, labels, data)
+        # 空聚类用随机样本重新初始化
+        empty = torch.bincount(labels, minlength=k) == 0
+        if empty.any():
+            sums[empty] = data[torch.from_numpy(rng.choice(len(sample), int(empty.sum()), replace=False))]
+        centroids = torch.nn.functional.normalize(sums, dim=1)
+    return centroids.numpy()
+
+
+class EmbeddingSpace:
+    """一个模型版本的特征矩阵及其 IVF 索引"""
+
+    def __init__(self, directory: Path, model_version: str):
+        self.directory = directory
+        self.model_version = model_version
+        self.meta_path = directory / "meta.json"
+        self.vectors_path = directory / "vectors.f16"
+        self.ids_path = directory / "ids.i64"
+        self.ivf_path = directory / "ivf.npz"
+        self._lock = threading.Lock()
+        self._dim: int | None = None
+        self._rows = 0
+        self._ids: np.ndarray | None = None
+        self._vectors: np.ndarray | None = None
+        self._ivf: dict | None = None
+        self._ivf_mtime: float | None = None
+        self.building = False
+
+    @property
+    def dim(self) -> int | None:
+        if self._dim is None and self.meta_path.exists():
+            self._dim = json.loads(self.meta_path.read_text())["dim"]
+        return self._dim
+
+    def count(self) -> int:
+        """有效行数"""
+        dim = self.dim
+        if dim is None or not self.ids_path.exists():
+            return 0
+        return min(self.ids_path.stat().st_size // 8, self.vectors_path.stat().st_size // (2 * dim))
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray) -> int:
+        """
+        追加若干行（阻塞调用）
+
+        Args:
+            ids: 识别记录 ID (n,)
+            vectors: 特征 (n, dim)，在此做 L2 归一化并转为 float16
+
+        Returns:
+            追加后的行数
+        """
+        rows = _normalize(vectors.astype(np.float32)).astype(np.float16)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._lock, _file_lock(self.directory / ".lock"):
+            dim = self.dim
+            if dim is None:
+                dim = rows.shape[1]
+                self.meta_path.write_text(json.dumps({"model_version": self.model_version, "dim": dim}))
+                self._dim = dim
+            elif rows.shape[1] != dim:
+                raise ValueError(f"特征维度不一致: {rows.shape[1]} / {dim} ({self.model_version})")
+            count = self.count()
+            # 上次追加在写完之前中断时，先截掉多出的部分再追加
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(count * dim * 2)
+                f.write(rows.tobytes())
+            with open(self.ids_path, "ab") as f:
+                f.truncate(count * 8)
+                f.write(ids.astype(np.int64).tobytes())
+        return count + len(ids)
+
+    def _snapshot(self) -> tuple[np.ndarray, np.ndarray] | None:
+        """当前有效行的 (ids, vectors) 内存映射；其他进程追加后重新映射"""
+        count = self.count()
+        if count == 0:
+            return None
+        with self._lock:
+            if count != self._rows:
+                self._ids = np.memmap(self.ids_path, np.int64, "r", shape=(count,))
+                self._vectors = np.memmap(self.vectors_path, np.float16, "r", shape=(count, self.dim))
+                self._rows = count
+            return self._ids, self._vectors
+
+    def _load_ivf(self) -> dict | None:
+        try:
+            mtime = self.ivf_path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+        if mtime != self._ivf_mtime:
+            with np.load(self.ivf_path) as data:
+                self._ivf = {key: data[key] for key in data.files}
+            self._ivf_mtime = mtime
+        return self._ivf
+
+    def _score(self, vectors: np.ndarray, query: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+        """分块计算余弦相似度（行已归一化，即点积）；rows 为 None 时计算全部行"""
+        total = len(vectors) if rows is None else len(rows)
+        scores = np.empty(total, dtype=np.float32)
+        step = _chunk_rows(vectors.shape[1])
+        for start in range(0, total, step):
+            end = min(start + step, total)
+            block = vectors[start:end] if rows is None else vectors[rows[start:end]]
+            scores[start:end] = block.astype(np.float32) @ query
+        return scores
+
+    def _ivf_rows(self, ivf: dict, query: np.ndarray, count: int) -> np.ndarray:
+        """与查询最接近的 nprobe 个聚类的行号，加上索引构建之后追加的行"""
+        centroid_scores = ivf["centroids"] @ query
+        nprobe = min(max(1, settings.EMBEDDING_IVF_NPROBE), len(centroid_scores))
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        order, offsets = ivf["order"], ivf["offsets"]
+        parts = [order[offsets[c]:offsets[c + 1]] for c in probe]
+        parts.append(np.arange(int(ivf["rows"]), count))
+        return np.sort(np.concatenate(parts))
+
+    def search(self, record_ids: list[int], limit: int) -> list[tuple[int, float]] | None:
+        """
+        余弦相似度 Top-k（阻塞调用）
+
+        Args:
+            record_ids: 查询记录 ID，依次使用第一个有特征的（共享同一张图片的记录可以互相代替）
+            limit: 返回的最大条数
+
+        Returns:
+            [(记录 ID, 相似度)]，按相似度降序，不含查询记录本身；这些 ID 都没有特征时返回 None
+        """
+        snapshot = self._snapshot()
+        if snapshot is None:
+            return None
+        ids, vectors = snapshot
+        query_id = query_row = None
+        for record_id in record_ids:
+            rows = np.flatnonzero(ids == record_id)
+            if rows.size:
+                query_id, query_row = record_id, int(rows[-1])
+                break
+        if query_row is None:
+            return None
+        query = vectors[query_row].astype(np.float32)
+
+        start = time.perf_counter()
+        ivf = self._load_ivf()
+        if ivf is not None and int(ivf["rows"]) <= len(ids):
+            mode = "ivf"
+            rows = self._ivf_rows(ivf, query, len(ids))
+            scores = self._score(vectors, query, rows)
+        else:
+            mode = "exact"
+            rows = None
+            scores = self._score(vectors, query)
+        candidate_ids = ids[rows] if rows is not None else ids
+        scores[candidate_ids == query_id] = -np.inf
+
+        k = min(limit, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        SIMILAR_SEARCH_SECONDS.observe(time.perf_counter() - start, mode=mode)
+        return [(int(candidate_ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def needs_ivf(self) -> bool:
+        """行数达到阈值且没有索引，或索引之后追加的行已经较多"""
+        count = self.count()
+        if count < settings.EMBEDDING_IVF_MIN_ROWS:
+            return False
+        ivf = self._load_ivf()
+        return ivf is None or count - int(ivf["rows"]) > int(ivf["rows"]) * _IVF_REBUILD_GROWTH
+
+    def build_ivf(self, blocking: bool = True) -> int | None:
+        """
+        构建 IVF 索引（阻塞调用）
+
+        Returns:
+            聚类数；非阻塞模式下其他进程正在构建时返回 None
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with _file_lock(self.directory / ".ivf.lock", blocking) as locked:
+            if not locked:
+                return None
+            snapshot = self._snapshot()
+            if snapshot is None:
+                return None
+            _, vectors = snapshot
+            count = len(vectors)
+            low, high = _IVF_LISTS_RANGE
+            nlist = min(count, int(np.clip(np.sqrt(count), low, high)))
+            rng = np.random.default_rng(0)
+            sample_rows = np.sort(rng.choice(count, min(count, nlist * _IVF_SAMPLES_PER_LIST), replace=False))
+            centroids = _spherical_kmeans(
+                vectors[sample_rows].astype(np.float32), nlist, _KMEANS_ITERATIONS, rng
+            )
+
+            labels = np.empty(count, dtype=np.int64)
+            step = _chunk_rows(vectors.shape[1])
+            for start in range(0, count, step):
+                block = vectors[start:start + step].astype(np.float32)
+                labels[start:start + step] = np.argmax(block @ centroids.T, axis=1)
+            order = np.argsort(labels, kind="stable")
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=nlist))])
+
+            tmp_path = self.directory / ".ivf.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, centroids=centroids, order=order, offsets=offsets, rows=np.int64(count))
+            # 原子替换，查询方按修改时间重新加载
+            os.replace(tmp_path, self.ivf_path)
+            return nlist
+
+
+class EmbeddingIndex:
+    """按模型版本管理特征矩阵"""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._spaces: dict[str, EmbeddingSpace] = {}
+        self._lock = threading.Lock()
+
+    def space(self, model_version: str) -> EmbeddingSpace:
+        with self._lock:
+            space = self._spaces.get(model_version)
+            if space is None:
+                # 模型版本中含有 : + / 等字符，目录名使用哈希
+                name = hashlib.sha256(model_version.encode()).hexdigest()[:16]
+                space = self._spaces[model_version] = EmbeddingSpace(self.root / name, model_version)
+            return space
+
+    def spaces(self) -> list[EmbeddingSpace]:
+        """磁盘上已有的全部特征矩阵"""
+        if not self.root.exists():
+            return []
+        result = []
+        for meta_path in sorted(self.root.glob("*/meta.json")):
+            result.append(self.space(json.loads(meta_path.read_text())["model_version"]))
+        return result
+
+    def _add(self, entries: list[tuple[int, str, torch.Tensor]]):
+        groups: dict[str, list[tuple[int, torch.Tensor]]] = {}
+        for record_id, model_version, embedding in entries:
+            groups.setdefault(model_version, []).append((record_id, embedding))
+        for model_version, items in groups.items():
+            space = self.space(model_version)
+            ids = np.array([record_id for record_id, _ in items], dtype=np.int64)
+            vectors = torch.stack([embedding for _, embedding in items]).float().numpy()
+            space.append(ids, vectors)
+            if space.needs_ivf() and not space.building:
+                self._build_in_background(space)
+
+    async def add(self, entries: Iterable[tuple[int, str | None, torch.Tensor | None]]):
+        """
+        追加已提交的识别记录的特征（在线程中写文件）
+
+        特征只用于相似检索，写入失败时只打印错误，不影响已提交的记录。
+
+        Args:
+            entries: (记录 ID, 模型版本, 特征) 列表，特征为 None 的跳过
+        """
+        if not settings.EMBEDDING_INDEX_ENABLED:
+            return
+        entries = [entry for entry in entries if entry[1] is not None and entry[2] is not None]
+        if not entries:
+            return
+        try:
+            await asyncio.to_thread(self._add, entries)
+        except Exception as e:
+            print(f"写入识别特征失败: {e}")
+
+    async def search(self, model_version: str, record_ids: list[int], limit: int) -> list[tuple[int, float]] | None:
+        """见 EmbeddingSpace.search"""
+        return await asyncio.to_thread(self.space(model_version).search, record_ids, limit)
+
+    def _build_in_background(self, space: EmbeddingSpace):
+        space.building = True
+
+        def run():
+            try:
+                start = time.perf_counter()
+                nlist = space.build_ivf(blocking=False)
+                if nlist:
+                    print(
+                        f"已为 {space.model_version} 的 {space.count()} 条特征构建 IVF 索引"
+                        f"（{nlist} 个聚类，耗时 {time.perf_counter() - start:.1f} s）"
+                    )
+            except Exception as e:
+                print(f"构建相似检索索引失败 ({space.model_version}): {e}")
+            finally:
+                space.building = False
+
+        threading.Thread(target=run, name="embedding-ivf", daemon=True).start()
+
+
+# 全局单例
+embedding_index = EmbeddingIndex(settings.EMBEDDING_DIR)
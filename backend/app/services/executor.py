@@ -0,0 +1,72 @@
+"""
+有界推理线程池
+把同步、CPU 密集的推理从 asyncio 事件循环中移出，并限制排队长度
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+
+class ExecutorBusyError(RuntimeError):
+    """推理队列已满，调用方应返回 503"""
+    pass
+
+
+class BoundedExecutor:
+    """
+    有界线程池
+
+    同时在执行和排队的任务总数不超过 max_workers + max_pending，
+    超出时 run() 立即抛出 ExecutorBusyError，而不是无限堆积。
+    """
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(0, max_pending)
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_pending)
+        self._lock = threading.Lock()
+        self._pool: ThreadPoolExecutor | None = None
+        self._pool_pid: int | None = None
+        self._in_flight = 0
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        # 线程池不会跨越 fork，在子进程中重新创建
+        pid = os.getpid()
+        if self._pool is None or self._pool_pid != pid:
+            with self._lock:
+                if self._pool is None or self._pool_pid != pid:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix="inference"
+                    )
+                    self._pool_pid = pid
+        return self._pool
+
+    def _release(self, _future):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """在线程池中执行 fn(*args) 并等待结果"""
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorBusyError("推理队列已满")
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self._get_pool().submit(fn, *args)
+        except BaseException:
+            self._release(None)
+            raise
+        # 任务完成或被取消时都会归还名额
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def in_flight(self) -> int:
+        """正在执行或排队的任务数"""
+        return self._in_flight
+
+    def shutdown(self, wait: bool = True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
@@ -0,0 +1,263 @@
+"""
+异步识别任务队列
+以 prediction_jobs 表作为本地持久化队列：API 进程入队，worker 进程（worker.py）按批领取。
+
+领取是一条 UPDATE ... WHERE id IN (SELECT ... LIMIT n) RETURNING 语句，SQLite 的写锁保证
+多个 worker 进程不会领到同一个任务。领取的同时写入租约（worker_id + leased_until），
+租约到期仍未完成的任务（worker 崩溃、被杀死）重新对其他 worker 可见；完成 / 失败只对仍持有
+租约的任务生效，过期的 worker 写回的结果会被丢弃。
+"""
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database import async_session
+from app.core.metrics import metrics
+from app.models.prediction import PredictionJob
+
+JOB_EVENTS = metrics.counter(
+    "cropvision_prediction_jobs_total",
+    "Async prediction job events (enqueued / rejected / claimed / succeeded / retried / failed / expired)",
+    ("event",),
+)
+JOB_WAIT_SECONDS = metrics.histogram(
+    "cropvision_prediction_job_wait_seconds",
+    "Time from enqueue to the first claim by a worker",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0),
+)
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+
+class QueueFullError(RuntimeError):
+    """排队任务数达到 JOB_QUEUE_MAX_PENDING，调用方应返回 503"""
+    pass
+
+
+@dataclass
+class QueueStats:
+    """队列深度快照（由 refresh_stats 定期刷新，供 /metrics 输出）"""
+    queued: int = 0
+    running: int = 0
+    oldest_queued_age_seconds: float = 0.0
+
+
+class JobQueue:
+    """prediction_jobs 表上的队列操作"""
+
+    def __init__(self, max_pending: int, max_attempts: int, visibility_timeout: int, retry_backoff: float):
+        self.max_pending = max(0, max_pending)
+        self.max_attempts = max(1, max_attempts)
+        self.visibility_timeout = max(1, visibility_timeout)
+        self.retry_backoff = max(0.0, retry_backoff)
+        self.stats = QueueStats()
+
+    async def pending_count(self, db: AsyncSession) -> int:
+        result = await db.execute(
+            select(func.count()).select_from(PredictionJob).where(PredictionJob.status == "queued")
+        )
+        return result.scalar_one()
+
+    async def enqueue(self, db: AsyncSession, image_path: str, content_hash: str, tta: str = "none") -> PredictionJob:
+        """
+        创建排队中的任务（由调用方提交）
+
+        Raises:
+            QueueFullError: 排队任务数已达上限
+        """
+        if self.max_pending and await self.pending_count(db) >= self.max_pending:
+            JOB_EVENTS.inc(event="rejected")
+            raise QueueFullError(f"识别任务队列已满（{self.max_pending}）")
+        now = datetime.now()
+        job = PredictionJob(
+            id=uuid.uuid4().hex,
+            status="queued",
+            image_path=image_path,
+            content_hash=content_hash,
+            tta=tta,
+            attempts=0,
+            max_attempts=self.max_attempts,
+            available_at=now,
+            created_at=now,
+        )
+        db.add(job)
+        JOB_EVENTS.inc(event="enqueued")
+        return job
+
+    async def get(self, db: AsyncSession, job_id: str) -> PredictionJob | None:
+        return await db.get(PredictionJob, job_id)
+
+    async def claim(self, worker_id: str, limit: int) -> list[PredictionJob]:
+        """
+        领取最多 limit 个任务：已到重试时间的排队任务，以及租约已过期的运行中任务
+
+        租约过期且已用完重试次数的任务直接标记为失败，不再领取。
+        """
+        now = datetime.now()
+        expired = and_(PredictionJob.status == "running", PredictionJob.leased_until < now)
+        async with async_session() as db:
+            result = await db.execute(
+                update(PredictionJob)
+                .where(expired, PredictionJob.attempts >= PredictionJob.max_attempts)
+                .values(status="failed", error="处理超时，已达到最大重试次数", finished_at=now, worker_id=None)
+            )
+            if result.rowcount:
+                JOB_EVENTS.inc(result.rowcount, event="expired")
+            candidates = (
+                select(PredictionJob.id)
+                .where(or_(
+                    and_(PredictionJob.status == "queued", PredictionJob.available_at <= now),
+                    expired,
+                ))
+                .order_by(PredictionJob.available_at)
+                .limit(max(1, limit))
+            )
+            result = await db.execute(
+                update(PredictionJob)
+                .where(PredictionJob.id.in_(candidates))
+                .values(
+                    status="running",
+                    worker_id=worker_id,
+                    leased_until=now + timedelta(seconds=self.visibility_timeout),
+                    attempts=PredictionJob.attempts + 1,
+                    started_at=func.coalesce(PredictionJob.started_at, now),
+                )
+                .returning(PredictionJob)
+            )
+            jobs = sorted(result.scalars().all(), key=lambda job: job.created_at)
+            await db.commit()
+        for job in jobs:
+            JOB_EVENTS.inc(event="claimed")
+            if job.attempts == 1:
+                JOB_WAIT_SECONDS.observe((now - job.created_at).total_seconds())
+        return jobs
+
+    async def owned(self, db: AsyncSession, worker_id: str, job_ids: list[str]) -> set[str]:
+        """
+        续租并返回仍由 worker_id 持有的任务 ID
+
+        在写入结果的事务开头调用：这条 UPDATE 取得写锁，事务提交前租约不会被其他 worker 抢走。
+        """
+        if not job_ids:
+            return set()
+        result = await db.execute(
+            update(PredictionJob)
+            .where(
+                PredictionJob.id.in_(job_ids),
+                PredictionJob.status == "running",
+                PredictionJob.worker_id == worker_id,
+            )
+            .values(leased_until=datetime.now() + timedelta(seconds=self.visibility_timeout))
+            .returning(PredictionJob.id)
+        )
+        return set(result.scalars().all())
+
+    async def complete(self, db: AsyncSession, outcomes: list[dict]):
+        """
+        写入任务结果（调用方已通过 owned() 确认租约，并负责提交）
+
+        Args:
+            outcomes: {"id", "result", "record_id"}（成功）或 {"id", "error"}（不可重试的失败）
+        """
+        if not outcomes:
+            return
+        now = datetime.now()
+        rows = []
+        for outcome in outcomes:
+            failed = "error" in outcome
+            rows.append({
+                "id": outcome["id"],
+                "status": "failed" if failed else "succeeded",
+                "result": outcome.get("result"),
+                "record_id": outcome.get("record_id"),
+                "error": outcome.get("error"),
+                "finished_at": now,
+                "leased_until": None,
+            })
+            JOB_EVENTS.inc(event="failed" if failed else "succeeded")
+        await db.execute(update(PredictionJob), rows)
+
+    async def release(self, worker_id: str, jobs: list[PredictionJob], error: str):
+        """
+        处理失败的任务放回队列，按 retry_backoff × 2^(attempts-1) 延迟重试；
+        已用完重试次数的标记为失败
+        """
+        now = datetime.now()
+        async with async_session() as db:
+            for job in jobs:
+                owned = (
+                    PredictionJob.id == job.id,
+                    PredictionJob.status == "running",
+                    PredictionJob.worker_id == worker_id,
+                )
+                if job.attempts >= job.max_attempts:
+                    values = {"status": "failed", "finished_at": now}
+                    event = "failed"
+                else:
+                    delay = self.retry_backoff * 2 ** (job.attempts - 1)
+                    values = {"status": "queued", "available_at": now + timedelta(seconds=delay)}
+                    event = "retried"
+                result = await db.execute(
+                    update(PredictionJob)
+                    .where(*owned)
+                    .values(**values, error=error, worker_id=None, leased_until=None)
+                )
+                if result.rowcount:
+                    JOB_EVENTS.inc(event=event)
+            await db.commit()
+
+    async def purge_finished(self, ttl_hours: int) -> int:
+        """删除结束超过 ttl_hours 的任务，返回删除数（图片由记录引用或交给孤立文件回收）"""
+        async with async_session() as db:
+            result = await db.execute(
+                delete(PredictionJob).where(PredictionJob.finished_at < datetime.now() - timedelta(hours=ttl_hours))
+            )
+            await db.commit()
+        return result.rowcount
+
+    async def refresh_stats(self) -> QueueStats:
+        """刷新排队 / 运行中任务数和最早排队任务的等待时间"""
+        async with async_session() as db:
+            result = await db.execute(
+                select(PredictionJob.status, func.count(), func.min(PredictionJob.created_at))
+                .where(PredictionJob.status.in_(("queued", "running")))
+                .group_by(PredictionJob.status)
+            )
+            rows = {status: (count, oldest) for status, count, oldest in result.all()}
+        queued, oldest = rows.get("queued", (0, None))
+        self.stats = QueueStats(
+            queued=queued,
+            running=rows.get("running", (0, None))[0],
+            oldest_queued_age_seconds=(datetime.now() - oldest).total_seconds() if oldest else 0.0,
+        )
+        return self.stats
+
+
+# 全局单例
+job_queue = JobQueue(
+    settings.JOB_QUEUE_MAX_PENDING,
+    settings.JOB_MAX_ATTEMPTS,
+    settings.JOB_VISIBILITY_TIMEOUT_SECONDS,
+    settings.JOB_RETRY_BACKOFF_SECONDS,
+)
+
+metrics.gauge(
+    "cropvision_prediction_jobs_queued", "Async prediction jobs waiting to be claimed",
+    function=lambda: job_queue.stats.queued,
+)
+metrics.gauge(
+    "cropvision_prediction_jobs_running", "Async prediction jobs leased by a worker",
+    function=lambda: job_queue.stats.running,
+)
+metrics.gauge(
+    "cropvision_prediction_jobs_oldest_queued_seconds", "Age of the oldest queued async prediction job",
+    function=lambda: job_queue.stats.oldest_queued_age_seconds,
+)
+metrics.gauge(
+    "cropvision_prediction_jobs_queue_utilization", "Queued jobs as a fraction of JOB_QUEUE_MAX_PENDING",
+    function=lambda: job_queue.stats.queued / job_queue.max_pending if job_queue.max_pending else 0.0,
+)
@@ -0,0 +1,216 @@
+"""
+异步识别任务 worker
+循环领取一批任务，常规任务合并为一次批量推理（与 /api/predict/batch 相同的路径），
+TTA 任务逐张推理；一批的识别记录、统计汇总、缓存行和任务结果在同一个事务中写入。
+
+图片无法解码属于不可重试的失败，任务直接结束；其他异常（推理失败、数据库繁忙等）
+按退避时间放回队列重试。
+"""
+import asyncio
+import os
+import socket
+import time
+import uuid
+from datetime import datetime
+
+from PIL import UnidentifiedImageError
+
+from app.core.config import settings
+from app.core.database import async_session
+from app.core.metrics import metrics
+from app.models.prediction import PredictionJob
+from app.schemas.prediction import PredictionResponse
+from app.services.ai_service import PredictionResult, ai_service
+from app.services.bulk_delete import remove_image_files
+from app.services.embedding_index import embedding_index
+from app.services.job_queue import job_queue
+from app.services.prediction_cache import CachedPrediction, prediction_cache
+from app.services.record_writer import write_predictions
+from app.services.thumbnails import generate_all
+
+JOB_BATCH_SECONDS = metrics.histogram(
+    "cropvision_prediction_job_batch_seconds", "Time to process one claimed batch of async prediction jobs"
+)
+JOB_BATCH_SIZE = metrics.histogram(
+    "cropvision_prediction_job_batch_size",
+    "Async prediction jobs claimed per batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+
+
+class JobWorker:
+    """领取并执行异步识别任务（每个进程一个，可在 worker.py 或 API 进程中运行）"""
+
+    def __init__(self, batch_size: int, poll_interval_ms: int):
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = max(10, poll_interval_ms) / 1000
+        self.worker_id = ""
+        self._stopping = asyncio.Event()
+        self._last_housekeeping = 0.0
+
+    def stop(self):
+        """处理完当前批次后退出 run()"""
+        self._stopping.set()
+
+    async def _idle(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _housekeeping(self):
+        """按 JOB_QUEUE_STATS_INTERVAL_SECONDS 刷新队列深度指标，并清理过期的已结束任务"""
+        if time.monotonic() - self._last_housekeeping < settings.JOB_QUEUE_STATS_INTERVAL_SECONDS:
+            return
+        self._last_housekeeping = time.monotonic()
+        await job_queue.refresh_stats()
+        purged = await job_queue.purge_finished(settings.JOB_RESULT_TTL_HOURS)
+        if purged:
+            print(f"已清理 {purged} 个过期的识别任务")
+
+    async def run(self):
+        """主循环：模型就绪后持续领取任务，队列为空时按 JOB_POLL_INTERVAL_MS 轮询"""
+        # worker_id 包含进程号，在 fork 后的子进程中才确定
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        print(f"识别任务 worker {self.worker_id} 已启动")
+        while not self._stopping.is_set():
+            if not ai_service.is_ready:
+                await self._idle(1.0)
+                continue
+            try:
+                await self._housekeeping()
+                jobs = await job_queue.claim(self.worker_id, self.batch_size)
+            except Exception as e:
+                print(f"领取识别任务失败: {e}")
+                await self._idle(self.poll_interval)
+                continue
+            if not jobs:
+                await self._idle(self.poll_interval)
+                continue
+            try:
+                await self.process(jobs)
+            except asyncio.CancelledError:
+                await asyncio.shield(job_queue.release(self.worker_id, jobs, "worker 关闭，任务中断"))
+                raise
+            except Exception as e:
+                print(f"识别任务批次失败，稍后重试: {e}")
+                try:
+                    await job_queue.release(self.worker_id, jobs, str(e))
+                except Exception as release_error:
+                    # 放回失败时等待租约过期后由其他 worker 重新领取
+                    print(f"放回识别任务失败: {release_error}")
+        print(f"识别任务 worker {self.worker_id} 已停止")
+
+    async def _lookup_cache(self, jobs: list[PredictionJob], model_version: str) -> dict[str, CachedPrediction]:
+        """常规任务先查预测缓存，命中的不再推理"""
+        hits = {}
+        async with async_session() as db:
+            for job in jobs:
+                cached = await prediction_cache.get(db, job.content_hash, model_version)
+                if cached is not None:
+                    hits[job.id] = cached
+            await db.commit()
+        return hits
+
+    async def _infer(self, jobs: list[PredictionJob]) -> dict[str, PredictionResult | Exception]:
+        outcomes = {}
+        plain = [job for job in jobs if job.tta == "none"]
+        paths = [settings.UPLOAD_DIR / job.image_path for job in plain]
+        offset = 0
+        async for results in ai_service.predict_stream(paths, settings.BATCH_PREDICT_CHUNK_SIZE):
+            for job, result in zip(plain[offset:offset + len(results)], results):
+                outcomes[job.id] = result
+            offset += len(results)
+        for job in jobs:
+            if job.tta == "none":
+                continue
+            try:
+                outcomes[job.id] = await asyncio.to_thread(ai_service.predict, settings.UPLOAD_DIR / job.image_path, job.tta)
+            except (UnidentifiedImageError, OSError) as e:
+                outcomes[job.id] = e
+        return outcomes
+
+    async def process(self, jobs: list[PredictionJob]):
+        """执行一批任务并在一个事务中写入记录和任务结果"""
+        start = time.perf_counter()
+        JOB_BATCH_SIZE.observe(len(jobs))
+        model_version = ai_service.model_version
+        hits = await self._lookup_cache([job for job in jobs if job.tta == "none"], model_version)
+        outcomes = await self._infer([job for job in jobs if job.id not in hits])
+
+        created_at = datetime.now()
+        records, embeddings, succeeded, failed = [], [], [], []
+        # 新推理的常规任务的缓存条目：提交成功后才写入进程内缓存，避免重试时命中本任务自己的图片
+        fresh: dict[str, tuple[str, str, CachedPrediction]] = {}
+        for job in jobs:
+            cached = hits.get(job.id)
+            if cached is not None:
+                # 与同步接口一致：复用缓存结果和已保存的图片，本任务上传的图片在提交后删除
+                image_path, embedding, version = cached.image_path, None, model_version
+                prediction = cached
+            else:
+                result = outcomes[job.id]
+                if isinstance(result, Exception):
+                    failed.append({"id": job.id, "error": "图片无法解码"})
+                    continue
+                image_path, embedding, version = job.image_path, result.embedding, result.model_version
+                prediction = result
+                if job.tta == "none":
+                    fresh[job.id] = (job.content_hash, version, CachedPrediction(
+                        predicted_class=result.predicted_class,
+                        confidence=result.confidence,
+                        top_predictions=result.top_predictions,
+                        image_path=image_path,
+                    ))
+            records.append({
+                "image_path": image_path,
+                "predicted_class": prediction.predicted_class,
+                "confidence": prediction.confidence,
+                "model_version": version,
+                "created_at": created_at,
+            })
+            embeddings.append(embedding)
+            succeeded.append((job, PredictionResponse(
+                predicted_class=prediction.predicted_class,
+                confidence=round(prediction.confidence, 4),
+                image_url=f"/uploads/{image_path}",
+                top_predictions=prediction.top_predictions,
+                model_version=version,
+                tta=job.tta,
+            )))
+
+        async with async_session() as db:
+            owned = await job_queue.owned(db, self.worker_id, [job.id for job in jobs])
+            # 租约已过期、被其他 worker 重新领取的任务不写入结果
+            keep = [i for i, (job, _) in enumerate(succeeded) if job.id in owned]
+            records = [records[i] for i in keep]
+            embeddings = [embeddings[i] for i in keep]
+            succeeded = [succeeded[i] for i in keep]
+            fresh = {job_id: entry for job_id, entry in fresh.items() if job_id in owned}
+            # 同一批中重复的图片只保留一行缓存（同一条多行 upsert 不能两次更新同一行）
+            cache_rows = {content_hash: prediction_cache.row(content_hash, version, entry)
+                          for content_hash, version, entry in fresh.values()}
+            ids = await write_predictions(db, records, list(cache_rows.values()))
+            await job_queue.complete(db, [
+                {"id": job.id, "result": response.model_dump(), "record_id": record_id}
+                for (job, response), record_id in zip(succeeded, ids)
+            ] + [outcome for outcome in failed if outcome["id"] in owned])
+            await db.commit()
+
+        for content_hash, version, entry in fresh.values():
+            prediction_cache.put(content_hash, version, entry)
+        await embedding_index.add(zip(ids, [record["model_version"] for record in records], embeddings))
+        # 缓存条目指向本任务自己上传的图片时（例如上一次尝试留下的条目）不能删除
+        replaced = [
+            job.image_path for job, _ in succeeded
+            if job.id in hits and job.image_path != hits[job.id].image_path
+        ]
+        if replaced:
+            await asyncio.to_thread(remove_image_files, replaced)
+        if settings.DERIVED_PREGENERATE:
+            await asyncio.to_thread(generate_all, [job.image_path for job, _ in succeeded if job.id not in hits])
+        JOB_BATCH_SECONDS.observe(time.perf_counter() - start)
+
+
+# 全局单例
+job_worker = JobWorker(settings.JOB_BATCH_SIZE, settings.JOB_POLL_INTERVAL_MS)
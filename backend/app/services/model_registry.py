@@ -0,0 +1,253 @@
+"""
+模型注册表
+MODEL_DIR 下的 registry.json 清单记录所有可用模型版本及当前激活的版本
+
+清单格式:
+{
+  "active": "mnv3-q-20250101",
+  "models": [
+    {
+      "version": "mnv3-q-20250101",
+      "artifact": "quantized_model_scripted.pt",
+      "format": "torchscript",
+      "architecture": "mobilenet_v3_large_quantized",
+      "class_mapping": "class_mapping.json",
+      "input_size": 224,
+      "latency_ms": 12.5
+    }
+  ]
+}
+
+没有清单时按旧的固定顺序（量化 TorchScript → 量化 state dict → ResNet50）
+从已存在的模型文件合成注册表，行为与之前一致。
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有 fork 部署，只有进程内的线程锁
+    fcntl = None
+
+from app.core.config import settings
+
+# 支持的模型文件格式
+MODEL_FORMATS = ("torchscript", "quantized_state_dict", "resnet50_checkpoint", "onnx")
+# 量化模型的格式（权重在加载时按当前量化引擎打包）
+QUANTIZED_FORMATS = ("torchscript", "quantized_state_dict")
+
+# 没有清单时依次尝试的模型文件
+LEGACY_ARTIFACTS = [
+    ("quantized_model_scripted.pt", "torchscript", "mobilenet_v3_large_quantized"),
+    ("quantized_mobilenet_se.pth", "quantized_state_dict", "mobilenet_v3_large_quantized"),
+    (settings.MODEL_PATH, "resnet50_checkpoint", "resnet50"),
+]
+
+
+def artifact_version(path: Path) -> str:
+    """模型版本标识：文件名 + 内容哈希前缀，模型文件变化时随之改变"""
+    with open(path, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+    return f"{path.name}:{digest[:12]}"
+
+
+@dataclass
+class ModelSpec:
+    """注册表中的一个模型版本"""
+    version: str
+    artifact: str
+    format: str
+    architecture: str = ""
+    class_mapping: str = field(default_factory=lambda: settings.CLASS_MAPPING_PATH)
+    input_size: int = 224
+    latency_ms: float | None = None
+
+
+class ModelRegistry:
+    """模型注册表（读写 MODEL_DIR 下的清单文件）"""
+
+    def __init__(self, model_dir: Path, manifest_name: str):
+        self.model_dir = model_dir
+        self.path = model_dir / manifest_name
+        # 多个 worker 进程修改清单时的文件锁
+        self.lock_path = model_dir / f"{manifest_name}.lock"
+        self._lock = threading.Lock()
+        self._specs: dict[str, ModelSpec] = {}
+        self._active: str | None = None
+        self._mtime: float | None = None
+        self._has_manifest = False
+
+    @property
+    def has_manifest(self) -> bool:
+        return self._has_manifest
+
+    @property
+    def active_version(self) -> str | None:
+        return self._active
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        重新读取清单
+
+        Returns:
+            清单内容是否发生变化（按文件修改时间判断）
+        """
+        mtime = self.path.stat().st_mtime if self.path.exists() else None
+        if not force and self._specs and mtime == self._mtime:
+            return False
+
+        with self._lock:
+            if mtime is None:
+                self._load_legacy()
+            else:
+                self._specs, self._active = self._read_manifest()
+                self._has_manifest = True
+            self._mtime = mtime
+        return True
+
+    def _read_manifest(self) -> tuple[dict[str, ModelSpec], str | None]:
+        with open(self.path, "r") as f:
+            manifest = json.load(f)
+        specs = {}
+        for item in manifest.get("models", []):
+            spec = ModelSpec(**item)
+            if spec.format not in MODEL_FORMATS:
+                raise ValueError(f"不支持的模型格式: {spec.format} ({spec.version})")
+            specs[spec.version] = spec
+        return specs, manifest.get("active")
+
+    def _load_legacy(self):
+        """没有清单时，从已存在的模型文件合成注册表"""
+        self._specs = {}
+        self._active = None
+        self._has_manifest = False
+        for artifact, fmt, architecture in LEGACY_ARTIFACTS:
+            path = self.model_dir / artifact
+            if not path.exists():
+                continue
+            spec = ModelSpec(
+                version=artifact_version(path),
+                artifact=artifact,
+                format=fmt,
+                architecture=architecture,
+            )
+            self._specs[spec.version] = spec
+            if self._active is None:
+                self._active = spec.version
+
+    def list(self) -> list[ModelSpec]:
+        return list(self._specs.values())
+
+    def get(self, version: str) -> ModelSpec:
+        """按版本号获取模型，不存在时抛出 KeyError"""
+        return self._specs[version]
+
+    def set_active(self, version: str):
+        """切换激活版本并写回清单"""
+        if version not in self._specs:
+            raise KeyError(version)
+
+        def activate(specs: dict[str, ModelSpec], active: str | None) -> str | None:
+            if version not in specs:
+                raise KeyError(version)
+            return version
+
+        self._update(activate)
+
+    def record_latency(self, version: str, latency_ms: float):
+        """记录实测的单张图片延迟"""
+        if version not in self._specs:
+            return
+
+        def record(specs: dict[str, ModelSpec], active: str | None) -> str | None:
+            if version in specs:
+                specs[version].latency_ms = latency_ms
+            return active
+
+        self._update(record)
+
+    def register(self, spec: ModelSpec, activate: bool = False):
+        """登记新版本（覆盖同名版本）"""
+        if spec.format not in MODEL_FORMATS:
+            raise ValueError(f"不支持的模型格式: {spec.format}")
+
+        def add(specs: dict[str, ModelSpec], active: str | None) -> str | None:
+            specs[spec.version] = spec
+            return spec.version if activate or active is None else active
+
+        self._update(add, create=True)
+
+    def initialize_manifest(self):
+        """把当前目录中的模型文件（旧的固定顺序）写成清单（其他进程已生成清单时沿用该清单）"""
+        self._update(lambda specs, active: active, create=True)
+
+    @contextmanager
+    def _file_lock(self):
+        """进程内线程锁 + 跨进程文件锁，保证 读取 → 修改 → 替换 整体互斥"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _update(
+        self,
+        mutate: Callable[[dict[str, ModelSpec], str | None], str | None],
+        create: bool = False,
+    ):
+        """
+        在文件锁内重新读取清单、应用修改并写回
+
+        修改作用在磁盘上的最新内容上，而不是本进程可能已过期的副本，
+        不会覆盖其他 worker 刚写入的激活版本或延迟。
+
+        Args:
+            mutate: 接收 (模型表, 激活版本)，原地修改模型表并返回新的激活版本
+            create: 没有清单时是否以当前目录中的模型文件为基础生成清单；
+                为 False 时保持旧的固定顺序模式（不生成清单），只修改内存中的注册表
+        """
+        with self._file_lock():
+            if self.path.exists():
+                specs, active = self._read_manifest()
+            elif create or self._has_manifest:
+                self._load_legacy()
+                specs, active = self._specs, self._active
+            else:
+                # 旧的固定顺序模式下不生成清单，保持原有行为
+                self._active = mutate(self._specs, self._active)
+                return
+            active = mutate(specs, active)
+            self._write(specs, active)
+            self._specs, self._active, self._has_manifest = specs, active, True
+            self._mtime = self.path.stat().st_mtime
+
+    def _write(self, specs: dict[str, ModelSpec], active: str | None):
+        manifest = {
+            "active": active,
+            "models": [asdict(spec) for spec in specs.values()],
+        }
+        # 每次写入使用独立的临时文件，再原子替换，其他 worker 不会读到写了一半的文件
+        fd, tmp_name = tempfile.mkstemp(dir=self.model_dir, prefix=f".{self.path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(manifest, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_name, self.path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+
+# 全局注册表实例
+model_registry = ModelRegistry(settings.MODEL_DIR, settings.MODEL_REGISTRY_PATH)
@@ -0,0 +1,134 @@
+"""
+孤立文件回收
+对照 prediction_records 和 prediction_jobs 清理 UPLOAD_DIR 中没有记录引用的图片、失败请求遗留的
+.part 临时文件，以及原图已不存在的派生图片。
+
+修改时间新于宽限期的文件一律跳过：它们可能属于仍在处理中的请求
+（例如已保存图片、记录尚在 write-behind 缓冲区或批量识别尚未结束）。
+异步识别任务引用的图片在任务被清理（JOB_RESULT_TTL_HOURS）之前不会回收，即使任务排队超过宽限期。
+"""
+import asyncio
+import os
+import time
+from dataclasses import asdict, dataclass
+
+from sqlalchemy import select, union
+
+from app.core.config import settings
+from app.core.database import async_session
+from app.core.metrics import metrics
+from app.models.prediction import PredictionJob, PredictionRecord
+from app.services.bulk_delete import remove_image_files
+
+ORPHAN_FILES_REMOVED = metrics.counter(
+    "cropvision_orphan_files_removed_total", "Orphaned files removed by the garbage collector", ("kind",)
+)
+
+# 每次查询引用关系的文件名数量
+_LOOKUP_CHUNK = 500
+# 只回收图片文件，上传目录中的其他文件（如 .gitkeep）不做处理
+_IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+@dataclass
+class OrphanReport:
+    scanned: int = 0
+    uploads: int = 0
+    temp_files: int = 0
+    derived: int = 0
+    skipped_recent: int = 0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def _scan_uploads(cutoff: float) -> tuple[list[str], list[str], int, int]:
+    """返回 (早于 cutoff 的图片文件名, 早于 cutoff 的临时文件名, 扫描数, 跳过数)"""
+    images, temps, scanned, skipped = [], [], 0, 0
+    with os.scandir(settings.UPLOAD_DIR) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            scanned += 1
+            if entry.stat().st_mtime > cutoff:
+                skipped += 1
+            elif entry.name.startswith("."):
+                # stream_upload 的 .part 临时文件和其他隐藏文件
+                if entry.name.endswith(".part"):
+                    temps.append(entry.name)
+            elif os.path.splitext(entry.name)[1].lower() in _IMAGE_SUFFIXES:
+                images.append(entry.name)
+    return images, temps, scanned, skipped
+
+
+def _remove_orphan_derived(cutoff: float, dry_run: bool) -> int:
+    """删除原图已不存在的派生图片和生成失败遗留的临时文件"""
+    removed = 0
+    for root, _, files in os.walk(settings.DERIVED_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            if name.endswith(".webp"):
+                orphan = not (settings.UPLOAD_DIR / name[:-len(".webp")]).exists()
+            else:
+                orphan = name.startswith(".") and name.endswith(".tmp")
+            if not orphan or os.path.getmtime(path) > cutoff:
+                continue
+            if not dry_run:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+            removed += 1
+    return removed
+
+
+async def collect_orphans(grace_seconds: int | None = None, dry_run: bool = False) -> OrphanReport:
+    """
+    回收一次孤立文件
+
+    Args:
+        grace_seconds: 宽限期，默认使用 ORPHAN_GC_GRACE_SECONDS
+        dry_run: 只统计不删除
+    """
+    if grace_seconds is None:
+        grace_seconds = settings.ORPHAN_GC_GRACE_SECONDS
+    cutoff = time.time() - grace_seconds
+    images, temps, scanned, skipped = await asyncio.to_thread(_scan_uploads, cutoff)
+    report = OrphanReport(scanned=scanned, skipped_recent=skipped)
+
+    orphans = []
+    async with async_session() as db:
+        for start in range(0, len(images), _LOOKUP_CHUNK):
+            chunk = images[start:start + _LOOKUP_CHUNK]
+            result = await db.execute(union(
+                select(PredictionRecord.image_path).where(PredictionRecord.image_path.in_(chunk)),
+                select(PredictionJob.image_path).where(PredictionJob.image_path.in_(chunk)),
+            ))
+            referenced = set(result.scalars().all())
+            orphans.extend(name for name in chunk if name not in referenced)
+
+    report.uploads = len(orphans)
+    report.temp_files = len(temps)
+    if not dry_run:
+        report.uploads = await asyncio.to_thread(remove_image_files, orphans)
+        for name in temps:
+            (settings.UPLOAD_DIR / name).unlink(missing_ok=True)
+    report.derived = await asyncio.to_thread(_remove_orphan_derived, cutoff, dry_run)
+
+    if not dry_run:
+        ORPHAN_FILES_REMOVED.inc(report.uploads, kind="upload")
+        ORPHAN_FILES_REMOVED.inc(report.temp_files, kind="temp")
+        ORPHAN_FILES_REMOVED.inc(report.derived, kind="derived")
+    return report
+
+
+async def collect_orphans_periodically():
+    """按 ORPHAN_GC_INTERVAL_SECONDS 周期回收（在应用生命周期中运行）"""
+    while True:
+        await asyncio.sleep(settings.ORPHAN_GC_INTERVAL_SECONDS)
+        try:
+            report = await collect_orphans()
+            if report.uploads or report.temp_files or report.derived:
+                print(f"孤立文件回收: {report.as_dict()}")
+        except Exception as e:
+            print(f"孤立文件回收失败: {e}")
@@ -0,0 +1,209 @@
+"""
+预测结果缓存
+进程内 LRU + 数据库持久化表，键为上传内容哈希与模型版本
+"""
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.models.prediction import PredictionCacheEntry
+
+CACHE_REQUESTS = metrics.counter(
+    "cropvision_prediction_cache_requests_total", "Prediction cache lookups by result", ("result",)
+)
+
+
+@dataclass
+class CachedPrediction:
+    """缓存的预测结果"""
+    predicted_class: str
+    confidence: float
+    top_predictions: list[dict]
+    image_path: str
+
+
+class PredictionCache:
+    """
+    预测结果缓存
+
+    先查进程内 LRU，未命中再查持久化表（按模型版本过滤）；查询的模型版本变化时只清空本进程的 LRU。
+    旧版本的持久化条目由完成模型切换的进程删除一次（见 retire_other_versions），
+    而不是由每个查询进程各自删除：多个 API worker / 任务 worker 切换到新版本的时间不同，
+    否则会互相清空对方正在使用的条目。
+
+    进程内 LRU 只存放已提交的条目：调用方在持久化行随识别记录提交之后才调用 put()。
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max(0, max_entries)
+        self._entries: OrderedDict[str, CachedPrediction] = OrderedDict()
+        self._model_version: str | None = None
+        # 模型切换完成后待删除的旧版本条目（保留该版本，删除其他版本），由下一次 get() 执行
+        self._retire_version: str | None = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lru_get(self, content_hash: str) -> CachedPrediction | None:
+        with self._lock:
+            entry = self._entries.get(content_hash)
+            if entry is not None:
+                self._entries.move_to_end(content_hash)
+            return entry
+
+    def _lru_put(self, content_hash: str, entry: CachedPrediction):
+        if self.max_entries == 0:
+            return
+        with self._lock:
+            self._entries[content_hash] = entry
+            self._entries.move_to_end(content_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _lru_discard(self, content_hash: str):
+        with self._lock:
+            self._entries.pop(content_hash, None)
+
+    def _check_version(self, model_version: str):
+        """查询的模型版本变化时清空进程内 LRU（LRU 的键不含模型版本）"""
+        if self._model_version == model_version:
+            return
+        with self._lock:
+            self._entries.clear()
+        self._model_version = model_version
+
+    def retire_other_versions(self, model_version: str):
+        """
+        本进程完成模型切换后调用（可在切换线程中调用）：清空 LRU，
+        下一次 get() 在调用方的事务中删除其他版本的持久化条目
+        """
+        with self._lock:
+            self._entries.clear()
+            self._retire_version = model_version
+
+    async def _purge_retired(self, db: AsyncSession):
+        with self._lock:
+            model_version, self._retire_version = self._retire_version, None
+        if model_version is not None:
+            await db.execute(
+                delete(PredictionCacheEntry).where(PredictionCacheEntry.model_version != model_version)
+            )
+
+    async def get(self, db: AsyncSession, content_hash: str, model_version: str) -> CachedPrediction | None:
+        """
+        查询缓存
+
+        命中的条目所引用的图片文件若已被删除（例如历史记录被清理），视为未命中。
+        """
+        self._check_version(model_version)
+        await self._purge_retired(db)
+
+        entry = self._lru_get(content_hash)
+        if entry is None:
+            result = await db.execute(
+                select(PredictionCacheEntry).where(
+                    PredictionCacheEntry.content_hash == content_hash,
+                    PredictionCacheEntry.model_version == model_version,
+                )
+            )
+            row = result.scalar_one_or_none()
+            if row is not None:
+                entry = CachedPrediction(
+                    predicted_class=row.predicted_class,
+                    confidence=row.confidence,
+                    top_predictions=row.top_predictions,
+                    image_path=row.image_path,
+                )
+
+        if entry is not None and not (settings.UPLOAD_DIR / entry.image_path).exists():
+            self._lru_discard(content_hash)
+            await db.execute(
+                delete(PredictionCacheEntry).where(PredictionCacheEntry.content_hash == content_hash)
+            )
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            CACHE_REQUESTS.inc(result="miss")
+            return None
+
+        self.hits += 1
+        CACHE_REQUESTS.inc(result="hit")
+        self._lru_put(content_hash, entry)
+        return entry
+
+    def put(self, content_hash: str, model_version: str, entry: CachedPrediction):
+        """
+        写入进程内缓存（在持久化行提交之后调用）
+
+        模型已切换到其他版本时忽略，避免 LRU 中混入旧版本的结果
+        """
+        if model_version == self._model_version:
+            self._lru_put(content_hash, entry)
+
+    def remember(self, rows: list[dict]):
+        """把已提交的持久化行写入进程内缓存"""
+        for row in rows:
+            self.put(row["content_hash"], row["model_version"], CachedPrediction(
+                predicted_class=row["predicted_class"],
+                confidence=row["confidence"],
+                top_predictions=row["top_predictions"],
+                image_path=row["image_path"],
+            ))
+
+    @staticmethod
+    def row(content_hash: str, model_version: str, entry: CachedPrediction) -> dict:
+        """持久化表的行数据：由调用方通过 persist() 随识别记录一起写入（可能延迟批量写入），提交后再 put()"""
+        return {
+            "content_hash": content_hash,
+            "model_version": model_version,
+            "image_path": entry.image_path,
+            "predicted_class": entry.predicted_class,
+            "confidence": entry.confidence,
+            "top_predictions": entry.top_predictions,
+        }
+
+    async def persist(self, db: AsyncSession, rows: list[dict]):
+        """把 row() 生成的行写入持久化表（多行 upsert，随调用方的事务一起提交）"""
+        if not rows:
+            return
+        stmt = insert(PredictionCacheEntry).values(rows)
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=["content_hash", "model_version"],
+            set_={
+                column: stmt.excluded[column]
+                for column in ("image_path", "predicted_class", "confidence", "top_predictions")
+            },
+        ))
+
+    def stats(self) -> dict:
+        """命中/未命中计数"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0,
+            "entries": len(self._entries),
+            "model_version": self._model_version,
+        }
+
+
+# 全局缓存实例
+prediction_cache = PredictionCache(settings.PREDICTION_CACHE_SIZE)
+
+metrics.gauge(
+    "cropvision_prediction_cache_hit_ratio",
+    "Share of prediction cache lookups served from the cache",
+    lambda: prediction_cache.stats()["hit_ratio"],
+)
+metrics.gauge(
+    "cropvision_prediction_cache_entries",
+    "Entries in the in-process prediction LRU",
+    lambda: prediction_cache.stats()["entries"],
+)
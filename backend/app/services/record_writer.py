@@ -0,0 +1,275 @@
+"""
+识别记录写入
+单条识别的记录、统计汇总和缓存行默认随请求的事务一起提交；开启 write-behind 后
+先放入进程内缓冲区，由后台任务攒够 N 条或等待 T 毫秒后合并为一次多行插入、一次提交。
+识别时提取的特征在记录提交之后追加到相似检索索引（见 embedding_index）。
+
+代价是记录在写入前最多有 T 毫秒不可见（历史列表、统计接口），进程被强制杀死时
+缓冲区中的记录会丢失；正常关闭时会先写完剩余记录。
+
+合并写入违反约束（IntegrityError）时改为逐条写入，只丢弃出错的记录；其他错误
+（例如数据库繁忙）整批放回缓冲区重试，每条记录最多尝试 WRITE_BEHIND_MAX_ATTEMPTS 次。
+"""
+import asyncio
+import time
+
+import torch
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database import async_session
+from app.core.metrics import metrics
+from app.models.prediction import PredictionRecord
+from app.services import stats_rollup
+from app.services.embedding_index import embedding_index
+from app.services.prediction_cache import prediction_cache
+from app.services.taxonomy import class_columns
+
+WRITE_BEHIND_FLUSH_SECONDS = metrics.histogram(
+    "cropvision_write_behind_flush_seconds", "Time to write one buffered batch of prediction records"
+)
+WRITE_BEHIND_FLUSH_ROWS = metrics.histogram(
+    "cropvision_write_behind_flush_rows",
+    "Prediction records written per buffered batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024),
+)
+WRITE_BEHIND_DROPPED = metrics.counter(
+    "cropvision_write_behind_dropped_total",
+    "Buffered prediction records dropped without being written",
+    ("reason",),
+)
+
+
+async def write_predictions(db: AsyncSession, records: list[dict], cache_rows: list[dict]) -> list[int]:
+    """
+    一次写入多条识别记录，同时更新统计汇总表和预测缓存持久化表（调用方负责提交）
+
+    Args:
+        records: PredictionRecord 的列数据，必须包含 created_at；crop / disease / is_healthy 在此填充
+        cache_rows: prediction_cache.row() 生成的行
+
+    Returns:
+        与 records 一一对应的记录 ID
+    """
+    ids = []
+    if records:
+        records = [{**class_columns(record["predicted_class"]), **record} for record in records]
+        result = await db.execute(insert(PredictionRecord).values(records).returning(PredictionRecord.id))
+        # 单条多行 INSERT 按 VALUES 的顺序依次分配 rowid；RETURNING 本身不保证顺序，排序后与 records 对应
+        ids = sorted(result.scalars().all())
+        await stats_rollup.record_inserted(
+            db, [(record["created_at"], record["predicted_class"]) for record in records]
+        )
+    await prediction_cache.persist(db, cache_rows)
+    return ids
+
+
+async def backfill_class_columns(db: AsyncSession) -> int:
+    """
+    为 crop 为空的旧记录填充 crop / disease / is_healthy（调用方负责提交事务）
+
+    按类别逐个 UPDATE，每条语句走 predicted_class 索引，语句数只与类别数有关
+
+    Returns:
+        更新的记录数
+    """
+    classes = (await db.execute(
+        select(PredictionRecord.predicted_class).where(PredictionRecord.crop.is_(None)).distinct()
+    )).scalars().all()
+    updated = 0
+    for predicted_class in classes:
+        result = await db.execute(
+            update(PredictionRecord)
+            .where(PredictionRecord.predicted_class == predicted_class, PredictionRecord.crop.is_(None))
+            .values(**class_columns(predicted_class))
+        )
+        updated += result.rowcount
+    return updated
+
+
+class RecordWriter:
+    """识别记录的 write-behind 缓冲区"""
+
+    def __init__(self, enabled: bool, max_batch: int, flush_interval_ms: int, max_attempts: int):
+        self.enabled = enabled
+        self.max_batch = max(1, max_batch)
+        self.flush_interval = max(0, flush_interval_ms) / 1000
+        self.max_attempts = max(1, max_attempts)
+        # 以下四个列表一一对应：记录、特征、缓存行（没有时为 None）、已失败的写入次数
+        self._records: list[dict] = []
+        self._embeddings: list[torch.Tensor | None] = []
+        self._cache_rows: list[dict | None] = []
+        self._attempts: list[int] = []
+        self._has_data: asyncio.Event | None = None
+        self._full: asyncio.Event | None = None
+        self._flush_lock: asyncio.Lock | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._records)
+
+    def start(self):
+        """在应用启动时调用（需要运行中的事件循环）"""
+        if not self.enabled or self._task is not None:
+            return
+        self._has_data = asyncio.Event()
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """在应用关闭时调用：停止后台任务并写完缓冲区中的记录"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        written = await self.flush()
+        if self._records:
+            print(f"⚠️ 关闭时仍有 {len(self._records)} 条识别记录未能写入数据库")
+        elif written:
+            print(f"已写入缓冲区中剩余的 {written} 条识别记录")
+
+    async def save(
+        self, db: AsyncSession, record: dict, cache_row: dict | None = None, embedding: torch.Tensor | None = None
+    ) -> int | None:
+        """
+        保存一条识别记录
+
+        未开启 write-behind 时写入 db 的当前事务并返回记录 ID（由调用方提交，
+        提交后再把特征交给 embedding_index）；开启时连同特征放入缓冲区后立即返回 None。
+        """
+        if self._task is None:
+            return (await write_predictions(db, [record], [cache_row] if cache_row is not None else []))[0]
+        self._requeue([record], [embedding], [cache_row], [0])
+        self._has_data.set()
+        if len(self._records) >= self.max_batch:
+            self._full.set()
+
+    async def _run(self):
+        while True:
+            await self._has_data.wait()
+            try:
+                # 从第一条记录进入缓冲区开始计时，攒满一批则提前写入
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    def _requeue(
+        self, records: list[dict], embeddings: list, cache_rows: list, attempts: list[int], front: bool = False
+    ):
+        """放入缓冲区（front 为 True 时放回队首，保持原有顺序）"""
+        at = 0 if front else len(self._records)
+        self._records[at:at] = records
+        self._embeddings[at:at] = embeddings
+        self._cache_rows[at:at] = cache_rows
+        self._attempts[at:at] = attempts
+
+    @staticmethod
+    async def _write(records: list[dict], cache_rows: list[dict | None]) -> list[int]:
+        """写入并提交，提交后把缓存行放入进程内缓存"""
+        rows = [row for row in cache_rows if row is not None]
+        async with async_session() as db:
+            ids = await write_predictions(db, records, rows)
+            await db.commit()
+        prediction_cache.remember(rows)
+        return ids
+
+    def _retry_later(self, batch: list[tuple], error: Exception):
+        """写入失败的记录放回缓冲区，已达到尝试次数上限的丢弃"""
+        keep = [entry for entry in batch if entry[3] + 1 < self.max_attempts]
+        dropped = len(batch) - len(keep)
+        if keep:
+            records, embeddings, cache_rows, attempts = zip(*keep)
+            self._requeue(list(records), list(embeddings), list(cache_rows), [n + 1 for n in attempts], front=True)
+            self._has_data.set()
+        if dropped:
+            WRITE_BEHIND_DROPPED.inc(dropped, reason="attempts")
+            print(f"⚠️ {dropped} 条识别记录已写入失败 {self.max_attempts} 次，丢弃: {error}")
+
+    async def _write_one_by_one(self, batch: list[tuple]) -> tuple[list[int], list[dict], list]:
+        """
+        合并写入违反约束时逐条写入：违反约束的记录记录日志后丢弃，
+        其他错误的记录放回缓冲区重试
+
+        Returns:
+            已写入记录的 ID、记录和特征
+        """
+        ids, written, embeddings, failed = [], [], [], []
+        error = None
+        for index, entry in enumerate(batch):
+            record, embedding, cache_row, _ = entry
+            try:
+                ids.extend(await self._write([record], [cache_row]))
+            except IntegrityError as e:
+                WRITE_BEHIND_DROPPED.inc(reason="integrity")
+                print(f"⚠️ 识别记录违反约束，丢弃: {record} ({e.orig})")
+                continue
+            except Exception as e:
+                failed.append(entry)
+                error = e
+                continue
+            except BaseException:
+                # 被取消：尚未写入的记录放回缓冲区
+                self._requeue(*map(list, zip(*(failed + batch[index:]))), front=True)
+                self._has_data.set()
+                raise
+            written.append(record)
+            embeddings.append(embedding)
+        if failed:
+            self._retry_later(failed, error)
+        return ids, written, embeddings
+
+    async def flush(self) -> int:
+        """写入缓冲区中的全部记录，返回写入条数；失败时记录放回缓冲区，下一轮重试"""
+        if self._flush_lock is None:
+            return 0
+        async with self._flush_lock:
+            batch = list(zip(self._records, self._embeddings, self._cache_rows, self._attempts))
+            self._records, self._embeddings, self._cache_rows, self._attempts = [], [], [], []
+            self._full.clear()
+            self._has_data.clear()
+            if not batch:
+                return 0
+            records = [entry[0] for entry in batch]
+            embeddings = [entry[1] for entry in batch]
+            start = time.perf_counter()
+            try:
+                ids = await self._write(records, [entry[2] for entry in batch])
+            except IntegrityError:
+                ids, records, embeddings = await self._write_one_by_one(batch)
+            except Exception as e:
+                print(f"批量写入识别记录失败，稍后重试: {e}")
+                self._retry_later(batch, e)
+                return 0
+            except BaseException:
+                # 关闭时被取消：放回缓冲区（不计入失败次数），由 stop() 的最后一次 flush 写入
+                self._requeue(*map(list, zip(*batch)), front=True)
+                self._has_data.set()
+                raise
+            WRITE_BEHIND_FLUSH_SECONDS.observe(time.perf_counter() - start)
+            WRITE_BEHIND_FLUSH_ROWS.observe(len(records))
+            await embedding_index.add(zip(ids, [record["model_version"] for record in records], embeddings))
+            return len(records)
+
+
+# 全局单例
+record_writer = RecordWriter(
+    settings.PREDICTION_WRITE_BEHIND,
+    settings.WRITE_BEHIND_MAX_BATCH,
+    settings.WRITE_BEHIND_FLUSH_MS,
+    settings.WRITE_BEHIND_MAX_ATTEMPTS,
+)
+
+metrics.gauge(
+    "cropvision_write_behind_pending", "Prediction records buffered and not yet written",
+    function=lambda: record_writer.pending,
+)
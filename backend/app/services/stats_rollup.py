@@ -0,0 +1,187 @@
+"""
+统计汇总表维护
+识别记录按 日期 × 类别 计数，插入 / 删除记录时在同一个会话（同一事务）中增减计数；
+统计接口只读取汇总表，耗时与识别记录总数无关
+"""
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Iterable
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models.prediction import PredictionDailyStat, PredictionRecord
+from app.services.taxonomy import class_columns
+
+
+async def _apply(db: AsyncSession, deltas: Counter, sign: int):
+    if not deltas:
+        return
+    values = [
+        {
+            "day": day,
+            "predicted_class": predicted_class,
+            "crop": class_columns(predicted_class)["crop"],
+            "is_healthy": class_columns(predicted_class)["is_healthy"],
+            "count": sign * count,
+        }
+        for (day, predicted_class), count in deltas.items()
+    ]
+    stmt = insert(PredictionDailyStat)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[PredictionDailyStat.day, PredictionDailyStat.predicted_class],
+        set_={"count": PredictionDailyStat.count + stmt.excluded.count},
+    )
+    await db.execute(stmt, values)
+    if sign < 0:
+        await db.execute(delete(PredictionDailyStat).where(PredictionDailyStat.count <= 0))
+
+
+async def record_inserted(db: AsyncSession, rows: Iterable[tuple[datetime, str]]):
+    """
+    登记新插入的识别记录（调用方负责提交事务）
+
+    Args:
+        rows: (created_at, predicted_class) 列表
+    """
+    await _apply(db, Counter((created_at.date(), cls) for created_at, cls in rows), 1)
+
+
+async def record_deleted(db: AsyncSession, rows: Iterable[tuple[datetime, str]]):
+    """登记被删除的识别记录（调用方负责提交事务）"""
+    await _apply(db, Counter((created_at.date(), cls) for created_at, cls in rows), -1)
+
+
+async def rebuild(db: AsyncSession) -> int:
+    """
+    根据识别记录全量重建汇总表（调用方负责提交事务）
+
+    Returns:
+        汇总的识别记录数
+    """
+    await db.execute(delete(PredictionDailyStat))
+    day = func.date(PredictionRecord.created_at)
+    result = await db.execute(
+        select(day, PredictionRecord.predicted_class, func.count())
+        .group_by(day, PredictionRecord.predicted_class)
+    )
+    deltas = Counter({
+        (date.fromisoformat(row_day), predicted_class): count
+        for row_day, predicted_class, count in result.all()
+    })
+    await _apply(db, deltas, 1)
+    return sum(deltas.values())
+
+
+async def ensure_initialized(db: AsyncSession):
+    """汇总表为空而识别记录非空（首次升级到带汇总表的版本）时自动重建"""
+    has_stats = (await db.execute(select(PredictionDailyStat.day).limit(1))).first() is not None
+    if has_stats:
+        return
+    has_records = (await db.execute(select(PredictionRecord.id).limit(1))).first() is not None
+    if has_records:
+        total = await rebuild(db)
+        await db.commit()
+        print(f"已根据 {total} 条识别记录重建统计汇总表")
+
+
+async def summary(db: AsyncSession) -> dict:
+    """总数、今日数、健康/病害数以及按类别、按作物的计数"""
+    class_rows = (await db.execute(
+        select(
+            PredictionDailyStat.predicted_class,
+            PredictionDailyStat.crop,
+            PredictionDailyStat.is_healthy,
+            func.sum(PredictionDailyStat.count),
+        ).group_by(PredictionDailyStat.predicted_class)
+    )).all()
+    today_count = (await db.execute(
+        select(func.coalesce(func.sum(PredictionDailyStat.count), 0))
+        .where(PredictionDailyStat.day == date.today())
+    )).scalar()
+
+    total = sum(row[3] for row in class_rows)
+    healthy_count = sum(row[3] for row in class_rows if row[2])
+    crop_stats = {}
+    for predicted_class, crop, healthy, count in class_rows:
+        item = crop_stats.setdefault(crop, {"crop": crop, "count": 0, "healthy": 0, "diseased": 0})
+        item["count"] += count
+        item["healthy" if healthy else "diseased"] += count
+
+    return {
+        "total": total,
+        "today_count": today_count,
+        "healthy_count": healthy_count,
+        "diseased_count": total - healthy_count,
+        "healthy_rate": round(healthy_count / total, 4) if total > 0 else 0,
+        "by_class": [{"class": row[0], "count": row[3]} for row in class_rows],
+        "by_crop": list(crop_stats.values()),
+    }
+
+
+def _bucket(day: date, granularity: str) -> date:
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+async def trend(db: AsyncSession, start: date, end: date, granularity: str = "day") -> list[dict]:
+    """
+    按 日 / 周（周一）/ 月（1 日）汇总 [start, end] 内的识别数和健康 / 病害数
+
+    汇总表按主键 (day, predicted_class) 做范围扫描，结果行数只与天数有关
+    """
+    result = await db.execute(
+        select(
+            PredictionDailyStat.day,
+            PredictionDailyStat.is_healthy,
+            func.sum(PredictionDailyStat.count),
+        )
+        .where(PredictionDailyStat.day >= start, PredictionDailyStat.day <= end)
+        .group_by(PredictionDailyStat.day, PredictionDailyStat.is_healthy)
+    )
+    buckets = {}
+    for day, healthy, count in result.all():
+        key = _bucket(day, granularity).isoformat()
+        item = buckets.setdefault(key, {"date": key, "total": 0, "healthy": 0, "diseased": 0})
+        item["total"] += count
+        item["healthy" if healthy else "diseased"] += count
+    return sorted(buckets.values(), key=lambda item: item["date"])
+
+
+class TrendCache:
+    """趋势统计的短时响应缓存，键为 (start, end, granularity)"""
+
+    def __init__(self, ttl: float, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: dict[tuple, tuple[float, list[dict]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> list[dict] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            return entry[1]
+
+    def put(self, key: tuple, data: list[dict]):
+        if self.ttl <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries = {k: v for k, v in self._entries.items() if v[0] >= now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (now + self.ttl, data)
+
+
+# 全局单例
+trend_cache = TrendCache(settings.STATS_TREND_CACHE_TTL)
@@ -0,0 +1,28 @@
+"""
+病害类别名称解析
+类别名称为 PlantVillage 风格的 "<作物>___<病害>"，健康类别的病害部分为 healthy
+"""
+from functools import lru_cache
+
+SEPARATOR = "___"
+
+
+def split_class(class_name: str) -> tuple[str, str]:
+    """拆分为 (作物, 病害)；不含分隔符时整个名称视为作物"""
+    crop, _, disease = class_name.partition(SEPARATOR)
+    return crop, disease
+
+
+def crop_of(class_name: str) -> str:
+    return split_class(class_name)[0]
+
+
+def is_healthy(class_name: str) -> bool:
+    return "healthy" in class_name.lower()
+
+
+@lru_cache(maxsize=1024)
+def class_columns(class_name: str) -> dict:
+    """识别记录中由类别名称派生的列: crop / disease / is_healthy"""
+    crop, disease = split_class(class_name)
+    return {"crop": crop, "disease": disease, "is_healthy": is_healthy(class_name)}
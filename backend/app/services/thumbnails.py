@@ -0,0 +1,108 @@
+"""
+派生图片服务
+为上传的原图生成 WebP 缩略图和中等尺寸预览图，存放在分片的缓存目录中
+
+目录结构: DERIVED_DIR/<variant>/<ab>/<原图文件名>.webp
+其中 ab 为原图文件名哈希的前两位，避免单个目录下文件过多。
+"""
+import hashlib
+import os
+import threading
+import uuid
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+# 派生图片规格: 名称 -> 最长边像素
+VARIANTS = {
+    "thumb": settings.THUMBNAIL_SIZE,
+    "preview": settings.PREVIEW_SIZE,
+}
+
+DERIVED_GENERATE_SECONDS = metrics.histogram(
+    "cropvision_derived_image_seconds", "Time to generate a derived WebP image", ("variant",)
+)
+
+
+class DerivedImageError(ValueError):
+    """原图不存在或文件名不合法"""
+    pass
+
+
+def derived_path(image_path: str, variant: str) -> Path:
+    shard = hashlib.sha1(image_path.encode()).hexdigest()[:2]
+    return settings.DERIVED_DIR / variant / shard / f"{image_path}.webp"
+
+
+def _source_path(image_path: str) -> Path:
+    # 只接受上传目录下的文件名，拒绝路径穿越
+    if not image_path or Path(image_path).name != image_path or image_path.startswith("."):
+        raise DerivedImageError(f"非法的文件名: {image_path}")
+    source = settings.UPLOAD_DIR / image_path
+    if not source.is_file():
+        raise DerivedImageError(f"原图不存在: {image_path}")
+    return source
+
+
+# 同一张图片的同一规格只生成一次，并发请求等待同一个结果
+_locks: dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def _lock_for(key: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def ensure_derived(image_path: str, variant: str) -> Path:
+    """
+    返回派生图片路径，不存在时生成（阻塞调用，应在线程中执行）
+
+    Raises:
+        KeyError: 未知的规格
+        DerivedImageError: 原图不存在或文件名不合法
+    """
+    size = VARIANTS[variant]
+    target = derived_path(image_path, variant)
+    if target.exists():
+        return target
+
+    source = _source_path(image_path)
+    key = f"{variant}/{image_path}"
+    with _lock_for(key):
+        if target.exists():
+            return target
+        with DERIVED_GENERATE_SECONDS.time(variant=variant):
+            with Image.open(source) as image:
+                # JPEG 直接按接近目标的比例解码，避免先解码整张大图
+                image.draft("RGB", (size, size))
+                image = ImageOps.exif_transpose(image).convert("RGB")
+                image.thumbnail((size, size), Image.Resampling.LANCZOS)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                temp = target.with_name(f".{uuid.uuid4()}.tmp")
+                image.save(temp, "WEBP", quality=settings.DERIVED_WEBP_QUALITY, method=4)
+            # 原子替换，并发读取方不会看到写了一半的文件
+            os.replace(temp, target)
+    with _locks_guard:
+        _locks.pop(key, None)
+    return target
+
+
+def generate_all(image_paths: list[str]):
+    """入库时预先生成所有规格（在后台任务中执行，失败不影响主流程）"""
+    for image_path in image_paths:
+        for variant in VARIANTS:
+            try:
+                ensure_derived(image_path, variant)
+            except Exception as e:
+                print(f"生成派生图片失败 ({variant}/{image_path}): {e}")
+
+
+def delete_derived(image_paths: set[str]):
+    """原图删除时一并删除其派生图片"""
+    for image_path in image_paths:
+        for variant in VARIANTS:
+            derived_path(image_path, variant).unlink(missing_ok=True)
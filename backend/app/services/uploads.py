@@ -0,0 +1,183 @@
+"""
+上传文件流式落盘
+直接解析 multipart 请求体，图片数据边接收边写入磁盘，同一遍扫描中计算内容哈希、识别文件头并检查大小上限
+"""
+import hashlib
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+
+import anyio
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+from starlette.requests import Request
+
+
+class UploadTooLargeError(ValueError):
+    """上传内容超过大小上限"""
+    pass
+
+
+class UnsupportedImageError(ValueError):
+    """文件头不是支持的图片格式"""
+    pass
+
+
+# 文件头魔数 -> 保存时使用的扩展名
+_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+)
+SNIFF_BYTES = 12
+
+
+def sniff_image_type(header: bytes) -> str | None:
+    """根据文件头识别图片格式，返回扩展名；无法识别时返回 None"""
+    for magic, suffix in _SIGNATURES:
+        if header.startswith(magic):
+            return suffix
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+
+@dataclass
+class StoredUpload:
+    """已落盘的上传文件（位于临时路径，由调用方决定保留或删除）"""
+    path: Path
+    size: int
+    sha256: str
+    suffix: str
+
+    async def commit(self, filename: str) -> Path:
+        """把临时文件移动为正式文件名（同目录内重命名，原子操作）"""
+        target = self.path.with_name(filename)
+        await anyio.Path(self.path).rename(target)
+        self.path = target
+        return target
+
+    async def discard(self):
+        await anyio.Path(self.path).unlink(missing_ok=True)
+
+
+class _MultipartEvents:
+    """
+    python-multipart 的回调（同步调用）只记录事件，由 stream_upload 在每块数据解析后异步处理，
+    与 Starlette 的 MultiPartParser 相同的做法
+    """
+
+    def __init__(self):
+        self.events: list[tuple[str, object]] = []
+        self._headers: list[tuple[bytes, bytes]] = []
+        self._field = b""
+        self._value = b""
+
+    def on_part_begin(self):
+        self._headers = []
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._value += data[start:end]
+
+    def on_header_end(self):
+        self._headers.append((self._field.lower(), self._value))
+        self._field = self._value = b""
+
+    def on_headers_finished(self):
+        headers = dict(self._headers)
+        _, options = parse_options_header(headers.get(b"content-disposition", b""))
+        content_type, _ = parse_options_header(headers.get(b"content-type", b""))
+        name = options.get(b"name", b"").decode("latin-1")
+        self.events.append(("headers", (name, content_type.decode("latin-1"))))
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        self.events.append(("data", data[start:end]))
+
+    def on_part_end(self):
+        self.events.append(("end", None))
+
+    def callbacks(self) -> dict:
+        return {
+            name: getattr(self, name)
+            for name in (
+                "on_part_begin", "on_header_field", "on_header_value", "on_header_end",
+                "on_headers_finished", "on_part_data", "on_part_end",
+            )
+        }
+
+
+async def stream_upload(
+    request: Request,
+    directory: Path,
+    max_bytes: int,
+    allowed_types: set[str],
+    field: str = "file",
+) -> StoredUpload:
+    """
+    从 multipart/form-data 请求体中取出 field 字段的图片，直接写入 directory 下的临时文件
+
+    边接收边解析请求体（不经过 Starlette 的表单解析和它的临时文件），图片数据只落盘一次；
+    每块依次更新哈希并异步写盘，超过 max_bytes、声明的类型不在 allowed_types 中或文件头
+    不是支持的图片格式时立即停止接收并删除临时文件。其他字段的内容被忽略。
+
+    Raises:
+        UploadTooLargeError: 图片超过 max_bytes
+        UnsupportedImageError: 请求不是 multipart、缺少 field 字段、类型不支持或文件头不是 jpg / png / webp
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise UnsupportedImageError("请求必须是 multipart/form-data")
+
+    receiver = _MultipartEvents()
+    parser = MultipartParser(options[b"boundary"], receiver.callbacks())
+    temp_path = directory / f".{uuid.uuid4()}.part"
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    suffix = None
+    out = None
+    # 当前分段是否为图片字段；图片字段出现过之后不再接收第二个同名字段
+    in_image = found = False
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for kind, payload in receiver.events:
+                if kind == "headers":
+                    name, part_type = payload
+                    in_image = name == field and not found
+                    if in_image:
+                        if part_type not in allowed_types:
+                            raise UnsupportedImageError("仅支持 jpg/png/webp 格式图片")
+                        found = True
+                        out = await anyio.open_file(temp_path, "wb")
+                elif kind == "data" and in_image:
+                    size += len(payload)
+                    if size > max_bytes:
+                        raise UploadTooLargeError(f"图片大小超过 {max_bytes // (1024 * 1024)} MB 上限")
+                    if suffix is None:
+                        # 文件头可能跨越两块数据，凑够 SNIFF_BYTES 再识别
+                        head += payload[:SNIFF_BYTES - len(head)]
+                        if len(head) >= SNIFF_BYTES:
+                            suffix = sniff_image_type(head)
+                            if suffix is None:
+                                raise UnsupportedImageError("文件内容不是 jpg/png/webp 图片")
+                    digest.update(payload)
+                    await out.write(payload)
+                elif kind == "end" and in_image:
+                    in_image = False
+                    await out.aclose()
+                    out = None
+            receiver.events.clear()
+        parser.finalize()
+        if not found:
+            raise UnsupportedImageError(f"缺少 {field} 字段")
+        if suffix is None:
+            raise UnsupportedImageError("上传的文件为空" if size == 0 else "文件内容不是 jpg/png/webp 图片")
+    except BaseException:
+        if out is not None:
+            await out.aclose()
+        await anyio.Path(temp_path).unlink(missing_ok=True)
+        raise
+    return StoredUpload(path=temp_path, size=size, sha256=digest.hexdigest(), suffix=suffix)
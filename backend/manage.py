@@ -0,0 +1,91 @@
+"""
+运维管理命令
+
+用法:
+    python manage.py rebuild-stats       # 根据识别记录全量重建统计汇总表
+    python manage.py backfill-columns    # 为旧识别记录填充 crop / disease / is_healthy 列
+    python manage.py gc-uploads          # 清理没有记录引用的图片、临时文件和派生图片
+    python manage.py index-embeddings    # 为相似检索的特征矩阵重建 IVF 索引
+"""
+import argparse
+import asyncio
+import time
+
+from app.core.config import settings
+from app.core.database import async_session, init_db
+from app.services import stats_rollup
+from app.services.embedding_index import embedding_index
+from app.services.orphan_gc import collect_orphans
+from app.services.record_writer import backfill_class_columns
+
+
+async def rebuild_stats(args):
+    await init_db()
+    async with async_session() as db:
+        total = await stats_rollup.rebuild(db)
+        await db.commit()
+    print(f"✅ 已根据 {total} 条识别记录重建统计汇总表")
+
+
+async def backfill_columns(args):
+    # init_db 会为旧数据库补上新增的列和索引
+    await init_db()
+    async with async_session() as db:
+        updated = await backfill_class_columns(db)
+        await db.commit()
+    print(f"✅ 已为 {updated} 条识别记录填充作物 / 病害 / 健康状态列")
+
+
+async def gc_uploads(args):
+    await init_db()
+    report = await collect_orphans(grace_seconds=args.grace, dry_run=args.dry_run)
+    action = "可清理" if args.dry_run else "已清理"
+    print(
+        f"✅ 扫描 {report.scanned} 个上传文件（{report.skipped_recent} 个在宽限期内跳过），"
+        f"{action}孤立图片 {report.uploads} 个、临时文件 {report.temp_files} 个、派生图片 {report.derived} 个"
+    )
+
+
+async def index_embeddings(args):
+    spaces = embedding_index.spaces()
+    if not spaces:
+        print(f"⚠️ {settings.EMBEDDING_DIR} 下没有特征矩阵")
+    for space in spaces:
+        count = space.count()
+        if count < settings.EMBEDDING_IVF_MIN_ROWS and not args.force:
+            print(f"跳过 {space.model_version}: {count} 条特征，少于 EMBEDDING_IVF_MIN_ROWS")
+            continue
+        start = time.perf_counter()
+        nlist = await asyncio.to_thread(space.build_ivf)
+        print(f"✅ {space.model_version}: {count} 条特征，{nlist} 个聚类，耗时 {time.perf_counter() - start:.1f} s")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="CropVision-AI 管理命令")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = subparsers.add_parser("rebuild-stats", help="根据识别记录重建统计汇总表")
+    rebuild.set_defaults(handler=rebuild_stats)
+
+    backfill = subparsers.add_parser("backfill-columns", help="为旧识别记录填充 crop / disease / is_healthy 列")
+    backfill.set_defaults(handler=backfill_columns)
+
+    gc = subparsers.add_parser("gc-uploads", help="清理没有记录引用的图片、临时文件和派生图片")
+    gc.add_argument("--grace", type=int, default=None, help="跳过最近多少秒内修改的文件（默认 ORPHAN_GC_GRACE_SECONDS）")
+    gc.add_argument("--dry-run", action="store_true", help="只统计不删除")
+    gc.set_defaults(handler=gc_uploads)
+
+    index = subparsers.add_parser("index-embeddings", help="为相似检索的特征矩阵重建 IVF 索引")
+    index.add_argument("--force", action="store_true", help="行数少于 EMBEDDING_IVF_MIN_ROWS 时也构建")
+    index.set_defaults(handler=index_embeddings)
+
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    asyncio.run(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()
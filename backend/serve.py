@@ -0,0 +1,120 @@
+"""
+多进程部署入口（预加载 + fork）
+
+父进程先加载应用和模型，再 fork 出多个 uvicorn worker 共享同一个监听端口。
+模型权重在 fork 前已经就位，子进程通过写时复制共享这些内存页，
+而不是像 `uvicorn --workers N` 那样每个进程各自加载一份。
+
+用法:
+    python serve.py --workers 4              # 预加载模式（共享权重）
+    python serve.py --workers 4 --no-preload # 每个 worker 各自加载（对照组）
+    python serve.py --workers 4 --report     # 启动后打印各 worker 的内存占用
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+from app.core.config import settings
+from app.core.memory import format_report, memory_report
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="CropVision-AI 多进程部署")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.SERVE_WORKERS)
+    parser.add_argument("--no-preload", action="store_true", help="fork 后由每个 worker 各自加载模型")
+    parser.add_argument("--report", action="store_true", help="启动后打印每个 worker 的 RSS/PSS")
+    parser.add_argument("--report-delay", type=float, default=5.0, help="启动后等待多少秒再统计内存")
+    return parser.parse_args()
+
+
+def load_app(preload_model: bool = False):
+    from app.main import app
+    if preload_model:
+        # fork 前只加载模型、不预热。load() 会以 1 个算子内线程执行量化引擎比较的前向传播：
+        # 单线程时 PyTorch 直接在当前线程执行，不启动 OpenMP 线程池，子进程不会继承失效的线程池状态；
+        # 线程数调优和预热在各子进程中进行
+        from app.services.ai_service import ai_service
+        ai_service.load()
+    return app
+
+
+def run_worker(sock: socket.socket, preloaded_app):
+    app = preloaded_app if preloaded_app is not None else load_app()
+    config = uvicorn.Config(app, log_level="info")
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def main():
+    args = get_args()
+    # 各 worker 启动调优时按同机 worker 数分配线程预算（见 AUTOTUNE_ENABLED）
+    settings.SERVE_WORKERS = max(1, args.workers)
+
+    if not hasattr(os, "fork"):
+        print("[WARN] 当前平台不支持 fork，回退到 uvicorn 多进程模式（不共享权重）")
+        uvicorn.run("app.main:app", host=args.host, port=args.port, workers=args.workers)
+        return
+
+    print("[INFO] 父进程启动时内存:")
+    print(format_report([memory_report()]))
+
+    app = None
+    if not args.no_preload:
+        app = load_app(preload_model=True)
+        print("[INFO] 预加载完成后父进程内存:")
+        print(format_report([memory_report()]))
+        # 冻结现有对象，避免子进程中的垃圾回收触碰这些页导致写时复制
+        gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    children = []
+    for _ in range(max(1, args.workers)):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(sock, app)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    print(f"[INFO] 已启动 {len(children)} 个 worker: {children}，监听 {args.host}:{args.port}")
+
+    def shutdown(signum, _frame):
+        for child in children:
+            try:
+                os.kill(child, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    if args.report:
+        time.sleep(args.report_delay)
+        mode = "逐进程加载" if args.no_preload else "预加载共享"
+        print(f"[INFO] 各 worker 内存占用（{mode}）:")
+        print(format_report([memory_report(pid) for pid in children]))
+
+    for child in children:
+        try:
+            os.waitpid(child, 0)
+        except ChildProcessError:
+            pass
+    sock.close()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+测试环境
+在导入 app 之前把数据库、上传目录等指向临时目录，避免改动仓库中的 cropvision.db 和 uploads/
+"""
+import asyncio
+import os
+import tempfile
+from pathlib import Path
+
+_ROOT = Path(tempfile.mkdtemp(prefix="cropvision-test-"))
+for name in ("uploads", "derived", "models", "embeddings"):
+    (_ROOT / name).mkdir()
+os.environ.update({
+    "DATABASE_URL": f"sqlite+aiosqlite:///{_ROOT / 'test.db'}",
+    "UPLOAD_DIR": str(_ROOT / "uploads"),
+    "DERIVED_DIR": str(_ROOT / "derived"),
+    "MODEL_DIR": str(_ROOT / "models"),
+    "EMBEDDING_DIR": str(_ROOT / "embeddings"),
+    "DEBUG": "false",
+    "DERIVED_PREGENERATE": "false",
+})
+
+import pytest  # noqa: E402
+
+from app.core.database import Base, engine, init_db  # noqa: E402
+from app.services.prediction_cache import prediction_cache  # noqa: E402
+
+
+async def _dispose_after(coro):
+    try:
+        return await coro
+    finally:
+        # 连接绑定在创建它的事件循环上，每次 asyncio.run 之后关闭连接池
+        await engine.dispose()
+
+
+@pytest.fixture
+def run():
+    """在新的事件循环中执行协程并返回结果"""
+    return lambda coro: asyncio.run(_dispose_after(coro))
+
+
+@pytest.fixture(autouse=True)
+def database(run):
+    """每个测试使用空表和空的进程内预测缓存"""
+    async def reset():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+        await init_db()
+
+    run(reset())
+    prediction_cache._entries.clear()
+    prediction_cache._model_version = None
+    prediction_cache._retire_version = None
+    yield
@@ -0,0 +1,62 @@
+"""批量上传 / zip 展开：单张和合计大小上限、按文件头识别扩展名"""
+import io
+import zipfile
+
+import pytest
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+
+from app.api.predict import _expand_uploads
+from app.core.config import settings
+from app.services.uploads import UploadTooLargeError
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 100
+MB = 1024 * 1024
+
+
+def _upload(name: str, content: bytes, content_type: str) -> UploadFile:
+    return UploadFile(io.BytesIO(content), filename=name, headers=Headers({"content-type": content_type}))
+
+
+def _zip(entries: dict[str, bytes]) -> UploadFile:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in entries.items():
+            archive.writestr(name, content)
+    return _upload("images.zip", buffer.getvalue(), "application/zip")
+
+
+@pytest.fixture
+def small_limits(monkeypatch):
+    monkeypatch.setattr(settings, "MAX_UPLOAD_SIZE_MB", 1)
+    monkeypatch.setattr(settings, "MAX_REQUEST_SIZE_MB", 2)
+
+
+def test_suffix_comes_from_file_header(small_limits):
+    # 扩展名与内容不符的文件按文件头保存，非图片内容以错误项占位
+    items = _expand_uploads([
+        _upload("leaf.jpg", PNG, "image/jpeg"),
+        _zip({"a/leaf.webp": PNG, "b.png": b"not an image", "notes.txt": b"x"}),
+    ])
+    assert [(item.name, item.suffix, item.error is None) for item in items] == [
+        ("leaf.jpg", ".png", True),
+        ("a/leaf.webp", ".png", True),
+        ("b.png", None, False),
+        ("notes.txt", None, False),
+    ]
+
+
+def test_oversized_entries_are_skipped(small_limits):
+    # 高压缩比的条目按声明大小直接拒绝；单独上传的文件分块读取到上限即停止
+    items = _expand_uploads([
+        _zip({"bomb.png": PNG + b"\x00" * (2 * MB)}),
+        _upload("big.png", PNG + b"\x00" * MB, "image/png"),
+    ])
+    assert [item.content for item in items] == [None, None]
+    assert all("1 MB" in item.error for item in items)
+
+
+def test_total_decompressed_size_is_capped(small_limits):
+    entries = {f"{i}.png": PNG + b"\x00" * (MB - len(PNG) - 1) for i in range(3)}
+    with pytest.raises(UploadTooLargeError):
+        _expand_uploads([_zip(entries)])
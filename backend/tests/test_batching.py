@@ -0,0 +1,79 @@
+"""微批处理：并发请求合并为一批，结果按行交还各自的调用方，批量前向的异常传给该批所有请求"""
+import pytest
+import torch
+
+from app.services.batching import MicroBatcher
+
+
+def _inputs(count: int) -> list[torch.Tensor]:
+    # 每个输入的值等于自己的序号，便于核对结果的归属
+    return [torch.full((3, 2, 2), float(i)) for i in range(count)]
+
+
+def test_requests_grouped_up_to_max_batch_size():
+    sizes = []
+
+    def run_batch(batch):
+        sizes.append(batch.size(0))
+        return batch
+
+    # 等待窗口足够长：凑满 4 条立即执行，剩余 2 条等窗口结束后成批
+    batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=200)
+    futures = [batcher.submit(t) for t in _inputs(6)]
+    for future in futures:
+        future.result(timeout=5)
+
+    assert sizes == [4, 2]
+    assert batcher.stats.snapshot()["size_histogram"] == {2: 1, 4: 1}
+
+
+def test_results_routed_to_their_callers():
+    def run_batch(batch):
+        # 每行输出 (输入值 * 10, 行号)：行号不同也能核对每个调用方拿到的是自己那一行
+        values = batch.flatten(1)[:, 0] * 10
+        return torch.stack([values, torch.arange(batch.size(0), dtype=batch.dtype)], dim=1)
+
+    batcher = MicroBatcher(run_batch, max_batch_size=8, max_wait_ms=50)
+    futures = [batcher.submit(t) for t in _inputs(5)]
+
+    results = [future.result(timeout=5) for future in futures]
+    assert [row[0].item() for row in results] == [0.0, 10.0, 20.0, 30.0, 40.0]
+    assert [row[1].item() for row in results] == [0.0, 1.0, 2.0, 3.0, 4.0]
+
+
+def test_exception_propagates_to_whole_batch():
+    calls = []
+
+    def run_batch(batch):
+        calls.append(batch.size(0))
+        if len(calls) == 1:
+            raise RuntimeError("forward failed")
+        return batch
+
+    batcher = MicroBatcher(run_batch, max_batch_size=3, max_wait_ms=200)
+    failed = [batcher.submit(t) for t in _inputs(3)]
+    for future in failed:
+        with pytest.raises(RuntimeError, match="forward failed"):
+            future.result(timeout=5)
+
+    # 后台线程不因异常退出，后续请求照常处理
+    later = batcher.submit(torch.ones(3, 2, 2))
+    assert torch.equal(later.result(timeout=5), torch.ones(3, 2, 2))
+    assert calls == [3, 1]
+
+
+def test_cancelled_request_skipped():
+    sizes = []
+
+    def run_batch(batch):
+        sizes.append(batch.size(0))
+        return batch
+
+    batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=200)
+    futures = [batcher.submit(t) for t in _inputs(3)]
+    cancelled = futures[1].cancel()
+    futures[0].result(timeout=5)
+    futures[2].result(timeout=5)
+
+    # 取消发生在组批之前时该请求不进入前向；否则前向照常包含它
+    assert sizes == ([2] if cancelled else [3])
@@ -0,0 +1,146 @@
+"""批量删除：ID 数量超过 SQLite 的参数上限时分块删除，记录、图片和统计汇总一并清理；进程退出后遗留的任务标记为失败"""
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, func, select
+from sqlalchemy.exc import OperationalError
+
+from app.core.config import settings
+from app.core.database import async_session
+from app.models.prediction import BulkDeleteJob, PredictionDailyStat, PredictionRecord
+from app.services import bulk_delete
+from app.services.record_writer import write_predictions
+
+RECORDS = 50
+
+
+def _variable_limit() -> int:
+    # 与 aiosqlite 使用同一个 sqlite3 库；不同构建的上限从 999 到 250000 不等
+    connection = sqlite3.connect(":memory:")
+    try:
+        return connection.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+    finally:
+        connection.close()
+
+
+async def _seed() -> list[int]:
+    records = []
+    for i in range(RECORDS):
+        (settings.UPLOAD_DIR / f"bulk_{i}.jpg").write_bytes(b"\xff\xd8\xff")
+        records.append({
+            "image_path": f"bulk_{i}.jpg", "predicted_class": "Tomato___healthy", "confidence": 0.9,
+            "model_version": "test-model", "created_at": datetime(2024, 5, 1, 9, 0, 0),
+        })
+    async with async_session() as db:
+        ids = await write_predictions(db, records, [])
+        await db.commit()
+    return ids
+
+
+async def _counts() -> tuple[int, int]:
+    async with async_session() as db:
+        records = await db.scalar(select(func.count()).select_from(PredictionRecord))
+        stats = await db.scalar(select(func.coalesce(func.sum(PredictionDailyStat.count), 0)))
+    return records, stats
+
+
+@pytest.fixture
+def many_ids():
+    """已有记录的 ID 加上足以超出参数上限的不存在的 ID"""
+    return lambda ids: ids + list(range(max(ids) + 1, max(ids) + 1 + _variable_limit() + 1000))
+
+
+def test_single_statement_exceeds_variable_limit(run, many_ids):
+    async def scenario():
+        ids = many_ids(await _seed())
+        async with async_session() as db:
+            await db.execute(delete(PredictionRecord).where(PredictionRecord.id.in_(ids)))
+
+    # 不分块时一条 DELETE 的参数超出上限，说明下面的测试确实覆盖了分块
+    with pytest.raises(OperationalError, match="too many SQL variables"):
+        run(scenario())
+
+
+def test_chunked_delete_above_variable_limit(run, many_ids, monkeypatch):
+    # 块大小只影响事务数量，调大以缩短测试时间
+    monkeypatch.setattr(settings, "DELETE_CHUNK_SIZE", 20_000)
+
+    async def scenario():
+        ids = many_ids(await _seed())
+        result = await bulk_delete.delete_records(ids)
+        return result, await _counts()
+
+    (deleted, deleted_files), counts = run(scenario())
+    assert (deleted, deleted_files) == (RECORDS, RECORDS)
+    assert counts == (0, 0)
+    assert not any((settings.UPLOAD_DIR / f"bulk_{i}.jpg").exists() for i in range(RECORDS))
+
+
+def test_background_job_reports_progress(run, monkeypatch):
+    monkeypatch.setattr(settings, "DELETE_CHUNK_SIZE", 7)
+
+    async def scenario():
+        ids = await _seed()
+        job = await bulk_delete.start_delete_job(ids + ids[:5])
+        await asyncio.gather(*bulk_delete._job_tasks)
+        async with async_session() as db:
+            return await bulk_delete.get_job(db, job.id), await _counts()
+
+    job, counts = run(scenario())
+    assert (job.status, job.total, job.deleted, job.deleted_files) == ("succeeded", RECORDS, RECORDS, RECORDS)
+    assert job.finished_at is not None
+    assert counts == (0, 0)
+
+
+async def _add_job(job_id: str, status: str, age: timedelta, heartbeat: timedelta | None = None):
+    now = datetime.now()
+    async with async_session() as db:
+        db.add(BulkDeleteJob(
+            id=job_id, status=status, total=10, deleted=3, deleted_files=3, created_at=now - age,
+            heartbeat_at=now - heartbeat if heartbeat is not None else None,
+        ))
+        await db.commit()
+
+
+def test_stale_jobs_failed_at_startup(run):
+    stale = timedelta(seconds=settings.BULK_DELETE_STALE_SECONDS + 60)
+    fresh = timedelta(seconds=10)
+
+    async def scenario():
+        await _add_job("killed", "running", age=stale * 2, heartbeat=stale)
+        await _add_job("never-started", "pending", age=stale)
+        # 其他 worker 上仍在运行：任务创建得早，但心跳是新的
+        await _add_job("alive", "running", age=stale * 2, heartbeat=fresh)
+        await _add_job("done", "succeeded", age=stale * 2, heartbeat=stale)
+        async with async_session() as db:
+            marked = await bulk_delete.fail_stale_jobs(db)
+            await db.commit()
+            jobs = (await db.execute(select(BulkDeleteJob))).scalars().all()
+        return marked, {job.id: (job.status, job.error is not None, job.deleted) for job in jobs}
+
+    marked, jobs = run(scenario())
+    assert marked == 2
+    assert jobs == {
+        "killed": ("failed", True, 3),
+        "never-started": ("failed", True, 3),
+        "alive": ("running", False, 3),
+        "done": ("succeeded", False, 3),
+    }
+
+
+def test_get_job_fails_stale_job(run):
+    stale = timedelta(seconds=settings.BULK_DELETE_STALE_SECONDS + 60)
+
+    async def scenario():
+        # 进程被杀死后立即重启时启动检查还不会标记，之后查询进度时发现心跳超时
+        await _add_job("killed", "running", age=stale, heartbeat=stale)
+        await _add_job("alive", "running", age=stale, heartbeat=timedelta(seconds=10))
+        async with async_session() as db:
+            killed, alive = await bulk_delete.get_job(db, "killed"), await bulk_delete.get_job(db, "alive")
+        async with async_session() as db:
+            persisted = await db.get(BulkDeleteJob, "killed")
+        return killed.status, alive.status, persisted.status, persisted.finished_at is not None
+
+    assert run(scenario()) == ("failed", "running", "failed", True)
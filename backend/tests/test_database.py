@@ -0,0 +1,21 @@
+"""SQL 执行耗时指标：失败的语句不影响后续语句的计时"""
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app.core.database import DB_QUERY_SECONDS, engine
+
+
+def test_failed_statement_is_timed_without_leaking(run):
+    async def scenario():
+        before = DB_QUERY_SECONDS.count(route="background")
+        async with engine.connect() as conn:
+            with pytest.raises(OperationalError):
+                await conn.execute(text("SELECT * FROM missing_table"))
+            await conn.execute(text("SELECT 1"))
+            info = dict(conn.sync_connection.info)
+        return DB_QUERY_SECONDS.count(route="background") - before, info
+
+    observed, info = run(scenario())
+    assert observed == 2
+    assert "query_start" not in info
@@ -0,0 +1,106 @@
+"""相似病例检索：精确检索与暴力计算一致，IVF 索引在聚类明显的数据上返回相同结果，并覆盖索引之后追加的行"""
+import time
+
+import numpy as np
+import pytest
+import torch
+
+from app.core.config import settings
+from app.services.embedding_index import SIMILAR_SEARCH_SECONDS, EmbeddingIndex
+
+DIM = 32
+CLUSTERS = 40
+PER_CLUSTER = 50
+
+
+def _clustered(seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """CLUSTERS 个分得很开的聚类，ID 从 1 开始"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((CLUSTERS, DIM)).astype(np.float32)
+    vectors = np.repeat(centers, PER_CLUSTER, axis=0) + 0.05 * rng.standard_normal((CLUSTERS * PER_CLUSTER, DIM))
+    return np.arange(1, len(vectors) + 1, dtype=np.int64), vectors.astype(np.float32)
+
+
+def _brute_force(ids: np.ndarray, vectors: np.ndarray, query_id: int, limit: int) -> list[int]:
+    # 与索引相同：先归一化再转为 float16 存储
+    stored = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float16).astype(np.float32)
+    scores = stored @ stored[ids == query_id][0]
+    scores[ids == query_id] = -np.inf
+    return [int(ids[i]) for i in np.argsort(-scores, kind="stable")[:limit]]
+
+
+@pytest.fixture
+def space(tmp_path):
+    ids, vectors = _clustered()
+    space = EmbeddingIndex(tmp_path).space("test-model")
+    space.append(ids, vectors)
+    return space, ids, vectors
+
+
+def test_exact_search_matches_brute_force(space):
+    space, ids, vectors = space
+    exact = SIMILAR_SEARCH_SECONDS.count(mode="exact")
+
+    results = space.search([123], 10)
+
+    assert [record_id for record_id, _ in results] == _brute_force(ids, vectors, 123, 10)
+    assert 123 not in [record_id for record_id, _ in results]
+    assert [s for _, s in results] == sorted((s for _, s in results), reverse=True)
+    assert SIMILAR_SEARCH_SECONDS.count(mode="exact") == exact + 1
+
+
+def test_search_falls_back_to_next_query_id(space):
+    space, _, _ = space
+    # 第一个 ID 没有特征（例如命中预测缓存的记录），使用同一图片的其他记录
+    assert space.search([999_999, 7], 5) == space.search([7], 5)
+    assert space.search([999_999], 5) is None
+
+
+def test_ivf_search_matches_exact(space, monkeypatch):
+    space, ids, _ = space
+    queries = [1, 777, 1999]
+    expected = {q: [record_id for record_id, _ in space.search([q], 10)] for q in queries}
+
+    assert space.build_ivf() > 1
+    ivf = SIMILAR_SEARCH_SECONDS.count(mode="ivf")
+    for q in queries:
+        assert [record_id for record_id, _ in space.search([q], 10)] == expected[q]
+    assert SIMILAR_SEARCH_SECONDS.count(mode="ivf") == ivf + len(queries)
+
+    # 只探查一个聚类时扫描的行数远少于全部行
+    monkeypatch.setattr(settings, "EMBEDDING_IVF_NPROBE", 1)
+    query = space._snapshot()[1][0].astype(np.float32)
+    assert len(space._ivf_rows(space._load_ivf(), query, len(ids))) < len(ids) // 4
+
+
+def test_ivf_search_includes_rows_appended_after_build(space):
+    space, ids, vectors = space
+    space.build_ivf()
+    # 与第 1 行几乎相同的新行：不在任何聚类中，仍应排在第一位
+    new_id = int(ids[-1]) + 1
+    space.append(np.array([new_id]), vectors[:1] + 1e-3)
+
+    results = space.search([1], 5)
+    assert results[0][0] == new_id
+    assert not space.needs_ivf()
+
+
+def test_add_builds_ivf_in_background(run, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "EMBEDDING_INDEX_ENABLED", True)
+    monkeypatch.setattr(settings, "EMBEDDING_IVF_MIN_ROWS", 500)
+    index = EmbeddingIndex(tmp_path)
+    ids, vectors = _clustered(seed=1)
+    entries = [(int(i), "test-model", torch.from_numpy(v)) for i, v in zip(ids, vectors)]
+
+    # 分两次追加：第一次不足阈值，第二次达到阈值后在后台构建索引
+    run(index.add(entries[:400]))
+    space = index.space("test-model")
+    assert not space.ivf_path.exists()
+    run(index.add([*entries[400:], (0, "test-model", None), (0, None, torch.zeros(DIM))]))
+    deadline = time.monotonic() + 30
+    while space.building and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert space.ivf_path.exists()
+    assert space.count() == len(ids)
+    assert [record_id for record_id, _ in run(index.search("test-model", [5], 10))] == _brute_force(ids, vectors, 5, 10)
@@ -0,0 +1,119 @@
+"""历史记录游标分页：同一时间戳的记录按 id 排序不重复不遗漏，cursor 与 skip 互斥，满页给出 X-Next-Cursor；趋势统计的粒度校验"""
+from datetime import datetime, timedelta
+
+import httpx
+from fastapi import FastAPI
+
+from app.api import history_router
+from app.core.database import async_session
+from app.services.record_writer import write_predictions
+
+app = FastAPI()
+app.include_router(history_router)
+
+T0 = datetime(2024, 5, 1, 12, 0, 0)
+
+
+async def _seed(timestamps: list[datetime]) -> list[int]:
+    """按给定时间插入记录，返回历史接口应有的顺序：(created_at, id) 倒序"""
+    records = [
+        {"image_path": f"leaf_{i}.jpg", "predicted_class": "Tomato___healthy", "confidence": 0.9,
+         "model_version": "test-model", "created_at": created_at}
+        for i, created_at in enumerate(timestamps)
+    ]
+    async with async_session() as db:
+        ids = await write_predictions(db, records, [])
+        await db.commit()
+    return [record_id for _, record_id in sorted(zip(timestamps, ids), reverse=True)]
+
+
+async def _get(params: dict, path: str = "/api/history") -> httpx.Response:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.get(path, params=params)
+
+
+async def _walk(limit: int) -> tuple[list[int], int]:
+    """从首页开始跟随 X-Next-Cursor 翻到底，返回所有 id 和请求次数"""
+    ids, pages, cursor = [], 0, None
+    while True:
+        response = await _get({"limit": limit, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        pages += 1
+        ids.extend(item["id"] for item in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return ids, pages
+
+
+def test_cursor_pages_through_ties(run):
+    async def scenario():
+        # 中间 4 条时间相同，页边界落在它们之间
+        expected = await _seed([T0, T0 + timedelta(seconds=1), *[T0 + timedelta(seconds=2)] * 4, T0 + timedelta(seconds=3)])
+        return expected, await _walk(limit=3)
+
+    expected, (ids, pages) = run(scenario())
+    assert ids == expected
+    assert pages == 3
+
+
+def test_full_last_page_followed_by_empty_page(run):
+    async def scenario():
+        expected = await _seed([T0] * 4)
+        return expected, await _walk(limit=2)
+
+    expected, (ids, pages) = run(scenario())
+    # 最后一页恰好满页时仍给出游标，下一页为空且不再带游标
+    assert ids == expected
+    assert pages == 3
+
+
+def test_next_cursor_header(run):
+    async def scenario():
+        await _seed([T0] * 5)
+        full = await _get({"limit": 2})
+        offset = await _get({"limit": 2, "skip": 1})
+        partial = await _get({"limit": 10})
+        resumed = await _get({"limit": 10, "cursor": offset.headers["X-Next-Cursor"]})
+        return full, offset, partial, resumed
+
+    full, offset, partial, resumed = run(scenario())
+    assert "X-Next-Cursor" in full.headers
+    # 偏移分页满页时同样给出游标，可以从这里切换为游标分页
+    assert "X-Next-Cursor" in offset.headers
+    assert "X-Next-Cursor" not in partial.headers
+    assert [item["id"] for item in resumed.json()] == [item["id"] for item in partial.json()][3:]
+    item = partial.json()[0]
+    assert (item["thumbnail_url"], item["preview_url"]) == (
+        f"/api/images/thumb/{item['image_path']}", f"/api/images/preview/{item['image_path']}"
+    )
+
+
+def test_cursor_with_skip_rejected(run):
+    async def scenario():
+        await _seed([T0, T0])
+        cursor = (await _get({"limit": 1})).headers["X-Next-Cursor"]
+        return await _get({"cursor": cursor, "skip": 1}), await _get({"cursor": "not-a-cursor"})
+
+    with_skip, invalid = run(scenario())
+    assert with_skip.status_code == 400
+    assert invalid.status_code == 400
+
+
+def test_trend_granularity_validated(run):
+    async def scenario():
+        await _seed([T0, T0 + timedelta(days=1), T0 + timedelta(days=8)])
+        dates = {"start_date": "2024-04-01", "end_date": "2024-05-31"}
+        responses = {
+            granularity: await _get({**dates, "granularity": granularity}, "/api/stats/trend")
+            for granularity in ("day", "week", "month", "year", "")
+        }
+        return {granularity: (r.status_code, r.json()) for granularity, r in responses.items()}
+
+    responses = run(scenario())
+    assert [item["total"] for item in responses["day"][1]["data"]] == [1, 1, 1]
+    assert [item["total"] for item in responses["week"][1]["data"]] == [2, 1]
+    assert responses["month"][1]["data"] == [{"date": "2024-05-01", "total": 3, "healthy": 3, "diseased": 0}]
+    # 未知粒度不再按天汇总后缓存，直接返回 422
+    assert responses["year"][0] == 422
+    assert responses[""][0] == 422
@@ -0,0 +1,98 @@
+"""异步识别任务 worker：提交失败后的重试、租约丢失时的写入"""
+import pytest
+from PIL import Image
+from sqlalchemy import func, select, update
+
+from app.core.config import settings
+from app.core.database import async_session
+from app.models.prediction import PredictionCacheEntry, PredictionJob, PredictionRecord
+from app.services import job_worker as job_worker_module
+from app.services.ai_service import AIService, PredictionResult, ai_service
+from app.services.job_queue import job_queue
+from app.services.job_worker import JobWorker
+from app.services.prediction_cache import prediction_cache
+
+MODEL_VERSION = "test-model"
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    """不加载模型：推理固定返回同一个结果"""
+    async def predict_stream(images, chunk_size):
+        yield [
+            PredictionResult("Tomato___healthy", 0.9, [{"class": "Tomato___healthy", "confidence": 0.9}], MODEL_VERSION)
+            for _ in images
+        ]
+
+    monkeypatch.setattr(AIService, "model_version", property(lambda self: MODEL_VERSION))
+    monkeypatch.setattr(ai_service, "predict_stream", predict_stream)
+    monkeypatch.setattr(job_queue, "retry_backoff", 0.0)
+    worker = JobWorker(batch_size=8, poll_interval_ms=100)
+    worker.worker_id = "worker-1"
+    return worker
+
+
+async def _enqueue(name: str) -> PredictionJob:
+    Image.new("RGB", (32, 32), "green").save(settings.UPLOAD_DIR / name)
+    async with async_session() as db:
+        job = await job_queue.enqueue(db, name, "a" * 64)
+        await db.commit()
+    return job
+
+
+def test_retry_after_failed_commit_keeps_upload(worker, monkeypatch, run):
+    real_write = job_worker_module.write_predictions
+    calls = []
+
+    async def failing_once(db, records, cache_rows):
+        ids = await real_write(db, records, cache_rows)
+        calls.append(len(records))
+        if len(calls) == 1:
+            raise RuntimeError("database is locked")
+        return ids
+
+    monkeypatch.setattr(job_worker_module, "write_predictions", failing_once)
+
+    async def scenario():
+        job = await _enqueue("retry.jpg")
+        jobs = await job_queue.claim(worker.worker_id, 8)
+        with pytest.raises(RuntimeError):
+            await worker.process(jobs)
+        # 提交失败时缓存不能指向尚未写入记录的图片
+        assert prediction_cache._lru_get(job.content_hash) is None
+        await job_queue.release(worker.worker_id, jobs, "database is locked")
+
+        await worker.process(await job_queue.claim(worker.worker_id, 8))
+        async with async_session() as db:
+            stored = await db.get(PredictionJob, job.id)
+            records = (await db.execute(select(PredictionRecord))).scalars().all()
+        return job, stored, records
+
+    job, stored, records = run(scenario())
+    assert (settings.UPLOAD_DIR / job.image_path).exists()
+    assert stored.status == "succeeded" and stored.attempts == 2
+    assert [record.image_path for record in records] == [job.image_path]
+    assert stored.record_id == records[0].id
+    assert prediction_cache._lru_get(job.content_hash).image_path == job.image_path
+
+
+def test_lost_lease_writes_nothing(worker, run):
+    async def scenario():
+        job = await _enqueue("stale.jpg")
+        jobs = await job_queue.claim(worker.worker_id, 8)
+        # 租约过期后被其他 worker 重新领取
+        async with async_session() as db:
+            await db.execute(update(PredictionJob).values(worker_id="worker-2"))
+            await db.commit()
+        await worker.process(jobs)
+        async with async_session() as db:
+            records = (await db.execute(select(func.count()).select_from(PredictionRecord))).scalar_one()
+            cache_rows = (await db.execute(select(func.count()).select_from(PredictionCacheEntry))).scalar_one()
+            stored = await db.get(PredictionJob, job.id)
+        return job, records, cache_rows, stored
+
+    job, records, cache_rows, stored = run(scenario())
+    assert (records, cache_rows) == (0, 0)
+    assert stored.status == "running" and stored.worker_id == "worker-2"
+    assert prediction_cache._lru_get(job.content_hash) is None
+    assert (settings.UPLOAD_DIR / job.image_path).exists()
@@ -0,0 +1,53 @@
+"""模型注册表清单：多进程并发写入不出错、不覆盖其他进程的修改"""
+import json
+import multiprocessing
+from pathlib import Path
+
+from app.services.model_registry import ModelRegistry, ModelSpec
+
+
+def _spec(version: str) -> ModelSpec:
+    return ModelSpec(version=version, artifact=f"{version}.pt", format="torchscript")
+
+
+def _record_latencies(model_dir: str, version: str, rounds: int):
+    registry = ModelRegistry(Path(model_dir), "registry.json")
+    registry.reload(force=True)
+    for i in range(rounds):
+        registry.record_latency(version, float(i))
+
+
+def test_concurrent_latency_writes(tmp_path):
+    registry = ModelRegistry(tmp_path, "registry.json")
+    for version in ("a", "b", "c", "d"):
+        registry.register(_spec(version))
+
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_record_latencies, args=(str(tmp_path), v, 50)) for v in "abcd"]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert [process.exitcode for process in processes] == [0, 0, 0, 0]
+    manifest = json.loads((tmp_path / "registry.json").read_text())
+    # 每个进程的最后一次写入都保留下来，没有互相覆盖，也没有残留的临时文件
+    assert {item["version"]: item["latency_ms"] for item in manifest["models"]} == dict.fromkeys("abcd", 49.0)
+    assert list(tmp_path.glob("*.tmp")) == []
+
+
+def test_stale_process_does_not_undo_activation(tmp_path):
+    first = ModelRegistry(tmp_path, "registry.json")
+    first.register(_spec("a"))
+    first.register(_spec("b"))
+    stale = ModelRegistry(tmp_path, "registry.json")
+    stale.reload(force=True)
+
+    first.set_active("b")
+    stale.record_latency("a", 12.5)
+
+    fresh = ModelRegistry(tmp_path, "registry.json")
+    fresh.reload(force=True)
+    assert fresh.active_version == "b"
+    assert fresh.get("a").latency_ms == 12.5
+    assert stale.active_version == "b"
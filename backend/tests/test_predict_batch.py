@@ -0,0 +1,95 @@
+"""批量识别的 NDJSON 流：中途断开或出错时已输出的结果照样写入，重复图片复用缓存"""
+import io
+import json
+
+import pytest
+from fastapi import UploadFile
+from sqlalchemy import func, select
+from starlette.datastructures import Headers
+
+from app.api import predict as predict_module
+from app.core.config import settings
+from app.core.database import async_session
+from app.models.prediction import PredictionCacheEntry, PredictionRecord
+from app.services.ai_service import AIService, PredictionResult, ai_service
+
+MODEL_VERSION = "test-model"
+PNG = b"\x89PNG\r\n\x1a\n"
+
+
+def _result() -> PredictionResult:
+    return PredictionResult("Tomato___healthy", 0.9, [{"class": "Tomato___healthy", "confidence": 0.9}], MODEL_VERSION)
+
+
+@pytest.fixture
+def model(monkeypatch):
+    """不加载模型：每块一张图片；fail_after 块之后推理出错"""
+    state = {"fail_after": None}
+
+    async def predict_stream(images, chunk_size):
+        for index, _ in enumerate(images):
+            if state["fail_after"] is not None and index >= state["fail_after"]:
+                raise RuntimeError("inference failed")
+            yield [_result()]
+
+    monkeypatch.setattr(AIService, "model_version", property(lambda self: MODEL_VERSION))
+    monkeypatch.setattr(ai_service, "_status", "ready")
+    monkeypatch.setattr(ai_service, "predict_stream", predict_stream)
+    return state
+
+
+def _files(count: int) -> list[UploadFile]:
+    return [
+        UploadFile(io.BytesIO(PNG + bytes([i]) * 16), filename=f"{i}.png", headers=Headers({"content-type": "image/png"}))
+        for i in range(count)
+    ]
+
+
+async def _counts() -> tuple[int, int]:
+    async with async_session() as db:
+        records = await db.scalar(select(func.count()).select_from(PredictionRecord))
+        cache = await db.scalar(select(func.count()).select_from(PredictionCacheEntry))
+        return records, cache
+
+
+def test_client_disconnect_keeps_streamed_records(model, run):
+    async def scenario():
+        response = await predict_module.predict_batch(_files(3))
+        first = json.loads(await response.body_iterator.__anext__())
+        # 客户端读到第一行后断开
+        await response.body_iterator.aclose()
+        return first, await _counts()
+
+    first, counts = run(scenario())
+    assert (settings.UPLOAD_DIR / first["image_url"].removeprefix("/uploads/")).exists()
+    assert counts == (1, 1)
+
+
+def test_failure_in_later_chunk_keeps_earlier_records(model, run):
+    model["fail_after"] = 2
+
+    async def scenario():
+        response = await predict_module.predict_batch(_files(3))
+        lines = []
+        with pytest.raises(RuntimeError):
+            async for line in response.body_iterator:
+                lines.append(json.loads(line))
+        return lines, await _counts()
+
+    lines, counts = run(scenario())
+    assert len(lines) == 2
+    assert counts == (2, 2)
+
+
+def test_repeated_batch_reuses_cached_images(model, run):
+    async def scenario():
+        urls = []
+        for _ in range(2):
+            response = await predict_module.predict_batch(_files(2))
+            urls.append(sorted([json.loads(line)["image_url"] async for line in response.body_iterator]))
+        return urls, await _counts()
+
+    (first, second), counts = run(scenario())
+    assert first == second
+    assert counts == (4, 2)
+    assert all((settings.UPLOAD_DIR / url.removeprefix("/uploads/")).exists() for url in first)
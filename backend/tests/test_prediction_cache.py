@@ -0,0 +1,69 @@
+"""预测缓存：查询其他模型版本不删除持久化条目，旧版本条目只在本进程完成切换后删除一次"""
+from sqlalchemy import func, select
+
+from app.core.config import settings
+from app.core.database import async_session
+from app.models.prediction import PredictionCacheEntry
+from app.services.prediction_cache import CachedPrediction, prediction_cache
+
+
+def _entry(image_path: str) -> CachedPrediction:
+    return CachedPrediction(
+        predicted_class="Tomato___healthy", confidence=0.9, top_predictions=[], image_path=image_path,
+    )
+
+
+async def _seed(versions: list[str]):
+    (settings.UPLOAD_DIR / "leaf.jpg").write_bytes(b"\xff\xd8\xff")
+    async with async_session() as db:
+        await prediction_cache.persist(db, [prediction_cache.row("a" * 64, v, _entry("leaf.jpg")) for v in versions])
+        await db.commit()
+
+
+async def _versions() -> list[str]:
+    async with async_session() as db:
+        return sorted((await db.execute(select(PredictionCacheEntry.model_version))).scalars().all())
+
+
+async def _get(model_version: str) -> CachedPrediction | None:
+    async with async_session() as db:
+        entry = await prediction_cache.get(db, "a" * 64, model_version)
+        await db.commit()
+        return entry
+
+
+def test_lookup_with_other_version_keeps_rows(run):
+    async def scenario():
+        await _seed(["v1", "v2"])
+        # 两个进程（或同一进程先后）以不同版本查询，对方版本的条目都保留
+        first, second, again = await _get("v1"), await _get("v2"), await _get("v1")
+        return first is not None, second is not None, again is not None, await _versions()
+
+    assert run(scenario()) == (True, True, True, ["v1", "v2"])
+
+
+def test_swap_retires_other_versions_once(run):
+    async def scenario():
+        await _seed(["v1", "v2"])
+        await _get("v1")
+        prediction_cache.retire_other_versions("v2")
+        assert prediction_cache.stats()["entries"] == 0
+        hit = await _get("v2")
+        after_swap = await _versions()
+        # 之后其他进程重新写入的旧版本条目不会再被删除
+        await _seed(["v1"])
+        await _get("v2")
+        return hit is not None, after_swap, await _versions()
+
+    assert run(scenario()) == (True, ["v2"], ["v1", "v2"])
+
+
+def test_put_ignores_other_model_version(run):
+    async def scenario():
+        await _get("v2")
+        prediction_cache.remember([prediction_cache.row("b" * 64, "v1", _entry("old.jpg"))])
+        stale = prediction_cache.stats()["entries"]
+        prediction_cache.remember([prediction_cache.row("b" * 64, "v2", _entry("new.jpg"))])
+        return stale, prediction_cache.stats()["entries"]
+
+    assert run(scenario()) == (0, 1)
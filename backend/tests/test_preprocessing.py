@@ -0,0 +1,73 @@
+"""图像解码与预处理：与原先的 transforms.Compose 数值一致（单张、整批、channels_last）"""
+import io
+from pathlib import Path
+
+import pytest
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from app.ml.preprocessing import normalize, preprocess_batch, resize_size_for, to_uint8_tensor, tta_views
+from app.services.ai_service import AIService
+
+TOLERANCE = 1e-5
+REPO_ROOT = Path(__file__).resolve().parents[2]
+
+# 共享预处理模块之前的参考实现
+REFERENCE = transforms.Compose([
+    transforms.Resize(256),
+    transforms.CenterCrop(224),
+    transforms.ToTensor(),
+    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+])
+
+
+def _images() -> dict[str, Image.Image]:
+    """仓库中的图片，加上几种合成尺寸（横向、纵向、细长、恰好等于裁剪尺寸）和灰度图"""
+    images = {}
+    paths = [REPO_ROOT / "test_photo.jpeg", REPO_ROOT / "dummy_test.jpg", *sorted((REPO_ROOT / "backend/uploads").glob("*"))]
+    for path in paths:
+        if path.exists() and path.suffix.lower() in {".jpg", ".jpeg", ".png", ".webp"}:
+            images[path.name] = Image.open(path).convert("RGB")
+    generator = torch.Generator().manual_seed(0)
+    for width, height in [(640, 480), (480, 640), (300, 1200), (224, 224), (256, 256)]:
+        pixels = torch.randint(0, 256, (height, width, 3), dtype=torch.uint8, generator=generator)
+        images[f"random_{width}x{height}"] = Image.fromarray(pixels.numpy())
+    images["grayscale"] = Image.new("L", (500, 400), color=128)
+    return images
+
+
+IMAGES = _images()
+
+
+@pytest.mark.parametrize("name", list(IMAGES))
+def test_single_image_matches_reference(name):
+    image = IMAGES[name]
+    expected = REFERENCE(image.convert("RGB"))
+    assert (normalize(to_uint8_tensor(image))[0] - expected).abs().max().item() <= TOLERANCE
+    # TTA 的第一个视图与常规预处理相同
+    assert torch.equal(tta_views(image, "flip")[0], to_uint8_tensor(image))
+
+
+@pytest.mark.parametrize("channels_last", [False, True])
+def test_batch_matches_reference(channels_last):
+    batch = list(IMAGES.values())
+    expected = torch.stack([REFERENCE(image.convert("RGB")) for image in batch])
+    actual = preprocess_batch(batch, channels_last=channels_last)
+    assert actual.is_contiguous(memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+    assert (actual - expected).abs().max().item() <= TOLERANCE
+
+
+def _jpeg(width: int, height: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (30, 140, 60)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("input_size", [224, 256, 384])
+def test_jpeg_draft_never_below_resize_size(input_size):
+    # 2400 像素的短边可按 1/8 缩小到 300：input_size=224（Resize 256）时应缩小，更大的模型不能缩到 Resize 边长以下
+    resize_size = resize_size_for(input_size)
+    image = AIService._load_image(_jpeg(3200, 2400), resize_size)
+    assert min(image.size) >= resize_size
+    assert min(image.size) < 2400
@@ -0,0 +1,70 @@
+"""write-behind 缓冲区：违反约束的记录单独丢弃，其他失败按次数上限重试"""
+from datetime import datetime
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+
+from app.core.database import async_session
+from app.models.prediction import PredictionRecord
+from app.services import record_writer as record_writer_module
+from app.services.record_writer import WRITE_BEHIND_DROPPED, RecordWriter
+
+
+def _record(confidence: float | None) -> dict:
+    return {
+        "image_path": "leaf.jpg",
+        "predicted_class": "Tomato___healthy",
+        "confidence": confidence,
+        "model_version": "test-model",
+        "created_at": datetime.now(),
+    }
+
+
+async def _count_records() -> int:
+    async with async_session() as db:
+        return await db.scalar(select(func.count()).select_from(PredictionRecord))
+
+
+def _writer(max_attempts: int = 3) -> RecordWriter:
+    # 不按时间自动写入，只在测试中显式调用 flush()
+    writer = RecordWriter(True, 1000, 3_600_000, max_attempts)
+    writer.start()
+    return writer
+
+
+def test_bad_row_dropped_others_written(run):
+    async def scenario():
+        writer = _writer()
+        dropped = WRITE_BEHIND_DROPPED.value(reason="integrity")
+        for confidence in (0.9, None, 0.8):
+            await writer.save(None, _record(confidence))
+        written = await writer.flush()
+        pending = writer.pending
+        await writer.stop()
+        return written, pending, WRITE_BEHIND_DROPPED.value(reason="integrity") - dropped, await _count_records()
+
+    # confidence 为 NOT NULL 列：中间一条违反约束，只丢弃这一条
+    assert run(scenario()) == (2, 0, 1, 2)
+
+
+def test_failing_batch_dropped_after_max_attempts(run, monkeypatch):
+    async def failing_write(db, records, cache_rows):
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    async def scenario():
+        writer = _writer(max_attempts=3)
+        dropped = WRITE_BEHIND_DROPPED.value(reason="attempts")
+        await writer.save(None, _record(0.9))
+        monkeypatch.setattr(record_writer_module, "write_predictions", failing_write)
+        pending = []
+        for _ in range(3):
+            await writer.flush()
+            pending.append(writer.pending)
+        # 之后进入缓冲区的记录不继承前一批的失败次数
+        monkeypatch.undo()
+        await writer.save(None, _record(0.8))
+        written = await writer.flush()
+        await writer.stop()
+        return pending, WRITE_BEHIND_DROPPED.value(reason="attempts") - dropped, written, await _count_records()
+
+    assert run(scenario()) == ([1, 1, 0], 1, 1, 1)
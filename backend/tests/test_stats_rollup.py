@@ -0,0 +1,119 @@
+"""统计汇总表：插入、单条删除、批量删除之后与按识别记录重新计数的结果一致"""
+from datetime import datetime, timedelta
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import func, select
+
+from app.api import history_router
+from app.core.database import async_session
+from app.models.prediction import PredictionDailyStat, PredictionRecord
+from app.services import bulk_delete, stats_rollup
+from app.services.record_writer import write_predictions
+
+app = FastAPI()
+app.include_router(history_router)
+
+DAY1 = datetime(2024, 5, 1, 9, 0, 0)
+DAY2 = DAY1 + timedelta(days=1)
+CLASSES = ["Tomato___healthy", "Tomato___Late_blight", "Potato___Early_blight"]
+
+
+async def _insert(rows: list[tuple[datetime, str]]) -> list[int]:
+    records = [
+        {"image_path": f"leaf_{i}.jpg", "predicted_class": cls, "confidence": 0.9,
+         "model_version": "test-model", "created_at": created_at}
+        for i, (created_at, cls) in enumerate(rows)
+    ]
+    async with async_session() as db:
+        ids = await write_predictions(db, records, [])
+        await db.commit()
+    return ids
+
+
+async def _rollup() -> dict:
+    async with async_session() as db:
+        rows = (await db.execute(
+            select(PredictionDailyStat.day, PredictionDailyStat.predicted_class, PredictionDailyStat.count)
+        )).all()
+    return {(day, cls): count for day, cls, count in rows}
+
+
+async def _recount() -> dict:
+    day = func.date(PredictionRecord.created_at)
+    async with async_session() as db:
+        rows = (await db.execute(
+            select(day, PredictionRecord.predicted_class, func.count()).group_by(day, PredictionRecord.predicted_class)
+        )).all()
+    return {(datetime.fromisoformat(d).date(), cls): count for d, cls, count in rows}
+
+
+async def _summary() -> dict:
+    async with async_session() as db:
+        return await stats_rollup.summary(db)
+
+
+def _rows() -> list[tuple[datetime, str]]:
+    # 两天 × 三个类别，各组数量不同；Potato 只在第一天出现一次
+    return [
+        (DAY1, CLASSES[0]), (DAY1, CLASSES[0]), (DAY1, CLASSES[1]), (DAY1, CLASSES[2]),
+        (DAY2, CLASSES[0]), (DAY2, CLASSES[1]), (DAY2, CLASSES[1]),
+    ]
+
+
+def test_rollup_after_insert(run):
+    async def scenario():
+        await _insert(_rows())
+        return await _rollup(), await _recount(), await _summary()
+
+    rollup, recount, summary = run(scenario())
+    assert rollup == recount
+    assert rollup[(DAY1.date(), CLASSES[0])] == 2
+    assert (summary["total"], summary["healthy_count"], summary["diseased_count"]) == (7, 3, 4)
+
+
+def test_rollup_after_single_delete(run):
+    async def scenario():
+        ids = await _insert(_rows())
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            # 删除 DAY1 唯一的 Potato 记录和 DAY2 的一条 Late_blight
+            for record_id in (ids[3], ids[5]):
+                assert (await client.delete(f"/api/history/{record_id}")).status_code == 200
+        return await _rollup(), await _recount(), await _summary()
+
+    rollup, recount, summary = run(scenario())
+    assert rollup == recount
+    # 计数减到 0 的 (日期, 类别) 行被删除，不在汇总中留下 0
+    assert (DAY1.date(), CLASSES[2]) not in rollup
+    assert summary["total"] == 5
+    assert "Potato" not in [item["crop"] for item in summary["by_crop"]]
+
+
+def test_rollup_after_bulk_delete(run, monkeypatch):
+    monkeypatch.setattr(bulk_delete.settings, "DELETE_CHUNK_SIZE", 2)
+
+    async def scenario():
+        ids = await _insert(_rows())
+        # 跨越多个块，包含重复 ID 和不存在的 ID
+        deleted, _ = await bulk_delete.delete_records([ids[0], ids[2], ids[2], ids[4], ids[6], 10_000])
+        return deleted, await _rollup(), await _recount(), await _summary()
+
+    deleted, rollup, recount, summary = run(scenario())
+    assert deleted == 4
+    assert rollup == recount
+    assert summary["total"] == 3
+
+
+def test_rebuild_matches_incremental(run):
+    async def scenario():
+        ids = await _insert(_rows())
+        await bulk_delete.delete_records(ids[:2])
+        incremental = await _rollup()
+        async with async_session() as db:
+            await stats_rollup.rebuild(db)
+            await db.commit()
+        return incremental, await _rollup()
+
+    incremental, rebuilt = run(scenario())
+    assert incremental == rebuilt
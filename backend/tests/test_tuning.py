@@ -0,0 +1,72 @@
+"""启动调优：量化引擎只在加载时比较一次，worker 的 tune() 不重新加载模型"""
+import pytest
+import torch
+
+from app.core.config import settings
+from app.ml import tuning
+from app.services.ai_service import AIService, LoadedModel, ai_service
+from app.services.model_registry import ModelSpec
+
+SPEC = ModelSpec(version="student", artifact="student.pt", format="torchscript", architecture="mobilenet_v3_large_quantized")
+
+
+class FakeBackend:
+    name = "torch"
+
+
+@pytest.fixture
+def quantized(monkeypatch):
+    engines = tuning.available_engines()
+    if len(engines) < 2:
+        pytest.skip("需要至少两个可用的量化引擎")
+    original_engine = torch.backends.quantized.engine
+    original_threads = torch.get_num_threads()
+    built = []
+
+    def build_model(self, spec, backend=None):
+        built.append(torch.backends.quantized.engine)
+        return LoadedModel(version=spec.version, model=FakeBackend(), class_mapping={}, architecture=spec.architecture)
+
+    monkeypatch.setattr(settings, "AUTOTUNE_ENABLED", True)
+    monkeypatch.setattr(settings, "QUANTIZED_ENGINE", "")
+    monkeypatch.setattr(settings, "AUTOTUNE_ITERATIONS", 1)
+    monkeypatch.setattr(AIService, "build_model", build_model)
+    monkeypatch.setattr(AIService, "_load_model", lambda self: build_model(self, SPEC))
+    monkeypatch.setattr(AIService, "_model_spec", lambda self, handle: SPEC)
+    monkeypatch.setattr(AIService, "_probabilities", lambda self, batch, handle: None)
+    monkeypatch.setattr(ai_service, "_status", "pending")
+    monkeypatch.setattr(ai_service, "_active", None)
+    monkeypatch.setattr(ai_service, "_engine_candidates", [])
+    yield engines, built
+    torch.backends.quantized.engine = original_engine
+    torch.set_num_threads(original_threads)
+
+
+def test_engines_compared_once_at_load(quantized):
+    engines, built = quantized
+    ai_service.load()
+    # 初始加载一次，其余每个引擎各加载一次
+    assert sorted(built[1:]) == sorted(set(engines) - {built[0]})
+    candidates = ai_service._engine_candidates
+    assert {item["engine"] for item in candidates} == set(engines)
+    assert all(item["threads"] == 1 for item in candidates)
+    assert torch.backends.quantized.engine == candidates[0]["engine"]
+
+    # 模拟 fork 后的 worker：已加载，tune() 只比较线程数，保留加载时选定的模型和引擎
+    selected, count = ai_service._active, len(built)
+    ai_service.load()
+    ai_service.tune()
+    assert len(built) == count
+    assert ai_service._active is selected
+    result = ai_service._tuning
+    assert result.quantized_engine == candidates[0]["engine"]
+    assert {item["engine"] for item in result.candidates} == {candidates[0]["engine"]}
+    assert result.engine_candidates == candidates
+
+
+def test_fixed_engine_skips_comparison(quantized, monkeypatch):
+    engines, built = quantized
+    monkeypatch.setattr(settings, "QUANTIZED_ENGINE", engines[-1])
+    ai_service.load()
+    assert built == [engines[-1]]
+    assert ai_service._engine_candidates == []
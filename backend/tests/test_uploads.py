@@ -0,0 +1,80 @@
+"""单图上传的流式解析：大小上限、类型检查、跨块的文件头"""
+import hashlib
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+
+from app.core.config import settings
+from app.services.uploads import UnsupportedImageError, UploadTooLargeError, stream_upload
+
+JPEG = b"\xff\xd8\xff\xe0" + b"\x00" * 2000
+BOUNDARY = b"testboundary"
+
+
+def _multipart(content: bytes, content_type: str = "image/jpeg", name: str = "file") -> bytes:
+    return (
+        b"--" + BOUNDARY + b"\r\n"
+        + f'Content-Disposition: form-data; name="{name}"; filename="leaf.jpg"\r\n'.encode()
+        + f"Content-Type: {content_type}\r\n\r\n".encode()
+        + content + b"\r\n--" + BOUNDARY + b"--\r\n"
+    )
+
+
+app = FastAPI()
+
+
+@app.post("/upload")
+async def upload(request: Request):
+    try:
+        stored = await stream_upload(request, settings.UPLOAD_DIR, 4096, {"image/jpeg"})
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    content = stored.path.read_bytes()
+    await stored.discard()
+    return {"size": stored.size, "sha256": stored.sha256, "suffix": stored.suffix, "content_ok": content == JPEG}
+
+
+def _post(run, body: bytes, chunk: int | None = None) -> httpx.Response:
+    async def send():
+        async def chunks():
+            for start in range(0, len(body), chunk):
+                yield body[start:start + chunk]
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(
+                "/upload",
+                content=chunks() if chunk else body,
+                headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY.decode()}"},
+            )
+
+    return run(send())
+
+
+def _leftovers() -> list:
+    return [path for path in settings.UPLOAD_DIR.iterdir() if path.name.endswith(".part")]
+
+
+@pytest.mark.parametrize("chunk", [None, 3])
+def test_image_written_once_with_hash(run, chunk):
+    # chunk=3 时文件头跨越多块数据
+    response = _post(run, _multipart(JPEG), chunk)
+    assert response.status_code == 200
+    assert response.json() == {
+        "size": len(JPEG), "sha256": hashlib.sha256(JPEG).hexdigest(), "suffix": ".jpg", "content_ok": True,
+    }
+    assert _leftovers() == []
+
+
+@pytest.mark.parametrize("body, status", [
+    (_multipart(JPEG + b"\x00" * 4096), 413),
+    (_multipart(JPEG, content_type="text/plain"), 400),
+    (_multipart(b"GIF89a" + b"\x00" * 100), 400),
+    (_multipart(JPEG, name="other"), 400),
+])
+def test_rejected_upload_leaves_no_temp_file(run, body, status):
+    assert _post(run, body, chunk=512).status_code == status
+    assert _leftovers() == []
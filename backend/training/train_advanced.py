@@ -4,7 +4,7 @@ import sys
 import torch
 import torch.optim as optim
 from torch.utils.data import DataLoader
-from torchvision import datasets, transforms
+from torchvision import datasets
 import time
 import copy
 import matplotlib.pyplot as plt
@@ -13,6 +13,11 @@ import zipfile
 import shutil
 from tqdm import tqdm
 
+# Shared preprocessing lives in the backend app package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.ml.preprocessing import normalize, to_uint8_tensor
+from app.ml.tuning import default_engine, set_engine
+
 # Import our modules
 from models import get_student_model, get_teacher_model
 from distillation import KnowledgeDistillationLoss
@@ -116,7 +121,7 @@ def train_one_epoch(model, teacher, loader, criterion, optimizer, device):
     
     pbar = tqdm(loader, desc="Training", leave=False)
     for images, labels in pbar:
-        images, labels = images.to(device), labels.to(device)
+        images, labels = normalize(images.to(device, non_blocking=True)), labels.to(device)
         
         optimizer.zero_grad()
         
@@ -148,7 +153,7 @@ def validate(model, loader, device):
     total = 0
     with torch.no_grad():
         for images, labels in tqdm(loader, desc="Validating", leave=False):
-            images, labels = images.to(device), labels.to(device)
+            images, labels = normalize(images.to(device, non_blocking=True)), labels.to(device)
             outputs = model(images)
             _, predicted = outputs.max(1)
             total += labels.size(0)
@@ -173,10 +178,9 @@ def main():
         print("[WARN] GPU not found! Training will be slow.")
     print(f"Using device: {device}")
     
-    # Set quantization engine dynamically
-    # [FIX] Force qnnpack on Windows/x86 simply because fbgemm can be unstable for some PyTorch versions on specific CPUs
-    # or if there's a mismatch. qnnpack is safer.
-    torch.backends.quantized.engine = 'fbgemm'
+    # Set quantization engine dynamically: the first supported engine in the platform preference order
+    # (the server re-packs the weights for whichever engine its startup tuner picks)
+    set_engine(default_engine())
     print(f"[INFO] Quantization engine: {torch.backends.quantized.engine}")
     
     # 1. Data Setup
@@ -184,14 +188,8 @@ def main():
     # Handle download automatically
     dataset_path = download_and_extract_dataset(args.data_dir)
     
-    transform = transforms.Compose([
-        transforms.Resize(256),
-        transforms.CenterCrop(224),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-    ])
-    
-    full_dataset = datasets.ImageFolder(dataset_path, transform=transform)
+    # Workers only resize/crop to uint8; normalization runs per batch on the device
+    full_dataset = datasets.ImageFolder(dataset_path, transform=to_uint8_tensor)
     num_classes = len(full_dataset.classes)
     print(f"[INFO] Found {num_classes} classes.")
     
@@ -319,7 +317,7 @@ def main():
         # Loop below moves commands to device
         pbar = tqdm(train_loader, desc=f"QAT Epoch {epoch+1}", leave=True)
         for images, labels in pbar:
-            images, labels = images.to(device), labels.to(device) # Move to GPU
+            images, labels = normalize(images.to(device, non_blocking=True)), labels.to(device) # Move to GPU
             
             optimizer.zero_grad()
             outputs = student(images)
@@ -0,0 +1,130 @@
+"""
+异步识别任务 worker 进程
+
+从 prediction_jobs 表领取 POST /api/predict?async=true 创建的任务，按批推理并写回结果。
+与 API 服务共用同一个数据库和上传目录；可以启动任意多个进程，任务通过租约互斥。
+
+与 serve.py 相同，多进程模式下父进程先加载模型再 fork，子进程共享权重内存页。
+
+用法:
+    python worker.py                          # 单个 worker 进程
+    python worker.py --processes 4            # 预加载模型后 fork 出 4 个 worker
+    python worker.py --metrics-port 9100      # 在 9100（多进程时依次 9101…）端口输出 Prometheus 指标
+"""
+import argparse
+import asyncio
+import gc
+import os
+import signal
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.core.config import settings
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="CropVision-AI 异步识别任务 worker")
+    parser.add_argument("--processes", type=int, default=1, help="worker 进程数")
+    parser.add_argument("--metrics-port", type=int, default=0, help="输出 /metrics 的起始端口（0 表示不输出）")
+    return parser.parse_args()
+
+
+def serve_metrics(port: int):
+    """在后台线程中输出本进程的 Prometheus 指标（任务处理计数、批大小和耗时、推理各阶段耗时）"""
+    from app.core.metrics import metrics
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[INFO] worker {os.getpid()} 指标: http://0.0.0.0:{port}/metrics")
+
+
+async def prepare_database():
+    from app.core.database import engine, init_db
+    await init_db()
+    # fork 之前关闭连接池，子进程各自建立连接
+    await engine.dispose()
+
+
+async def run_worker():
+    from app.services.ai_service import ai_service
+    from app.services.job_worker import job_worker
+
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, job_worker.stop)
+    # 加载（已预加载时跳过）、调优并预热，完成前 worker 不领取任务
+    loader = asyncio.create_task(asyncio.to_thread(ai_service.load_and_warm_up))
+    await job_worker.run()
+    await loader
+
+
+def worker_main(metrics_port: int):
+    if metrics_port:
+        serve_metrics(metrics_port)
+    asyncio.run(run_worker())
+
+
+def main():
+    args = get_args()
+    processes = max(1, args.processes)
+    # 调优时按同机进程数分配线程预算（与 API 服务部署在同一台机器时应另行设置 TORCH_NUM_THREADS）
+    settings.SERVE_WORKERS = processes
+    asyncio.run(prepare_database())
+
+    if processes == 1 or not hasattr(os, "fork"):
+        if processes > 1:
+            print("[WARN] 当前平台不支持 fork，只启动一个 worker")
+        worker_main(args.metrics_port)
+        return
+
+    # fork 前只加载模型、不预热。load() 会以 1 个算子内线程执行量化引擎比较的前向传播：
+    # 单线程时 PyTorch 直接在当前线程执行，不启动 OpenMP 线程池，子进程不会继承失效的线程池状态；
+    # 线程数调优和预热在各子进程中进行
+    from app.services.ai_service import ai_service
+    ai_service.load()
+    gc.freeze()
+
+    children = []
+    for index in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                worker_main(args.metrics_port + index if args.metrics_port else 0)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    print(f"[INFO] 已启动 {len(children)} 个 worker: {children}")
+
+    def shutdown(signum, _frame):
+        for child in children:
+            try:
+                os.kill(child, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for child in children:
+        try:
+            os.waitpid(child, 0)
+        except ChildProcessError:
+            pass
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import asdict
+from datetime import datetime
+from pathlib import Path
+
+# Add backend to sys path for the shared app modules
+sys.path.append(str(Path("backend").resolve()))
+
+BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64]
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+IMAGE_DIRS = [Path("."), Path("backend/uploads")]
+
+TTA_LEVELS = ["flip", "full"]
+
+# Metrics where a larger value is a regression (everything else: smaller is a regression)
+HIGHER_IS_WORSE = ("cold_load_ms", "first_inference_ms", "peak_rss_mb", "p50_ms", "p95_ms", "p99_ms",
+                   *(f"tta_{level}_p50_ms" for level in TTA_LEVELS))
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark every model artifact the AI service can load (CPU only)"
+    )
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--backend", choices=["torch", "onnxruntime"], default=None,
+                        help="Inference backend (default: INFERENCE_BACKEND setting)")
+    parser.add_argument("--iterations", type=int, default=50, help="Single-image latency samples")
+    parser.add_argument("--batch-iterations", type=int, default=3, help="Timed runs per batch size")
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--baseline", help="Previous results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative regression")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def find_images():
+    images = []
+    for directory in IMAGE_DIRS:
+        for path in sorted(directory.glob("*")):
+            if path.suffix.lower() in IMAGE_SUFFIXES:
+                images.append(path)
+    return images
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if platform.system() == "Darwin" else 1024), 1)
+
+
+def run_worker(spec_json, args):
+    """Benchmark one artifact in a fresh process so cold load and peak RSS are isolated"""
+    start = time.perf_counter()
+    import torch
+    from app.services.ai_service import ai_service
+    from app.services.model_registry import ModelSpec
+    import_ms = (time.perf_counter() - start) * 1000
+
+    spec = ModelSpec(**json.loads(spec_json))
+    images = [path.read_bytes() for path in find_images()]
+    if not images:
+        raise RuntimeError("No images found in the repository")
+
+    # Cold load: build the model, then the first (unwarmed) forward pass
+    start = time.perf_counter()
+    handle = ai_service.build_model(spec, backend=args.backend)
+    cold_load_ms = (time.perf_counter() - start) * 1000
+
+    from app.ml.preprocessing import resize_size_for
+    resize_size = resize_size_for(handle.input_size)
+    tensors = [ai_service._preprocess(ai_service._load_image(data, resize_size), handle.input_size) for data in images]
+    start = time.perf_counter()
+    ai_service._forward(tensors[0], handle)
+    first_inference_ms = (time.perf_counter() - start) * 1000
+
+    # Single-image latency: decode + preprocess + forward, same code path as serving
+    for data in images[:3]:
+        ai_service._forward(ai_service._preprocess(ai_service._load_image(data, resize_size), handle.input_size), handle)
+    samples = []
+    for i in range(args.iterations):
+        data = images[i % len(images)]
+        start = time.perf_counter()
+        ai_service._forward(ai_service._preprocess(ai_service._load_image(data, resize_size), handle.input_size), handle)
+        samples.append((time.perf_counter() - start) * 1000)
+
+    # Test-time augmentation: decode + all views + one batched forward, compared with the plain p50
+    from app.ml.preprocessing import tta_views
+    tta = {}
+    for level in TTA_LEVELS:
+        tta_samples = []
+        for i in range(args.iterations):
+            data = images[i % len(images)]
+            start = time.perf_counter()
+            views = tta_views(ai_service._load_image(data, resize_size), level, resize_size, handle.input_size)
+            ai_service._forward(views, handle).mean(dim=0)
+            tta_samples.append((time.perf_counter() - start) * 1000)
+        p50 = percentile(tta_samples, 50)
+        tta[level] = {
+            "views": views.size(0),
+            "p50_ms": round(p50, 2),
+            "p95_ms": round(percentile(tta_samples, 95), 2),
+            "extra_ms": round(p50 - percentile(samples, 50), 2),
+        }
+
+    # Throughput: model forward on preprocessed batches (decode excluded)
+    throughput = {}
+    for batch_size in [b for b in BATCH_SIZES if b <= args.max_batch_size]:
+        batch = torch.stack([tensors[i % len(tensors)] for i in range(batch_size)])
+        ai_service._forward(batch, handle)
+        start = time.perf_counter()
+        for _ in range(args.batch_iterations):
+            ai_service._forward(batch, handle)
+        elapsed = time.perf_counter() - start
+        throughput[str(batch_size)] = round(batch_size * args.batch_iterations / elapsed, 2)
+
+    return {
+        "format": spec.format,
+        "artifact": spec.artifact,
+        "architecture": spec.architecture,
+        "backend": handle.model.name,
+        "import_ms": round(import_ms, 1),
+        "cold_load_ms": round(cold_load_ms, 1),
+        "first_inference_ms": round(first_inference_ms, 1),
+        "latency_ms": {
+            "p50_ms": round(percentile(samples, 50), 2),
+            "p95_ms": round(percentile(samples, 95), 2),
+            "p99_ms": round(percentile(samples, 99), 2),
+            "mean_ms": round(statistics.mean(samples), 2),
+            "samples": len(samples),
+        },
+        "tta_latency_ms": tta,
+        "throughput_images_per_s": throughput,
+        "peak_rss_mb": peak_rss_mb(),
+        "num_threads": torch.get_num_threads(),
+    }
+
+
+def environment():
+    import torch
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    try:
+        import onnxruntime
+        ort_version = onnxruntime.__version__
+    except ImportError:
+        ort_version = None
+    return {
+        "git_commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "onnxruntime": ort_version,
+        "quantized_engine": torch.backends.quantized.engine,
+        "supported_engines": list(torch.backends.quantized.supported_engines),
+    }
+
+
+def flatten(result):
+    metrics = {key: result[key] for key in ("cold_load_ms", "first_inference_ms", "peak_rss_mb")}
+    metrics.update({key: value for key, value in result["latency_ms"].items() if key in HIGHER_IS_WORSE})
+    metrics.update({f"throughput_bs{bs}": value for bs, value in result["throughput_images_per_s"].items()})
+    metrics.update({f"tta_{level}_p50_ms": value["p50_ms"] for level, value in result.get("tta_latency_ms", {}).items()})
+    return metrics
+
+
+def compare(baseline, current, tolerance):
+    regressions = []
+    for version, result in current["artifacts"].items():
+        old = baseline.get("artifacts", {}).get(version)
+        if not old or "error" in old or "error" in result:
+            continue
+        old_metrics, new_metrics = flatten(old), flatten(result)
+        for name, new_value in new_metrics.items():
+            old_value = old_metrics.get(name)
+            if not old_value:
+                continue
+            change = (new_value - old_value) / old_value
+            worse = change > tolerance if name in HIGHER_IS_WORSE else change < -tolerance
+            if worse:
+                regressions.append((version, name, old_value, new_value, change))
+    return regressions
+
+
+def main():
+    args = get_args()
+
+    if args.worker:
+        try:
+            result = run_worker(args.worker, args)
+        except Exception as e:
+            # Report a broken artifact as a result instead of aborting the whole suite
+            message = str(e).strip().splitlines()[0] if str(e).strip() else ""
+            result = {"error": f"{type(e).__name__}: {message[:300]}"}
+        print(json.dumps(result))
+        return
+
+    from app.core.config import settings
+    from app.services.model_registry import model_registry
+
+    model_registry.reload(force=True)
+    specs = model_registry.list()
+    if not specs:
+        print(f"Error: no model artifacts found in {settings.MODEL_DIR}")
+        sys.exit(1)
+    print(f"Images: {len(find_images())}, artifacts: {len(specs)}")
+
+    artifacts = {}
+    for spec in specs:
+        print(f"Benchmarking {spec.version} ({spec.format})...")
+        command = [sys.executable, __file__, "--worker", json.dumps(asdict(spec)),
+                   "--iterations", str(args.iterations), "--batch-iterations", str(args.batch_iterations),
+                   "--max-batch-size", str(args.max_batch_size)]
+        if args.backend:
+            command += ["--backend", args.backend]
+        proc = subprocess.run(command, capture_output=True, text=True)
+        if proc.returncode != 0:
+            error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit code {proc.returncode}"
+            print(f"[ERROR] {spec.version}: {error}")
+            artifacts[spec.version] = {"format": spec.format, "artifact": spec.artifact, "error": error}
+            continue
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        if "error" in result:
+            print(f"[ERROR] {spec.version}: {result['error']}")
+            result = {"format": spec.format, "artifact": spec.artifact, **result}
+        artifacts[spec.version] = result
+
+    results = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment(),
+        "config": {
+            "backend": args.backend or settings.INFERENCE_BACKEND,
+            "iterations": args.iterations,
+            "batch_iterations": args.batch_iterations,
+            "batch_sizes": [b for b in BATCH_SIZES if b <= args.max_batch_size],
+        },
+        "artifacts": artifacts,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+
+    print(f"\n{'artifact':<36} {'backend':>11} {'load_ms':>9} {'p50':>8} {'p95':>8} {'p99':>8} "
+          f"{'tta flip':>9} {'tta full':>9} {'best img/s':>10} {'rss_mb':>8}")
+    for version, result in artifacts.items():
+        if "error" in result:
+            print(f"{version:<36} {'error':>11}")
+            continue
+        latency = result["latency_ms"]
+        best = max(result["throughput_images_per_s"].values())
+        tta = result["tta_latency_ms"]
+        print(f"{version:<36} {result['backend']:>11} {result['cold_load_ms']:>9} {latency['p50_ms']:>8} "
+              f"{latency['p95_ms']:>8} {latency['p99_ms']:>8} {tta['flip']['p50_ms']:>9} {tta['full']['p50_ms']:>9} "
+              f"{best:>10} {result['peak_rss_mb']:>8}")
+    print(f"\nSaved results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.tolerance)
+        if regressions:
+            print(f"\n[FAIL] {len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for version, name, old_value, new_value, change in regressions:
+                print(f"  {version} {name}: {old_value} -> {new_value} ({change:+.1%})")
+            sys.exit(1)
+        print(f"\n[PASS] No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
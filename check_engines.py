@@ -1,4 +1,59 @@
+"""
+Report the quantized engines and thread budget the server's startup tuner works with.
+
+Usage:
+    python check_engines.py                  # supported engines, default engine, CPU / thread budget
+    python check_engines.py --workers 4      # thread budget per worker with 4 co-located workers
+    python check_engines.py --tune           # also benchmark engines x threads on the active model
+"""
+import argparse
+import sys
+from pathlib import Path
 
 import torch
-print(f"Supported Engines: {torch.backends.quantized.supported_engines}")
-print(f"Current Engine: {torch.backends.quantized.engine}")
+
+# Add backend to sys path for the shared tuning helpers
+sys.path.append(str(Path(__file__).resolve().parent / "backend"))
+from app.ml import tuning
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Quantized engine / thread check")
+    parser.add_argument("--workers", type=int, default=1, help="Number of co-located server workers")
+    parser.add_argument("--tune", action="store_true", help="Run the startup tuner on the active model")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    print(f"Supported Engines: {torch.backends.quantized.supported_engines}")
+    print(f"Current Engine: {torch.backends.quantized.engine}")
+    print(f"Default Engine: {tuning.default_engine()}")
+    budget = tuning.thread_budget(args.workers)
+    print(f"CPUs: {tuning.cpu_count()}, workers: {args.workers}, thread budget per worker: {budget}")
+    print(f"Thread candidates: {tuning.thread_candidates(budget)}")
+
+    if not args.tune:
+        return
+
+    from app.core.config import settings
+    from app.services.ai_service import ai_service
+
+    settings.SERVE_WORKERS = args.workers
+    settings.AUTOTUNE_ENABLED = True
+    ai_service.load()
+    ai_service.tune()
+    result = ai_service.readiness()["tuning"]
+    print(f"\nModel: {ai_service.model_version} (batch size {result['batch_size']})")
+    if result["engine_candidates"]:
+        print(f"{'engine':<10} {'threads':>8} {'latency_ms':>11}  (engine comparison at load time)")
+        for item in result["engine_candidates"]:
+            print(f"{item['engine']:<10} {item['threads']:>8} {item['latency_ms']:>11}")
+    print(f"{'engine':<10} {'threads':>8} {'latency_ms':>11}")
+    for item in result["candidates"]:
+        print(f"{item['engine'] or '-':<10} {item['threads']:>8} {item['latency_ms']:>11}")
+    print(f"Selected: engine={result['quantized_engine']} threads={result['num_threads']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+# Add backend to sys path for the shared app modules
+sys.path.append(str(Path("backend").resolve()))
+from PIL import Image
+from app.core.config import settings
+from app.ml.backends import OnnxRuntimeBackend
+from app.ml.preprocessing import normalize, to_uint8_tensor
+from app.services.ai_service import ai_service
+from app.services.model_registry import QUANTIZED_FORMATS, ModelSpec, artifact_version, model_registry
+
+PARITY_TOLERANCE = 1e-4
+LATENCY_BATCH_SIZES = [1, 8]
+LATENCY_ITERATIONS = 20
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Export a registered model to ONNX and compare it against PyTorch")
+    parser.add_argument("--version", help="Registry version to export (default: active version)")
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--register", action="store_true", help="Add the ONNX artifact to the model registry")
+    parser.add_argument("--skip-latency", action="store_true")
+    return parser.parse_args()
+
+
+def export(module, output_path, input_size, classes, opset):
+    import json
+    import onnx
+
+    dummy = torch.randn(1, 3, input_size, input_size)
+    torch.onnx.export(
+        module,
+        dummy,
+        str(output_path),
+        input_names=["input"],
+        output_names=["logits"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=opset,
+        dynamo=False,
+    )
+
+    # Store class names so the ONNX file is self-describing (like the ResNet checkpoint)
+    model = onnx.load(str(output_path))
+    entry = model.metadata_props.add()
+    entry.key = "classes"
+    entry.value = json.dumps(classes, ensure_ascii=False)
+    onnx.checker.check_model(model)
+    onnx.save(model, str(output_path))
+
+
+def load_parity_images(input_size):
+    """Repo images plus a random batch, as uint8 tensors"""
+    tensors, names = [], []
+    for path in sorted(Path(".").glob("*.jp*g")):
+        image = Image.open(path).convert("RGB")
+        tensors.append(to_uint8_tensor(image, resize_size=input_size * 256 // 224, crop_size=input_size))
+        names.append(path.name)
+    generator = torch.Generator().manual_seed(0)
+    for i in range(8):
+        tensors.append(torch.randint(0, 256, (3, input_size, input_size), dtype=torch.uint8, generator=generator))
+        names.append(f"random_{i}")
+    return torch.stack(tensors), names
+
+
+def check_parity(torch_backend, onnx_backend, input_size):
+    batch, names = load_parity_images(input_size)
+    inputs = normalize(batch)
+    torch_probs = torch.softmax(torch_backend(inputs), dim=1)
+    onnx_probs = torch.softmax(onnx_backend(inputs), dim=1)
+
+    ok = True
+    for i, name in enumerate(names):
+        diff = (torch_probs[i] - onnx_probs[i]).abs().max().item()
+        same_top1 = torch_probs[i].argmax().item() == onnx_probs[i].argmax().item()
+        passed = diff <= PARITY_TOLERANCE and same_top1
+        ok = ok and passed
+        print(f"[{'PASS' if passed else 'FAIL'}] {name}: max prob diff {diff:.2e}, top-1 {'match' if same_top1 else 'MISMATCH'}")
+    return ok
+
+
+def measure_latency(backend, batch_size, input_size):
+    inputs = normalize(torch.randint(0, 256, (batch_size, 3, input_size, input_size), dtype=torch.uint8))
+    for _ in range(3):
+        backend(inputs)
+    timings = []
+    for _ in range(LATENCY_ITERATIONS):
+        start = time.perf_counter()
+        backend(inputs)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    args = get_args()
+    model_registry.reload(force=True)
+    version = args.version or model_registry.active_version
+    if version is None:
+        print(f"Error: no model found in {settings.MODEL_DIR}")
+        sys.exit(1)
+    spec = model_registry.get(version)
+    if spec.format in QUANTIZED_FORMATS:
+        # 量化算子没有对应的 ONNX 实现：改为导出注册表中的浮点模型（例如级联的教师模型 ResNet50），
+        # 导出结果作为独立版本登记（--register），需要单独激活
+        fallback = next((s for s in model_registry.list() if s.format == "resnet50_checkpoint"), None)
+        if fallback is None:
+            print(f"Error: {spec.version} is quantized ({spec.format}) and the registry has no float model to export")
+            sys.exit(1)
+        print(f"{spec.version} is quantized ({spec.format}); exporting the float model {fallback.version} instead")
+        spec = fallback
+    print(f"Exporting {spec.version} ({spec.format}, {spec.artifact})")
+
+    handle = ai_service.build_model(spec, backend="torch")
+    torch_backend = handle.model
+    classes = [handle.class_mapping[str(i)] for i in range(len(handle.class_mapping))]
+
+    output_path = (settings.MODEL_DIR / spec.artifact).with_suffix(".onnx")
+    try:
+        export(torch_backend.module, output_path, spec.input_size, classes, args.opset)
+    except Exception as e:
+        # 量化模型已在上面换成浮点模型，这里是浮点模型本身导出失败
+        print(f"Error: ONNX export failed for {spec.format}: {e}")
+        sys.exit(1)
+    print(f"Saved ONNX model to {output_path}")
+
+    onnx_backend = OnnxRuntimeBackend(output_path, intra_op_threads=settings.ONNX_INTRA_OP_THREADS)
+
+    print("\nParity check (PyTorch vs ONNX Runtime):")
+    parity_ok = check_parity(torch_backend, onnx_backend, spec.input_size)
+
+    if not args.skip_latency:
+        print("\nLatency comparison (median ms):")
+        print(f"{'batch':>6} {torch_backend.name:>12} {'onnxruntime':>12} {'speedup':>8}")
+        for batch_size in LATENCY_BATCH_SIZES:
+            torch_ms = measure_latency(torch_backend, batch_size, spec.input_size)
+            onnx_ms = measure_latency(onnx_backend, batch_size, spec.input_size)
+            print(f"{batch_size:>6} {torch_ms:>12.2f} {onnx_ms:>12.2f} {torch_ms / onnx_ms:>7.2f}x")
+
+    if not parity_ok:
+        print("\nParity check failed, not registering the ONNX model")
+        sys.exit(1)
+
+    if args.register:
+        onnx_spec = ModelSpec(
+            version=artifact_version(output_path),
+            artifact=output_path.name,
+            format="onnx",
+            architecture=spec.architecture,
+            class_mapping=spec.class_mapping,
+            input_size=spec.input_size,
+        )
+        model_registry.register(onnx_spec)
+        print(f"\nRegistered {onnx_spec.version} in {model_registry.path}")
+
+
+if __name__ == "__main__":
+    main()
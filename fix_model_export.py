@@ -2,13 +2,18 @@
 import torch
 import torch.nn as nn
 from torchvision.models.quantization import mobilenet_v3_large
-from torchvision import datasets, transforms
+from torchvision import datasets
 from torch.utils.data import DataLoader
 import os
 import json
 import sys
 from pathlib import Path
 
+# Add backend to sys path for the shared preprocessing module
+sys.path.append(str(Path("backend").resolve()))
+from app.ml.preprocessing import normalize, to_uint8_tensor
+from app.ml.tuning import default_engine
+
 
 def get_quantizable_model(num_classes):
     # Instantiate Quantizable MobileNetV3
@@ -24,7 +29,7 @@ def fix_model_advanced():
     print("Starting Advanced Model Fix (Fusion + Calibration)...")
     
     # 1. Setup
-    backend = 'onednn' # Matches Windows CPU
+    backend = default_engine()  # First supported engine for this platform
     torch.backends.quantized.engine = backend
     print(f"Engine: {backend}")
     
@@ -70,22 +75,15 @@ def fix_model_advanced():
         print("Error: content of data dir missing or not found")
         return
 
-    # Use standard transform
-    transform = transforms.Compose([
-        transforms.Resize(256),
-        transforms.CenterCrop(224),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-    ])
-    
-    dataset = datasets.ImageFolder(str(data_dir), transform=transform)
+    # Same preprocessing as serving: uint8 resize/crop, batched normalization
+    dataset = datasets.ImageFolder(str(data_dir), transform=to_uint8_tensor)
     # Use smaller subset for speed? No, run full or partial.
     # Run 50 batches is enough for calibration
     loader = DataLoader(dataset, batch_size=16, shuffle=True)
     
     print(f"Dataset size: {len(dataset)}")
     
-    device = torch.device('cpu') # QAT on CPU for safety with onednn
+    device = torch.device('cpu') # QAT calibration on CPU
     model.to(device)
     
     # We don't need to optimize, just Forward pass to update observers
@@ -93,7 +91,7 @@ def fix_model_advanced():
         count = 0
         max_batches = 50
         for images, _ in loader:
-            images = images.to(device)
+            images = normalize(images.to(device))
             model(images)
             count += 1
             if count >= max_batches:
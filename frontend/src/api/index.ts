@@ -14,9 +14,24 @@ export const predictApi = {
   },
 }
 
+// 历史记录查询参数：偏移分页 (skip) 或游标分页 (cursor = 上一页响应头 x-next-cursor)
+export interface HistoryQuery {
+  skip?: number
+  limit?: number
+  cursor?: string
+  predicted_class?: string
+  crop?: string
+  status?: string
+  keyword?: string
+  start_date?: string
+  end_date?: string
+  min_confidence?: number
+  max_confidence?: number
+}
+
 // 历史记录接口
 export const historyApi = {
-  list: (params?: { skip?: number; limit?: number }) => api.get('/history', { params }),
+  list: (params?: HistoryQuery) => api.get('/history', { params }),
   detail: (id: number) => api.get(`/history/${id}`),
   delete: (id: number) => api.delete(`/history/${id}`),
   batchDelete: (ids: number[]) => api.delete('/history/batch', { data: { ids } }),
@@ -17,7 +17,13 @@ export interface PredictionRecord {
   image_path: string
   predicted_class: string
   confidence: number
+  crop?: string | null
+  disease?: string | null
+  is_healthy?: boolean | null
+  model_version?: string | null
   created_at: string
+  thumbnail_url: string
+  preview_url: string
 }
 
 // 统计数据
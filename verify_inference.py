@@ -18,6 +18,7 @@ try:
     print(f"Testing Inference with Engine: {torch.backends.quantized.engine}")
     
     from app.services.ai_service import ai_service
+    ai_service.load_and_warm_up()
     
     # Force reload model just in case (the import instantiates it, so it should have the engine set)
     # Check engine again
@@ -7,18 +7,21 @@ backend_path = Path("backend").resolve()
 sys.path.append(str(backend_path))
 
 from app.services.ai_service import ai_service as aiservice
+aiservice.load()
 
 try:
     print(f"Checking Model Loading...")
-    model = aiservice._model
+    model = aiservice._active.model
     if model is None:
         print("[ERROR] Model is None!")
         sys.exit(1)
         
-    print(f"[SUCCESS] Model loaded: {type(model)}")
+    print(f"[SUCCESS] Model loaded: {aiservice.model_version} ({aiservice.backend_name})")
     
-    if hasattr(model, 'code'): # Check if it is a scripted/JIT model
+    if model.name == "torchscript": # Check if it is a scripted/JIT model
          print("[INFO] Model is TorchScript/JIT.")
+    elif model.name == "onnxruntime":
+         print("[INFO] Model is ONNX Runtime session.")
     else:
          print("[INFO] Model is Standard PyTorch Module.")
 